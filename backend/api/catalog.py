@@ -0,0 +1,118 @@
+import gzip
+import hashlib
+
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+
+from rest_framework.renderers import JSONRenderer
+
+from api.utils import get_catalog_version
+from recipes.models import Ingredient, Tag
+
+
+CATALOG_FIELDS = {
+    Tag: ("id", "name", "color", "slug"),
+    Ingredient: ("id", "name", "measurement_unit"),
+}
+CATALOG_MODELS = {"tags": Tag, "ingredients": Ingredient}
+
+
+class Catalog:
+    """
+    Справочник, заранее сериализованный в JSON и сжатый gzip.
+
+    Хранится в памяти процесса до смены версии справочника. ETag
+    считается по содержимому, Last-Modified берется из версии.
+    """
+
+    def __init__(self, name, version):
+        """Загружает справочник name из БД и сериализует его."""
+        model = CATALOG_MODELS[name]
+        self.version = version
+        self.data = list(model.objects.values(*CATALOG_FIELDS[model]))
+        self.body = JSONRenderer().render(self.data)
+        self.gzip_body = gzip.compress(self.body)
+        self.etag = f'W/"{hashlib.md5(self.body).hexdigest()}"'
+        self.last_modified = int(version)
+
+    def by_id(self):
+        """Возвращает словарь id -> запись справочника."""
+        return {item["id"]: item for item in self.data}
+
+    def response(self, request):
+        """
+        Возвращает готовый ответ со справочником или 304, если у клиента
+        уже есть актуальная версия.
+        """
+        response = HttpResponse(content_type="application/json")
+        response["ETag"] = self.etag
+        response["Last-Modified"] = http_date(self.last_modified)
+        patch_vary_headers(response, ("Accept-Encoding",))
+        conditional = get_conditional_response(
+            request,
+            etag=self.etag,
+            last_modified=self.last_modified,
+            response=response,
+        )
+        if conditional is not response:
+            return conditional
+        if "gzip" in request.META.get("HTTP_ACCEPT_ENCODING", ""):
+            response.content = self.gzip_body
+            response["Content-Encoding"] = "gzip"
+        else:
+            response.content = self.body
+        return response
+
+
+_catalogs = {}
+
+
+def get_catalog(name):
+    """
+    Возвращает справочник текущего процесса, загружая его заново,
+    если версия справочника изменилась.
+    """
+    version = get_catalog_version(name)
+    catalog = _catalogs.get(name)
+    if catalog is None or catalog.version != version:
+        catalog = _catalogs[name] = Catalog(name, version)
+    return catalog
+
+
+def get_tag_choices():
+    """Возвращает варианты выбора тегов по слагу для фильтров."""
+    return [(tag["slug"], tag["name"]) for tag in get_catalog("tags").data]
+
+
+_tag_bits = {"version": None, "bits": {}}
+
+
+def get_tag_masks(slugs):
+    """
+    Возвращает маску тегов со слагами slugs для Recipe.tags_mask. Биты
+    тегов хранятся в памяти процесса до смены версии справочника тегов.
+    """
+    version = get_catalog_version("tags")
+    if _tag_bits["version"] != version:
+        _tag_bits["bits"] = dict(Tag.objects.values_list("slug", "bit"))
+        _tag_bits["version"] = version
+    mask = 0
+    for slug in slugs:
+        mask |= 1 << _tag_bits["bits"][slug]
+    return mask
+
+
+class CatalogListMixin:
+    """
+    Отдает список справочника из кэша процесса, если в запросе нет
+    параметров фильтрации и клиент ожидает JSON.
+    """
+
+    catalog_name = None
+
+    def list(self, request, *args, **kwargs):
+        renderer, _ = self.perform_content_negotiation(request)
+        if request.query_params or renderer.format != "json":
+            return super().list(request, *args, **kwargs)
+        return get_catalog(self.catalog_name).response(request)
@@ -1,47 +1,133 @@
+from django.contrib.postgres.search import TrigramWordSimilarity
+from django.db import connection
+from django.db.models import (
+    Case,
+    Exists,
+    F,
+    IntegerField,
+    OuterRef,
+    Q,
+    Value,
+    When,
+)
+
 from django_filters import rest_framework
 
-from recipes.models import Ingredient, Recipe, Tag
+from api.catalog import get_tag_choices, get_tag_masks
+from api.search import search_recipes
+from foodgram.constants import SEARCH_RESULTS_LIMIT
+from recipes.models import FavoriteRecipe, Ingredient, Recipe, ShoppingList
 
 
 class IngredientFilter(rest_framework.FilterSet):
-    """Фильтр для поиска ингредиентов по имени."""
+    """
+    Фильтр для поиска ингредиентов по началу имени и ранжированного
+    поиска с учетом вхождений и опечаток.
+
+    На PostgreSQL вхождение ищется по триграммному индексу UPPER(name),
+    а опечатки - оператором %> по триграммному индексу name с порогом
+    pg_trgm.word_similarity_threshold (0.6 по умолчанию).
+    """
 
     name = rest_framework.CharFilter(lookup_expr="istartswith")
+    search = rest_framework.CharFilter(method="get_search")
 
     class Meta:
         model = Ingredient
-        fields = ["name"]
+        fields = ["name", "search"]
+
+    def get_search(self, queryset, name, value):
+        value = value.strip()
+        matches = Q(name__icontains=value)
+        order = ["rank", "name"]
+        if connection.vendor == "postgresql":
+            queryset = queryset.annotate(
+                similarity=TrigramWordSimilarity(value, "name"))
+            matches |= Q(name__trigram_word_similar=value)
+            order = ["rank", "-similarity", "name"]
+        return queryset.filter(matches).annotate(
+            rank=Case(
+                When(name__istartswith=value, then=Value(0)),
+                When(name__icontains=f" {value}", then=Value(1)),
+                default=Value(2),
+                output_field=IntegerField(),
+            )
+        ).order_by(*order)[:SEARCH_RESULTS_LIMIT]
 
 
 class RecipeFilter(rest_framework.FilterSet):
     """
     Фильтр для поиска рецептов с возможностью фильтрации по автору, тегам,
     избранным и добавленным в корзину.
+
+    Теги проверяются по маске тегов самого рецепта, а избранное и список
+    покупок - подзапросами EXISTS, а не соединениями, поэтому рецепт
+    попадает в выдачу один раз без DISTINCT и сохраняется порядок по
+    индексу recipe_name_id.
     """
 
-    author = rest_framework.CharFilter()
-    tags = rest_framework.ModelMultipleChoiceFilter(
-        field_name="tags__slug",
-        queryset=Tag.objects.all(),
+    author = rest_framework.NumberFilter(field_name="author_id")
+    tags = rest_framework.MultipleChoiceFilter(
+        choices=get_tag_choices,
+        method="get_tags",
         label="Tags",
-        to_field_name="slug",
+    )
+    tags_all = rest_framework.MultipleChoiceFilter(
+        choices=get_tag_choices,
+        method="get_tags_all",
+        label="All tags",
     )
     is_favorited = rest_framework.BooleanFilter(method="get_is_favorited")
     is_in_shopping_cart = rest_framework.BooleanFilter(
         method="get_is_in_shopping_cart")
+    search = rest_framework.CharFilter(method="get_search")
 
     class Meta:
         model = Recipe
-        fields = ("tags", "author", "is_favorited", "is_in_shopping_cart")
+        fields = (
+            "tags", "tags_all", "author", "is_favorited",
+            "is_in_shopping_cart", "search",
+        )
+
+    def get_tags(self, queryset, name, value):
+        """Оставляет рецепты хотя бы с одним из тегов."""
+        if not value:
+            return queryset
+        return queryset.alias(
+            tag_bits=F("tags_mask").bitand(get_tag_masks(value))
+        ).exclude(tag_bits=0)
+
+    def get_tags_all(self, queryset, name, value):
+        """Оставляет рецепты со всеми перечисленными тегами."""
+        if not value:
+            return queryset
+        mask = get_tag_masks(value)
+        return queryset.alias(
+            tag_bits=F("tags_mask").bitand(mask)
+        ).filter(tag_bits=mask)
 
     def get_is_favorited(self, queryset, name, value):
-        if value:
-            return queryset.filter(
-                favorite__user=self.request.user)
-        return queryset
+        return self.filter_user_list(queryset, FavoriteRecipe, value)
 
     def get_is_in_shopping_cart(self, queryset, name, value):
-        if value:
-            return queryset.filter(
-                shopping_list_recipe__user=self.request.user)
-        return queryset
+        return self.filter_user_list(queryset, ShoppingList, value)
+
+    def filter_user_list(self, queryset, model, value):
+        """
+        Оставляет рецепты из избранного или списка покупок текущего
+        пользователя. У анонимного пользователя таких рецептов нет.
+        """
+        if not value:
+            return queryset
+        user = self.request.user
+        if user.is_anonymous:
+            return queryset.none()
+        return queryset.filter(Exists(model.objects.filter(
+            user=user, recipe_id=OuterRef("pk"))))
+
+    def get_search(self, queryset, name, value):
+        """
+        Ищет рецепты по названию, описанию и ингредиентам с учетом
+        словоформ и сортирует их по релевантности.
+        """
+        return search_recipes(queryset, value)
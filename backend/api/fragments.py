@@ -0,0 +1,174 @@
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+from api.serializers import (
+    CustomUserSerializer,
+    RecipeFragmentSerializer,
+    RecipeViewingSerializer,
+)
+from api.utils import get_catalog_version, get_following_ids
+from foodgram.constants import RECIPE_FRAGMENT_TIMEOUT, RECIPE_FRAGMENT_VERSION
+from recipes.models import Recipe
+
+
+USER_FLAGS = ("is_favorited", "is_in_shopping_cart")
+
+
+def fragment_key(recipe_id, version, catalog_versions):
+    """
+    Возвращает ключ кэша общего представления рецепта. В ключ входят
+    версия самого рецепта и версии тегов и ингредиентов, поэтому
+    изменение рецепта или справочника делает устаревшим представление
+    без удаления из кэша.
+    """
+    return (
+        f"recipe:{RECIPE_FRAGMENT_VERSION}:"
+        f"{catalog_versions[0]}:{catalog_versions[1]}:{recipe_id}:{version}"
+    )
+
+
+def version_key(recipe_id):
+    """Возвращает ключ кэша версии представления рецепта."""
+    return f"recipe_version:{recipe_id}"
+
+
+def get_recipe_versions(recipe_ids):
+    """
+    Возвращает версии представлений рецептов. Версия - время последнего
+    изменения рецепта; у рецепта без версии в кэше она заводится, так
+    что после вытеснения версии из кэша старое представление не
+    читается.
+    """
+    keys = {version_key(recipe_id): recipe_id for recipe_id in recipe_ids}
+    versions = {
+        keys[key]: version for key, version in cache.get_many(keys).items()
+    }
+    for key, recipe_id in keys.items():
+        if recipe_id not in versions:
+            cache.add(key, time.time(), timeout=None)
+            versions[recipe_id] = cache.get(key)
+    return versions
+
+
+def get_catalog_versions():
+    """Возвращает версии тегов и ингредиентов для ключа представления."""
+    return get_catalog_version("tags"), get_catalog_version("ingredients")
+
+
+def get_recipe_fragments(recipe_ids):
+    """
+    Возвращает общие для всех пользователей представления рецептов.
+
+    Представления берутся из кэша, а отсутствующие строятся одним
+    набором запросов и кладутся в кэш.
+
+        Параметры:
+            recipe_ids (list): id рецептов.
+
+        Возвращает:
+            dict: id рецепта -> представление без признаков пользователя.
+
+    """
+    # Версии читаются до рецептов: представление, собранное из строк,
+    # которые успели измениться, попадет под уже устаревшую версию.
+    versions = get_catalog_versions()
+    recipe_versions = get_recipe_versions(recipe_ids)
+    keys = {
+        recipe_id: fragment_key(recipe_id, version, versions)
+        for recipe_id, version in recipe_versions.items()
+    }
+    cached = cache.get_many(keys.values())
+    fragments = {
+        recipe_id: cached[key]
+        for recipe_id, key in keys.items() if key in cached
+    }
+    missing = [
+        recipe_id for recipe_id in recipe_ids if recipe_id not in fragments
+    ]
+    if missing:
+        built = {
+            fragment["id"]: fragment
+            for fragment in RecipeFragmentSerializer(
+                Recipe.objects.with_related().filter(id__in=missing),
+                many=True,
+            ).data
+        }
+        cache.set_many(
+            {
+                keys[recipe_id]: fragment
+                for recipe_id, fragment in built.items()
+            },
+            timeout=RECIPE_FRAGMENT_TIMEOUT,
+        )
+        fragments.update(built)
+    return fragments
+
+
+def invalidate_recipe_fragments(recipe_ids):
+    """
+    Меняет версии представлений рецептов после фиксации транзакции.
+    Запрос, прочитавший рецепт до фиксации, кладет представление под
+    старой версией, которую уже никто не читает.
+    """
+    recipe_ids = list(recipe_ids)
+    if recipe_ids:
+        transaction.on_commit(lambda: cache.set_many(
+            {version_key(recipe_id): time.time() for recipe_id in recipe_ids},
+            timeout=None,
+        ))
+
+
+def serialize_recipes(recipes, request):
+    """
+    Собирает ответ RecipeViewingSerializer из кэшированных общих
+    представлений и признаков текущего пользователя.
+
+        Параметры:
+            recipes (list): Рецепты с аннотациями is_favorited
+                и is_in_shopping_cart.
+            request (Request): Объект текущего запроса.
+
+        Возвращает:
+            list: Рецепты в формате RecipeViewingSerializer.
+
+    """
+    fragments = get_recipe_fragments([recipe.id for recipe in recipes])
+    following_ids = get_following_ids(request)
+    result = []
+    for recipe in recipes:
+        fragment = fragments.get(recipe.id)
+        if fragment is None:
+            continue
+        data = {}
+        for field in RecipeViewingSerializer.Meta.fields:
+            if field in USER_FLAGS:
+                data[field] = getattr(recipe, field)
+            elif field == "author":
+                data[field] = serialize_author(
+                    fragment[field], recipe.author_id in following_ids)
+            elif field == "image":
+                data[field] = fragment[field] and request.build_absolute_uri(
+                    fragment[field])
+            elif field == "image_variants":
+                data[field] = {
+                    label: {
+                        extension: request.build_absolute_uri(url)
+                        for extension, url in formats.items()
+                    }
+                    for label, formats in fragment[field].items()
+                }
+            else:
+                data[field] = fragment[field]
+        result.append(data)
+    return result
+
+
+def serialize_author(author, is_subscribed):
+    """Добавляет к представлению автора признак подписки на него."""
+    return {
+        field: is_subscribed if field == "is_subscribed" else author[field]
+        for field in CustomUserSerializer.Meta.fields
+        if field != "password"
+    }
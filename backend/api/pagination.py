@@ -1,6 +1,18 @@
+import base64
+import binascii
+import json
+from collections import OrderedDict
+
+from django.db.models import Q
+
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
-from foodgram.constants import PAGE_SIZE
+from api.utils import estimate_count
+from foodgram.constants import MAX_PAGE_SIZE, PAGE_SIZE
+from recipes.models import FeedEntry
 
 
 class PageSizePagination(PageNumberPagination):
@@ -8,3 +20,149 @@ class PageSizePagination(PageNumberPagination):
 
     page_size = PAGE_SIZE
     page_size_query_param = "limit"
+    max_page_size = MAX_PAGE_SIZE
+
+
+class CursorPageSizePagination(PageSizePagination):
+    """
+    Пагинатор, который по запросу клиента переходит на курсоры.
+
+    Без параметра cursor работает как PageSizePagination. С параметром
+    cursor (пустым для первой страницы) выбирает страницу по значениям
+    полей сортировки последней записи, без OFFSET и без COUNT(*).
+    Сортировка берется из queryset и должна заканчиваться уникальным
+    полем. Формат ответа тот же; count равен null, если клиент не
+    запросил count=exact или count=estimate.
+    """
+
+    cursor_query_param = "cursor"
+    count_query_param = "count"
+    invalid_cursor_message = "Неверный курсор."
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_mode = self.cursor_query_param in request.query_params
+        if not self.cursor_mode:
+            return super().paginate_queryset(queryset, request, view)
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        ordering = self.get_ordering(queryset)
+        self.ordering = [field.lstrip("-") for field in ordering]
+        self.descending = [field.startswith("-") for field in ordering]
+        reverse, position = self.decode_cursor(request)
+        self.count = self.get_count(queryset, request)
+        if position is not None:
+            queryset = queryset.filter(self.position_filter(position, reverse))
+        if reverse:
+            queryset = queryset.reverse()
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        self.results = results
+        return results
+
+    def get_ordering(self, queryset):
+        ordering = queryset.query.order_by or queryset.model._meta.ordering
+        if not ordering or ordering[-1].lstrip("-") not in ("id", "pk"):
+            raise ValueError(
+                "Для курсорной пагинации сортировка должна "
+                "заканчиваться полем id."
+            )
+        return ordering
+
+    def get_count(self, queryset, request):
+        count = request.query_params.get(self.count_query_param)
+        if count == "exact":
+            return queryset.count()
+        if count == "estimate":
+            return estimate_count(queryset)
+        return None
+
+    def position_filter(self, position, reverse):
+        """
+        Строит условие «запись идет после position» для сортировки
+        из нескольких полей: (a > x) OR (a = x AND b > y) и т.д.
+        """
+        condition = Q()
+        equal = {}
+        for field, descending, value in zip(
+                self.ordering, self.descending, position):
+            lookup = "lt" if descending != reverse else "gt"
+            condition |= Q(**equal, **{f"{field}__{lookup}": value})
+            equal[field] = value
+        return condition
+
+    def decode_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return False, None
+        try:
+            reverse, position = json.loads(
+                base64.urlsafe_b64decode(cursor.encode()))
+        except (TypeError, ValueError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        if (not isinstance(position, list)
+                or len(position) != len(self.ordering)):
+            raise NotFound(self.invalid_cursor_message)
+        return bool(reverse), position
+
+    def encode_cursor(self, reverse, item):
+        position = [getattr(item, field) for field in self.ordering]
+        cursor = base64.urlsafe_b64encode(
+            json.dumps([reverse, position], default=str).encode()).decode()
+        url = remove_query_param(
+            self.request.build_absolute_uri(), self.page_query_param)
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_next_link(self):
+        if not self.cursor_mode:
+            return super().get_next_link()
+        if not self.has_next or not self.results:
+            return None
+        return self.encode_cursor(False, self.results[-1])
+
+    def get_previous_link(self):
+        if not self.cursor_mode:
+            return super().get_previous_link()
+        if not self.has_previous or not self.results:
+            return None
+        return self.encode_cursor(True, self.results[0])
+
+    def get_paginated_response(self, data):
+        if not self.cursor_mode:
+            return super().get_paginated_response(data)
+        return Response(OrderedDict([
+            ("count", self.count),
+            ("next", self.get_next_link()),
+            ("previous", self.get_previous_link()),
+            ("results", data),
+        ]))
+
+
+class FeedPagination(CursorPageSizePagination):
+    """
+    Курсорный пагинатор ленты подписок. Страница выбирается из ленты
+    пользователя, а queryset используется только для загрузки рецептов
+    по id. Переход возможен только вперед.
+    """
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_mode = True
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = ["pub_date", "id"]
+        reverse, position = self.decode_cursor(request)
+        if reverse:
+            raise NotFound(self.invalid_cursor_message)
+        self.count = None
+        ids = FeedEntry.objects.page(
+            request.user, before=position, limit=self.page_size + 1)
+        self.has_next = len(ids) > self.page_size
+        self.has_previous = False
+        recipes = queryset.in_bulk(ids[:self.page_size])
+        self.results = [recipes[pk] for pk in ids if pk in recipes]
+        return self.results
@@ -0,0 +1,32 @@
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+
+class TextRenderer(BaseRenderer):
+    """
+    Рендерер текстовых файлов. Файлы отдаются потоком из представления,
+    поэтому рендерер нужен для выбора формата и для ответов с ошибками.
+    """
+
+    media_type = "text/plain"
+    format = "txt"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict):
+            data = "\n".join(f"{key}: {value}" for key, value in data.items())
+        return str(data).encode(self.charset or "utf-8")
+
+
+class CSVRenderer(TextRenderer):
+    media_type = "text/csv"
+    format = "csv"
+
+
+class PDFRenderer(TextRenderer):
+    media_type = "application/pdf"
+    format = "pdf"
+    charset = None
+
+
+SHOPPING_LIST_RENDERERS = (
+    TextRenderer, CSVRenderer, JSONRenderer, PDFRenderer)
@@ -0,0 +1,317 @@
+import math
+import re
+import unicodedata
+from array import array
+from bisect import bisect_left
+from collections import Counter
+
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    SearchVector,
+)
+from django.db import connections, transaction
+from django.db.models import Case, FloatField, Value, When
+
+import snowballstemmer
+
+from api.utils import bump_catalog_version, get_catalog_version
+from foodgram.constants import (
+    SEARCH_CONFIG,
+    SEARCH_RESULTS_LIMIT,
+    TRIGRAM_SIMILARITY,
+)
+from recipes.models import Ingredient, Recipe
+
+
+WORD_START = re.compile(r"(?:^|(?<=[\s\-(,.]))\w", re.UNICODE)
+WORD = re.compile(r"\w+", re.UNICODE)
+PREFIX_RANK = 0
+WORD_RANK = 1
+FUZZY_RANK = 2
+
+
+def fold(value):
+    """
+    Приводит строку к виду для сравнения без учета регистра:
+    нормализует Unicode, выполняет casefold и заменяет "ё" на "е".
+    """
+    return unicodedata.normalize(
+        "NFKC", value).casefold().replace("ё", "е").strip()
+
+
+def trigrams(value):
+    """
+    Возвращает множество триграмм строки так же, как pg_trgm:
+    каждое слово дополняется двумя пробелами слева и одним справа.
+    """
+    result = set()
+    for word in WORD.findall(value):
+        padded = f"  {word} "
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+class IngredientIndex:
+    """
+    Индекс каталога ингредиентов в памяти процесса.
+
+    Хранит отсортированный список ключей: приведенное наименование
+    целиком и его хвосты с начала каждого следующего слова. Поиск по
+    префиксу выполняется двоичным поиском, совпадения с начала
+    наименования идут раньше совпадений с начала слова. Для поиска
+    с опечатками по требованию строится триграммный индекс.
+    """
+
+    def __init__(self, ingredients, version=None):
+        """Строит индекс по тройкам (id, наименование, единица)."""
+        self.version = version
+        self.ingredients = []
+        self.folded = []
+        self._postings = None
+        entries = []
+        for position, (pk, name, measurement_unit) in enumerate(ingredients):
+            folded = fold(name)
+            self.ingredients.append(
+                {"id": pk, "name": name, "measurement_unit": measurement_unit}
+            )
+            self.folded.append(folded)
+            for match in WORD_START.finditer(folded):
+                start = match.start()
+                entries.append((
+                    folded[start:],
+                    PREFIX_RANK if start == 0 else WORD_RANK,
+                    position,
+                ))
+        entries.sort()
+        self.keys = [key for key, _, _ in entries]
+        self.entries = [(rank, position) for _, rank, position in entries]
+
+    @classmethod
+    def from_db(cls, version=None):
+        return cls(
+            Ingredient.objects.order_by("name").values_list(
+                "id", "name", "measurement_unit").iterator(),
+            version=version,
+        )
+
+    @property
+    def postings(self):
+        """Триграмма -> позиции ингредиентов, в названии которых она есть."""
+        if self._postings is None:
+            postings = {}
+            for position, folded in enumerate(self.folded):
+                for trigram in trigrams(folded):
+                    postings.setdefault(trigram, array("I")).append(position)
+            self._postings = postings
+        return self._postings
+
+    def matches(self, query):
+        """Возвращает словарь позиция ингредиента -> лучший ранг."""
+        ranks = {}
+        start = bisect_left(self.keys, query)
+        for index in range(start, len(self.keys)):
+            if not self.keys[index].startswith(query):
+                break
+            rank, position = self.entries[index]
+            if rank < ranks.get(position, FUZZY_RANK):
+                ranks[position] = rank
+        return ranks
+
+    def fuzzy_matches(self, query):
+        """
+        Возвращает словарь позиция ингредиента -> сходство для названий,
+        содержащих query внутри слова или похожих на него.
+
+        Сходство считается как доля триграмм запроса, найденных
+        в названии (аналог word_similarity из pg_trgm). Вхождение query
+        внутрь слова считается полным совпадением.
+        """
+        query_trigrams = trigrams(query)
+        inner = query_trigrams.intersection(
+            query[i:i + 3] for i in range(len(query) - 2))
+        counts = Counter()
+        for trigram in query_trigrams:
+            counts.update(self.postings.get(trigram, ()))
+        required = math.ceil(len(query_trigrams) * TRIGRAM_SIMILARITY)
+        similarities = {}
+        for position, count in counts.items():
+            if count >= len(inner) and query in self.folded[position]:
+                similarities[position] = 1.0
+            elif count >= required:
+                similarities[position] = count / len(query_trigrams)
+        return similarities
+
+    def search(self, query, fuzzy=False, limit=None):
+        """
+        Ищет ингредиенты, наименование или одно из слов которых
+        начинается с query, а в режиме fuzzy также содержащие query
+        или похожие на него.
+
+            Параметры:
+                query (str): Строка поиска.
+                fuzzy (bool): Искать вхождения и опечатки.
+                limit (int): Максимальное число результатов.
+
+            Возвращает:
+                list: Ингредиенты в формате IngredientSerializer.
+
+        """
+        query = fold(query)
+        if not query:
+            return self.ingredients[:limit]
+        ranks = self.matches(query)
+        order = {position: (rank, 0) for position, rank in ranks.items()}
+        if fuzzy and len(query) >= 3 and (
+                limit is None or len(order) < limit):
+            for position, similarity in self.fuzzy_matches(query).items():
+                order.setdefault(position, (FUZZY_RANK, -similarity))
+        return [
+            self.ingredients[position]
+            for position in sorted(
+                order, key=lambda position: (order[position], position)
+            )[:limit]
+        ]
+
+
+_ingredient_index = None
+
+
+def get_ingredient_index():
+    """
+    Возвращает индекс ингредиентов текущего процесса, перестраивая его,
+    если версия каталога изменилась.
+    """
+    global _ingredient_index
+    version = get_catalog_version("ingredients")
+    if _ingredient_index is None or _ingredient_index.version != version:
+        _ingredient_index = IngredientIndex.from_db(version)
+    return _ingredient_index
+
+
+_stemmer = snowballstemmer.stemmer(SEARCH_CONFIG)
+
+
+def stem_words(value):
+    """Разбивает строку на слова и приводит их к основам."""
+    return _stemmer.stemWords(WORD.findall(fold(value)))
+
+
+class RecipeSearchIndex:
+    """
+    Обратный индекс поисковых документов рецептов в памяти процесса.
+
+    Используется, когда СУБД не PostgreSQL. Для каждой основы слова
+    хранит, в каких рецептах и сколько раз она встречается. Рецепт
+    находится, если в нем есть все основы запроса, и ранжируется по
+    сумме tf-idf основ.
+    """
+
+    def __init__(self, documents, version=None):
+        """Строит индекс по парам (id рецепта, поисковый документ)."""
+        self.version = version
+        self.postings = {}
+        self.lengths = {}
+        for recipe_id, document in documents:
+            stems = stem_words(document)
+            self.lengths[recipe_id] = len(stems) or 1
+            for stem, count in Counter(stems).items():
+                self.postings.setdefault(stem, {})[recipe_id] = count
+
+    @classmethod
+    def from_db(cls, version=None):
+        return cls(
+            Recipe.objects.values_list("id", "search_document").iterator(),
+            version=version,
+        )
+
+    def search(self, query, limit=None):
+        """
+        Возвращает список пар (id рецепта, ранг) по убыванию ранга.
+
+            Параметры:
+                query (str): Строка поиска.
+                limit (int): Максимальное число результатов.
+
+            Возвращает:
+                list: Пары (id рецепта, ранг).
+
+        """
+        stems = set(stem_words(query))
+        if not stems:
+            return []
+        postings = [self.postings.get(stem, {}) for stem in stems]
+        postings.sort(key=len)
+        ranks = {}
+        for recipe_id in postings[0]:
+            if all(recipe_id in posting for posting in postings[1:]):
+                ranks[recipe_id] = sum(
+                    posting[recipe_id] / self.lengths[recipe_id]
+                    * math.log(1 + len(self.lengths) / len(posting))
+                    for posting in postings
+                )
+        return sorted(
+            ranks.items(), key=lambda item: (-item[1], item[0]))[:limit]
+
+
+_recipe_search_index = None
+
+
+def get_recipe_search_index():
+    """
+    Возвращает поисковый индекс рецептов текущего процесса,
+    перестраивая его, если поисковые документы изменились.
+    """
+    global _recipe_search_index
+    version = get_catalog_version("recipe_search")
+    if (_recipe_search_index is None
+            or _recipe_search_index.version != version):
+        _recipe_search_index = RecipeSearchIndex.from_db(version)
+    return _recipe_search_index
+
+
+def update_recipe_search(recipe_ids):
+    """
+    Обновляет поисковые документы рецептов. Индекс в памяти процессов
+    перестраивается после фиксации транзакции.
+    """
+    Recipe.objects.filter(id__in=recipe_ids).update_search_documents()
+    transaction.on_commit(lambda: bump_catalog_version("recipe_search"))
+
+
+def search_recipes(queryset, query):
+    """
+    Оставляет в queryset рецепты, подходящие под строку поиска,
+    и сортирует их по релевантности.
+
+    На PostgreSQL используется полнотекстовый поиск по GIN-индексу
+    поискового документа, на остальных СУБД - индекс в памяти процесса.
+
+        Параметры:
+            queryset (QuerySet): Рецепты.
+            query (str): Строка поиска.
+
+        Возвращает:
+            QuerySet: Рецепты с рангом search_rank.
+
+    """
+    if connections[queryset.db].vendor == "postgresql":
+        vector = SearchVector("search_document", config=SEARCH_CONFIG)
+        search_query = SearchQuery(
+            query, config=SEARCH_CONFIG, search_type="websearch")
+        queryset = queryset.annotate(
+            search=vector,
+            search_rank=SearchRank(vector, search_query),
+        ).filter(search=search_query)
+    else:
+        ranks = get_recipe_search_index().search(
+            query, limit=SEARCH_RESULTS_LIMIT)
+        queryset = queryset.filter(
+            id__in=[recipe_id for recipe_id, _ in ranks]
+        ).annotate(search_rank=Case(
+            *(When(id=recipe_id, then=Value(rank))
+              for recipe_id, rank in ranks),
+            default=Value(0.0),
+            output_field=FloatField(),
+        ))
+    return queryset.order_by("-search_rank", "id")
@@ -1,14 +1,25 @@
-from django.core.exceptions import ValidationError
+import os
+import uuid
+
+from django.core.files.storage import default_storage
+from django.db import transaction
 
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
 
+from api.catalog import get_catalog
+from api.search import update_recipe_search
+from api.utils import get_following_ids
+from api.validators import find_invalid_ids
+from foodgram.constants import IMAGE_UPLOAD_MAX_SIZE
 from recipes.models import (
     FavoriteRecipe,
+    ImageUpload,
     Ingredient,
     IngredientCount,
     Recipe,
     ShoppingList,
+    ShoppingListIngredient,
     Tag,
 )
 from users.models import CustomUser, Subscription
@@ -26,11 +37,7 @@ class CustomUserSerializer(serializers.ModelSerializer):
                   "is_subscribed", "password")
 
     def get_is_subscribed(self, obj):
-        user = self.context.get("request").user
-        if user.is_anonymous:
-            return False
-        return Subscription.objects.filter(
-            user=user, following=obj.id).exists()
+        return obj.id in get_following_ids(self.context.get("request"))
 
 
 class AuthorSubscriptionSerializer(serializers.ModelSerializer):
@@ -50,9 +57,7 @@ class IngredientCountSerializer(serializers.ModelSerializer):
     ингредиентов в рецепте.
     """
 
-    id = serializers.PrimaryKeyRelatedField(
-        queryset=Ingredient.objects.all()
-    )
+    id = serializers.IntegerField(source="ingredients_id")
     name = serializers.ReadOnlyField(source="ingredients.name")
     measurement_unit = serializers.ReadOnlyField(
         source="ingredients.measurement_unit"
@@ -79,6 +84,32 @@ class TagSerializer(serializers.ModelSerializer):
         fields = ("id", "name", "color", "slug")
 
 
+class ImageVariantsField(serializers.ReadOnlyField):
+    """
+    Ссылки на уменьшенные копии картинки рецепта по размерам и форматам.
+    Пока копии текущей картинки не готовы, возвращает пустой словарь.
+    """
+
+    def get_attribute(self, instance):
+        return instance
+
+    def to_representation(self, recipe):
+        image_variants = recipe.image_variants
+        if image_variants.get("source") != recipe.image.name:
+            return {}
+        request = self.context.get("request")
+        return {
+            label: {
+                extension: (
+                    request.build_absolute_uri(default_storage.url(path))
+                    if request else default_storage.url(path)
+                )
+                for extension, path in formats.items()
+            }
+            for label, formats in image_variants["sizes"].items()
+        }
+
+
 class RecipeViewingSerializer(serializers.ModelSerializer):
     """
     Сериализатор для модели Recipe, представляющей рецепт
@@ -89,30 +120,45 @@ class RecipeViewingSerializer(serializers.ModelSerializer):
     tags = TagSerializer(many=True, read_only=True)
     author = CustomUserSerializer(read_only=True)
     image = Base64ImageField()
-    is_favorited = serializers.SerializerMethodField()
-    is_in_shopping_cart = serializers.SerializerMethodField()
+    image_variants = ImageVariantsField()
+    is_favorited = serializers.BooleanField(read_only=True)
+    is_in_shopping_cart = serializers.BooleanField(read_only=True)
 
     class Meta:
         model = Recipe
         fields = (
             "id", "tags", "author", "ingredients", "is_favorited",
-            "is_in_shopping_cart", "name", "image", "text", "cooking_time")
+            "is_in_shopping_cart", "name", "image", "image_variants", "text",
+            "cooking_time")
 
     def get_ingredients(self, obj):
-        ingredients = IngredientCount.objects.filter(recipe=obj)
-        return IngredientCountSerializer(ingredients, many=True).data
+        return IngredientCountSerializer(
+            obj.ingredient_count_recipe.all(), many=True).data
+
+
+class AuthorFragmentSerializer(serializers.ModelSerializer):
+    """Сериализатор автора рецепта без признаков текущего пользователя."""
+
+    class Meta:
+        model = CustomUser
+        fields = ("email", "id", "username", "first_name", "last_name")
 
-    def get_is_favorited(self, obj):
-        user = self.context.get("request").user
-        if user.is_anonymous:
-            return False
-        return FavoriteRecipe.objects.filter(user=user, recipe=obj.id).exists()
 
-    def get_is_in_shopping_cart(self, obj):
-        user = self.context.get("request").user
-        if user.is_anonymous:
-            return False
-        return ShoppingList.objects.filter(user=user, recipe=obj.id).exists()
+class RecipeFragmentSerializer(RecipeViewingSerializer):
+    """
+    Сериализатор общей для всех пользователей части рецепта, которая
+    кэшируется. Ссылки на картинки в нем относительные.
+    """
+
+    author = AuthorFragmentSerializer(read_only=True)
+    is_favorited = None
+    is_in_shopping_cart = None
+
+    class Meta(RecipeViewingSerializer.Meta):
+        fields = tuple(
+            field for field in RecipeViewingSerializer.Meta.fields
+            if field not in ("is_favorited", "is_in_shopping_cart")
+        )
 
 
 class ReducedRecipeSerializer(serializers.ModelSerializer):
@@ -121,9 +167,11 @@ class ReducedRecipeSerializer(serializers.ModelSerializer):
     с сокращенными полями.
     """
 
+    image_variants = ImageVariantsField()
+
     class Meta:
         model = Recipe
-        fields = "id", "name", "image", "cooking_time"
+        fields = "id", "name", "image", "image_variants", "cooking_time"
         read_only_fields = ["id", "name", "image", "cooking_time"]
 
 
@@ -142,68 +190,166 @@ class SubscribeRecipesSerializer(CustomUserSerializer):
                   "is_subscribed", "recipes", "recipes_count"]
 
     def get_recipes(self, obj):
-        request = self.context.get("request")
-        recipes_limit = request.GET.get("recipes_limit")
-        if recipes_limit:
-            try:
-                recipes_limit = int(recipes_limit)
-                if recipes_limit <= 0:
-                    raise ValidationError(
-                        "recipes_limit должно быть положительным целым числом."
-                    )
-            except ValueError:
-                raise ValidationError(
-                    "recipes_limit должно быть целым числом.")
-            recipes = Recipe.objects.filter(
-                author=obj).order_by("id")[:recipes_limit]
-        else:
-            recipes = Recipe.objects.filter(author=obj)
+        recipes = self.context.get("authors_recipes", {}).get(obj.id, [])
         serializer = ReducedRecipeSerializer(recipes, many=True)
         return serializer.data
 
 
+class ImageUploadSerializer(serializers.ModelSerializer):
+    """
+    Сериализатор для модели ImageUpload, представляющей картинку,
+    загруженную отдельно от рецепта.
+    """
+
+    class Meta:
+        model = ImageUpload
+        fields = ("token", "image")
+
+    def validate_image(self, value):
+        if value.size > IMAGE_UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError(
+                "Размер картинки не должен превышать "
+                f"{IMAGE_UPLOAD_MAX_SIZE // (1024 * 1024)} МБ.")
+        value.name = f"{uuid.uuid4()}{os.path.splitext(value.name)[1]}"
+        return value
+
+
 class CreateRecipeSerializer(serializers.ModelSerializer):
-    """Сериализатор для создания рецепта."""
+    """
+    Сериализатор для создания рецепта. Картинка передается либо
+    строкой base64 в поле image, либо токеном ранее загруженной
+    картинки в поле image_token.
+    """
 
     author = CustomUserSerializer(read_only=True)
     ingredients = IngredientCountSerializer(
         many=True, source="ingredient_count_ingredients")
     IngredientCountSerializer
-    tags = serializers.PrimaryKeyRelatedField(
-        queryset=Tag.objects.all(), many=True)
-    image = Base64ImageField()
+    tags = serializers.ListField(child=serializers.IntegerField())
+    image = Base64ImageField(required=False)
+    image_token = serializers.UUIDField(write_only=True, required=False)
 
     class Meta:
         model = Recipe
         fields = [
             "id", "author", "ingredients", "tags",
-            "image", "name", "text", "cooking_time"]
+            "image", "image_token", "name", "text", "cooking_time"]
+
+    def validate_ingredients(self, value):
+        ids = [ingredient["ingredients_id"] for ingredient in value]
+        errors = find_invalid_ids(ids, set(Ingredient.objects.filter(
+            id__in=ids).values_list("id", flat=True)))
+        if errors:
+            raise serializers.ValidationError([
+                {"id": errors[index]} if index in errors else {}
+                for index in range(len(value))
+            ])
+        return value
+
+    def validate_tags(self, value):
+        errors = find_invalid_ids(value, get_catalog("tags").by_id())
+        if errors:
+            raise serializers.ValidationError(errors)
+        return value
+
+    def validate(self, attrs):
+        token = attrs.pop("image_token", None)
+        if token is not None and "image" in attrs:
+            raise serializers.ValidationError(
+                {"image_token": "Передайте либо image, либо image_token."})
+        if token is not None:
+            self.image_upload = ImageUpload.objects.filter(
+                token=token, user=self.context["request"].user).first()
+            if self.image_upload is None:
+                raise serializers.ValidationError(
+                    {"image_token": "Картинка с таким токеном не найдена."})
+            attrs["image"] = self.image_upload.image.name
+        elif "image" not in attrs and self.instance is None:
+            raise serializers.ValidationError(
+                {"image": "Обязательное поле."})
+        return attrs
+
+    def release_image_upload(self):
+        """Удаляет запись о загрузке, картинка которой досталась рецепту."""
+        image_upload = getattr(self, "image_upload", None)
+        if image_upload is not None:
+            image_upload.delete()
 
     def add_tags_and_ingredients(self, tags, ingredients_data, recipe):
         recipe.tags.set(tags)
-        for ingredient in ingredients_data:
-            IngredientCount.objects.create(
-                ingredients_id=ingredient.get("id").id,
+        IngredientCount.objects.bulk_create(
+            IngredientCount(
+                ingredients_id=ingredient.get("ingredients_id"),
                 amount=ingredient.get("amount"),
                 recipe=recipe)
+            for ingredient in ingredients_data
+        )
         return recipe
 
+    def update_ingredients(self, ingredients_data, recipe):
+        """
+        Приводит ингредиенты рецепта к переданному списку, затрагивая
+        только добавленные, измененные и удаленные строки, и переносит
+        изменения в списки покупок пользователей с этим рецептом.
+        """
+        amounts = {
+            ingredient.get("ingredients_id"): ingredient.get("amount")
+            for ingredient in ingredients_data
+        }
+        changes = dict(amounts)
+        to_update = []
+        to_delete = []
+        for ingredient_count in IngredientCount.objects.filter(recipe=recipe):
+            changes[ingredient_count.ingredients_id] = (
+                changes.get(ingredient_count.ingredients_id, 0)
+                - ingredient_count.amount)
+            amount = amounts.pop(ingredient_count.ingredients_id, None)
+            if amount is None:
+                to_delete.append(ingredient_count.pk)
+            elif amount != ingredient_count.amount:
+                ingredient_count.amount = amount
+                to_update.append(ingredient_count)
+        if to_delete:
+            IngredientCount.objects.filter(pk__in=to_delete).delete()
+        if to_update:
+            IngredientCount.objects.bulk_update(to_update, ["amount"])
+        if amounts:
+            IngredientCount.objects.bulk_create(
+                IngredientCount(
+                    ingredients_id=ingredient_id,
+                    amount=amount,
+                    recipe=recipe)
+                for ingredient_id, amount in amounts.items()
+            )
+        ShoppingListIngredient.objects.change_amounts(
+            ShoppingList.objects.filter(recipe=recipe).values_list(
+                "user_id", flat=True),
+            changes,
+        )
+
+    @transaction.atomic
     def create(self, validated_data):
         ingredients_data = validated_data.pop("ingredient_count_ingredients")
         tags = validated_data.pop("tags")
         recipe = Recipe.objects.create(**validated_data)
-        return self.add_tags_and_ingredients(tags, ingredients_data, recipe)
+        self.release_image_upload()
+        self.add_tags_and_ingredients(tags, ingredients_data, recipe)
+        update_recipe_search([recipe.id])
+        return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
-        IngredientCount.objects.filter(recipe=instance).delete()
         ingredients_data = validated_data.pop("ingredient_count_ingredients")
         tags = validated_data.pop("tags")
-        instance.tags.clear()
-        self.add_tags_and_ingredients(tags, ingredients_data, instance)
+        instance.tags.set(tags)
+        self.update_ingredients(ingredients_data, instance)
+        self.release_image_upload()
         return super().update(instance, validated_data)
 
     def to_representation(self, instance):
         request = self.context.get("request")
+        instance = Recipe.objects.with_related().with_user_flags(
+            request.user).get(pk=instance.pk)
         return RecipeViewingSerializer(
             instance,
             context={"request": request}).data
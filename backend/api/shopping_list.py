@@ -0,0 +1,130 @@
+import csv
+import json
+from tempfile import SpooledTemporaryFile
+
+from django.conf import settings
+from django.db.models import F
+
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+
+from foodgram.constants import (
+    PDF_FONT_SIZE,
+    PDF_MARGIN,
+    PDF_SPOOL_SIZE,
+    SHOPPING_LIST_CHUNK_SIZE,
+    STREAM_CHUNK_SIZE,
+)
+from recipes.models import ShoppingListIngredient
+
+
+PDF_FONT_NAME = "ShoppingListFont"
+SHOPPING_LIST_FIELDS = ("name", "measurement_unit", "amount")
+
+
+class Echo:
+    """Псевдофайл, возвращающий записанную строку вместо ее хранения."""
+
+    def write(self, value):
+        return value
+
+
+def get_shopping_list(user):
+    """
+    Возвращает итератор по ингредиентам из корзины покупок пользователя,
+    уже просуммированным в ShoppingListIngredient.
+
+        Параметры:
+            user (User): Объект пользователя.
+
+        Возвращает:
+            Iterator[dict]: Строки с ключами name, measurement_unit
+            и amount.
+
+    """
+    return ShoppingListIngredient.objects.filter(user=user).values(
+        "amount",
+        name=F("ingredient__name"),
+        measurement_unit=F("ingredient__measurement_unit"),
+    ).order_by("name").iterator(chunk_size=SHOPPING_LIST_CHUNK_SIZE)
+
+
+def write_txt(rows):
+    """Отдает список покупок построчно в текстовом виде."""
+    for row in rows:
+        yield f"{row['name']} ({row['measurement_unit']}) -{row['amount']}\n"
+
+
+def write_csv(rows):
+    """Отдает список покупок построчно в формате CSV с заголовком."""
+    writer = csv.writer(Echo())
+    yield writer.writerow(SHOPPING_LIST_FIELDS)
+    for row in rows:
+        yield writer.writerow([row[field] for field in SHOPPING_LIST_FIELDS])
+
+
+def write_json(rows):
+    """Отдает список покупок как JSON-массив, по одному объекту за раз."""
+    separator = "["
+    for row in rows:
+        yield separator + json.dumps(row, ensure_ascii=False)
+        separator = ","
+    yield "[]" if separator == "[" else "]"
+
+
+def write_pdf(rows):
+    """
+    Пишет PDF во временный файл, который держится в памяти только до
+    PDF_SPOOL_SIZE байт, и отдает его частями.
+    """
+    if PDF_FONT_NAME not in pdfmetrics.getRegisteredFontNames():
+        pdfmetrics.registerFont(
+            TTFont(PDF_FONT_NAME, settings.SHOPPING_LIST_PDF_FONT))
+    with SpooledTemporaryFile(max_size=PDF_SPOOL_SIZE) as file:
+        pdf = canvas.Canvas(file, pagesize=A4)
+        height = A4[1]
+        y = None
+        for row in rows:
+            if y is None or y < PDF_MARGIN:
+                if y is not None:
+                    pdf.showPage()
+                pdf.setFont(PDF_FONT_NAME, PDF_FONT_SIZE)
+                y = height - PDF_MARGIN
+            pdf.drawString(
+                PDF_MARGIN, y,
+                f"{row['name']} ({row['measurement_unit']}) - {row['amount']}"
+            )
+            y -= PDF_FONT_SIZE * 1.5
+        pdf.save()
+        file.seek(0)
+        while True:
+            chunk = file.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+
+SHOPPING_LIST_WRITERS = {
+    "txt": write_txt,
+    "csv": write_csv,
+    "json": write_json,
+    "pdf": write_pdf,
+}
+
+
+def stream_shopping_list(user, file_format):
+    """
+    Отдает список покупок пользователя частями в нужном формате
+    по мере чтения строк из БД.
+
+        Параметры:
+            user (User): Объект пользователя.
+            file_format (str): Один из txt, csv, json, pdf.
+
+        Возвращает:
+            Iterator: Части файла списка покупок.
+
+    """
+    return SHOPPING_LIST_WRITERS[file_format](get_shopping_list(user))
@@ -0,0 +1,92 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from api.fragments import invalidate_recipe_fragments
+from api.search import update_recipe_search
+from api.utils import bump_catalog_version
+from recipes.models import Ingredient, IngredientCount, Recipe, Tag
+from users.models import CustomUser
+
+
+AUTHOR_FIELDS = {"email", "username", "first_name", "last_name"}
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def ingredients_changed(sender, **kwargs):
+    """
+    Сбрасывает кэш каталога ингредиентов при его изменении. Версия
+    меняется после фиксации транзакции, иначе другой процесс успел бы
+    собрать индекс из старых строк под новой версией.
+    """
+    transaction.on_commit(lambda: bump_catalog_version("ingredients"))
+
+
+@receiver(post_save, sender=Ingredient)
+def ingredient_renamed(sender, instance, created, **kwargs):
+    """Обновляет поисковые документы рецептов с этим ингредиентом."""
+    if not created:
+        update_recipe_search(instance.recipes_ingredient.values_list(
+            "id", flat=True))
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def tags_changed(sender, **kwargs):
+    """
+    Сбрасывает кэш тегов при их изменении после фиксации транзакции,
+    чтобы справочник и его ETag не собрались из старых строк.
+    """
+    transaction.on_commit(lambda: bump_catalog_version("tags"))
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def recipe_changed(sender, instance, **kwargs):
+    """Сбрасывает кэш представления измененного рецепта."""
+    invalidate_recipe_fragments([instance.pk])
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved(sender, instance, created, **kwargs):
+    """
+    Обновляет поисковый документ измененного рецепта. Документ нового
+    рецепта строится после добавления его ингредиентов.
+    """
+    if not created:
+        update_recipe_search([instance.pk])
+
+
+@receiver(post_save, sender=IngredientCount)
+@receiver(post_delete, sender=IngredientCount)
+def recipe_ingredients_changed(sender, instance, **kwargs):
+    """
+    Сбрасывает кэш представления рецепта при изменении его ингредиентов.
+    Поисковый документ пересобирается один раз на весь рецепт: при
+    сохранении рецепта через API и в RecipeAdmin.save_related.
+    """
+    invalidate_recipe_fragments([instance.recipe_id])
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Сбрасывает кэш представлений рецептов при изменении их тегов."""
+    if not reverse:
+        if action.startswith("post_"):
+            invalidate_recipe_fragments([instance.pk])
+    elif action == "pre_clear":
+        invalidate_recipe_fragments(
+            instance.recipes.values_list("id", flat=True))
+    elif action in ("post_add", "post_remove"):
+        invalidate_recipe_fragments(pk_set)
+
+
+@receiver(post_save, sender=CustomUser)
+def author_changed(sender, instance, created, update_fields, **kwargs):
+    """Сбрасывает кэш представлений рецептов автора при смене его данных."""
+    if created:
+        return
+    if update_fields is None or AUTHOR_FIELDS & set(update_fields):
+        invalidate_recipe_fragments(
+            instance.recipes.values_list("id", flat=True))
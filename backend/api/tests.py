@@ -0,0 +1,1015 @@
+import base64
+import gzip
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import tracemalloc
+from io import BytesIO, StringIO
+from unittest import mock
+from urllib.parse import parse_qs, quote, urlparse
+
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.client import ClientHandler
+from django.test.utils import CaptureQueriesContext
+
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api.catalog import get_catalog
+from api.fragments import (
+    fragment_key,
+    get_catalog_versions,
+    get_recipe_versions,
+    invalidate_recipe_fragments,
+)
+from api.utils import get_catalog_version
+from api.views import RecipeViewSet
+from foodgram.constants import IMAGE_ORIGINAL_MAX_SIZE
+from foodgram.querybudget import QueryBudgetExceeded, assert_max_queries
+from recipes.models import (
+    FavoriteRecipe,
+    FeedEntry,
+    Ingredient,
+    IngredientCount,
+    Recipe,
+    ShoppingList,
+    ShoppingListIngredient,
+    Tag,
+)
+from users.models import CustomUser, Subscription
+
+
+TEST_CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+}
+
+
+def create_user(username):
+    """Создает пользователя с почтой и паролем по его имени."""
+    return CustomUser.objects.create_user(
+        username=username,
+        email=f"{username}@example.org",
+        first_name=username,
+        last_name=username,
+        password="Test-pass-123",
+    )
+
+
+def create_recipes(author, count, tags, ingredients):
+    """
+    Создает count рецептов автора с тегами и ингредиентами так же,
+    как это делает API.
+    """
+    recipes = []
+    for number in range(count):
+        recipe = Recipe.objects.create(
+            author=author,
+            name=f"{author.username} {number}",
+            text="Текст рецепта",
+            cooking_time=number + 1,
+            image="recipes/images/test.png",
+        )
+        recipe.tags.set(tags[:number % len(tags) + 1])
+        IngredientCount.objects.bulk_create(
+            IngredientCount(
+                recipe=recipe,
+                ingredients=ingredients[(number + shift) % len(ingredients)],
+                amount=shift + 1,
+            )
+            for shift in range(3)
+        )
+        recipes.append(recipe)
+    return recipes
+
+
+def create_image(size, image_format="JPEG", **options):
+    """Создает файл картинки заданного размера для загрузки."""
+    content = BytesIO()
+    Image.effect_noise(size, 64).convert("RGB").save(
+        content, image_format, **options)
+    return SimpleUploadedFile(
+        f"upload.{image_format.lower()}", content.getvalue(),
+        content_type=f"image/{image_format.lower()}")
+
+
+@override_settings(
+    CACHES=TEST_CACHES, QUERY_BUDGET_ENABLED=True, QUERY_BUDGET_RAISE=True)
+class APITestCase(TestCase):
+    """
+    Общие данные: теги, ингредиенты, авторы с рецептами и клиенты.
+    Запрос, превысивший бюджет SQL-запросов представления, падает с
+    QueryBudgetExceeded.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        media_root = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, media_root)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        cls.addClassCleanup(media.disable)
+        os.makedirs(os.path.join(media_root, "recipes", "images"))
+        Image.new("RGB", (10, 10)).save(
+            os.path.join(media_root, "recipes", "images", "test.png"))
+        super().setUpClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tags = [
+            Tag.objects.create(
+                name=f"Тег {number}", color=f"#00000{number}",
+                slug=f"tag-{number}")
+            for number in range(3)
+        ]
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f"Ингредиент {number}", measurement_unit="г")
+            for number in range(10)
+        ]
+        cls.user = create_user("reader")
+        cls.authors = [create_user(f"author-{number}") for number in range(3)]
+        cls.recipes = []
+        for author in cls.authors:
+            cls.recipes += create_recipes(
+                author, 20, cls.tags, cls.ingredients)
+        for recipe in cls.recipes[::3]:
+            FavoriteRecipe.objects.create(user=cls.user, recipe=recipe)
+        for recipe in cls.recipes[::4]:
+            ShoppingList.objects.create(user=cls.user, recipe=recipe)
+
+    def setUp(self):
+        cache.clear()
+        self.anonymous = APIClient()
+        self.client = APIClient()
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+
+    def client_for(self, user):
+        """Возвращает клиент, авторизованный как user."""
+        client = APIClient()
+        client.force_authenticate(user=user)
+        return client
+
+    def count_queries(self, client, url):
+        """
+        Выполняет GET-запрос с пустым кэшем и возвращает ответ и число
+        SQL-запросов.
+        """
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response, len(queries)
+
+
+class RecipeListQueriesTest(APITestCase):
+    """Число запросов списка рецептов не зависит от размера страницы."""
+
+    def test_page_size_does_not_change_query_count(self):
+        for client in (self.anonymous, self.client):
+            with self.subTest(authenticated=client is self.client):
+                small, small_count = self.count_queries(
+                    client, "/api/recipes/?limit=2")
+                large, large_count = self.count_queries(
+                    client, "/api/recipes/?limit=50")
+                self.assertEqual(len(small.data["results"]), 2)
+                self.assertEqual(len(large.data["results"]), 50)
+                self.assertEqual(small_count, large_count)
+
+
+class QueryBudgetTest(APITestCase):
+    """Бюджеты SQL-запросов соблюдаются и проверяются в тестах."""
+
+    def test_request_within_budget(self):
+        budget = RecipeViewSet.query_budgets["list"]
+        cache.clear()
+        with assert_max_queries(budget):
+            response = self.client.get("/api/recipes/?limit=50")
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(int(response["X-DB-Queries"]), budget)
+
+    def test_request_over_view_budget_fails(self):
+        cache.clear()
+        with mock.patch.dict(RecipeViewSet.query_budgets, {"list": 1}):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get("/api/recipes/")
+
+    def test_block_over_budget_fails(self):
+        cache.clear()
+        with self.assertRaisesMessage(QueryBudgetExceeded, "Бюджет 1"):
+            with assert_max_queries(1):
+                self.anonymous.get("/api/recipes/")
+
+    def test_budget_is_logged_without_raise(self):
+        cache.clear()
+        with mock.patch.dict(RecipeViewSet.query_budgets, {"list": 1}):
+            with override_settings(QUERY_BUDGET_RAISE=False):
+                with self.assertLogs("foodgram.querybudget", "WARNING"):
+                    response = self.client.get("/api/recipes/")
+        self.assertEqual(response.status_code, 200)
+
+
+class CursorPaginationTest(APITestCase):
+    """Курсорная и постраничная пагинация списка рецептов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        Recipe.objects.bulk_create(
+            Recipe(
+                author=cls.authors[0],
+                name=f"Суп {number}" if number % 3 else f"Рагу {number}",
+                text="Суп " * (number % 4) + "с ингредиентом",
+                cooking_time=1,
+                image="recipes/images/test.png",
+            )
+            for number in range(50)
+        )
+        Recipe.objects.update_search_documents()
+
+    def walk(self, url, link="next"):
+        """
+        Проходит по ссылкам link от url и возвращает id рецептов
+        каждой страницы и ответы.
+        """
+        pages, responses = [], []
+        while url:
+            response = self.anonymous.get(url)
+            self.assertEqual(response.status_code, 200, response.content)
+            pages.append([recipe["id"] for recipe in response.data["results"]])
+            responses.append(response)
+            url = response.data[link]
+        return pages, responses
+
+    def test_forward_and_backward_cursors(self):
+        expected = list(Recipe.objects.order_by(
+            "name", "id").values_list("id", flat=True))
+        pages, responses = self.walk("/api/recipes/?cursor=&limit=7")
+        self.assertEqual(sum(pages, []), expected)
+        self.assertTrue(all(len(page) == 7 for page in pages[:-1]))
+        self.assertIsNone(responses[0].data["previous"])
+        self.assertIsNone(responses[0].data["count"])
+        back, _ = self.walk(responses[-1].data["previous"], "previous")
+        self.assertEqual(back, pages[-2::-1])
+
+    def test_cursor_on_search_rank(self):
+        query = f"/api/recipes/?search={quote('суп')}"
+        expected = [
+            recipe["id"] for recipe in
+            self.anonymous.get(f"{query}&limit=100").data["results"]]
+        self.assertGreater(len(expected), 10)
+        pages, responses = self.walk(f"{query}&cursor=&limit=4")
+        self.assertEqual(sum(pages, []), expected)
+        cursor = parse_qs(urlparse(responses[0].data["next"]).query)[
+            "cursor"][0]
+        _, (rank, _) = json.loads(base64.urlsafe_b64decode(cursor))
+        self.assertIsInstance(rank, float)
+        back, _ = self.walk(responses[-1].data["previous"], "previous")
+        self.assertEqual(back, pages[-2::-1])
+
+    def test_count_modes(self):
+        total = Recipe.objects.count()
+        for mode, count in (("", None), ("exact", total),
+                            ("estimate", total)):
+            with self.subTest(count=mode):
+                response = self.anonymous.get(
+                    f"/api/recipes/?cursor=&limit=5&count={mode}")
+                self.assertEqual(response.data["count"], count)
+
+    def test_page_size_is_capped_for_page_numbers(self):
+        total = Recipe.objects.count()
+        self.assertGreater(total, 100)
+        response = self.anonymous.get("/api/recipes/?limit=1000")
+        self.assertEqual(len(response.data["results"]), 100)
+        self.assertEqual(response.data["count"], total)
+        response = self.anonymous.get("/api/recipes/?limit=1000&page=2")
+        self.assertEqual(len(response.data["results"]), total - 100)
+
+
+class RecipeFilterTest(APITestCase):
+    """Все сочетания фильтров рецептов дают верную выдачу без дублей."""
+
+    TAGS = {
+        "": [],
+        "tags=tag-0": ["tags", ["tag-0"]],
+        "tags=tag-0&tags=tag-2": ["tags", ["tag-0", "tag-2"]],
+        "tags_all=tag-1&tags_all=tag-2": ["tags_all", ["tag-1", "tag-2"]],
+    }
+    # Версия справочника тегов и биты тегов при пустом кэше.
+    TAG_QUERIES = 2
+
+    def expected_ids(self, user, tags, author, is_favorited, in_cart):
+        """Отбирает рецепты перебором, повторяя фильтры в Python."""
+        favorites = set(FavoriteRecipe.objects.filter(
+            user=user).values_list("recipe_id", flat=True))
+        cart = set(ShoppingList.objects.filter(
+            user=user).values_list("recipe_id", flat=True))
+        ids = []
+        for recipe in Recipe.objects.prefetch_related("tags"):
+            slugs = {tag.slug for tag in recipe.tags.all()}
+            if tags and tags[0] == "tags" and not slugs & set(tags[1]):
+                continue
+            if tags and tags[0] == "tags_all" and not slugs >= set(tags[1]):
+                continue
+            if author and recipe.author_id != author.id:
+                continue
+            if is_favorited and recipe.id not in favorites:
+                continue
+            if in_cart and recipe.id not in cart:
+                continue
+            ids.append(recipe.id)
+        return ids
+
+    def test_filter_matrix(self):
+        for client, user in ((self.anonymous, None), (self.client, self.user)):
+            _, base_count = self.count_queries(
+                client, "/api/recipes/?limit=100")
+            for tags, author, is_favorited, in_cart in itertools.product(
+                    self.TAGS, (None, self.authors[1]), ("", "1", "0"),
+                    ("", "1", "0")):
+                params = [tags, "limit=100"]
+                if author:
+                    params.append(f"author={author.id}")
+                if is_favorited:
+                    params.append(f"is_favorited={is_favorited}")
+                if in_cart:
+                    params.append(f"is_in_shopping_cart={in_cart}")
+                url = "/api/recipes/?" + "&".join(filter(None, params))
+                with self.subTest(url=url, authenticated=bool(user)):
+                    response, count = self.count_queries(client, url)
+                    ids = [recipe["id"] for recipe in response.data["results"]]
+                    self.assertEqual(len(ids), len(set(ids)))
+                    self.assertCountEqual(ids, self.expected_ids(
+                        user, self.TAGS[tags], author, is_favorited == "1",
+                        in_cart == "1"))
+                    self.assertEqual(response.data["count"], len(ids))
+                    self.assertLessEqual(
+                        count, base_count + (self.TAG_QUERIES if tags else 0))
+
+
+class RecipeDetailTest(APITestCase):
+    """Страница рецепта."""
+
+    def test_recipe_is_returned(self):
+        recipe = self.recipes[0]
+        response = self.client.get(f"/api/recipes/{recipe.id}/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["id"], recipe.id)
+        self.assertTrue(response.data["is_favorited"])
+
+    def test_edited_recipe_is_served_fresh(self):
+        recipe = self.recipes[0]
+        url = f"/api/recipes/{recipe.id}/"
+        self.assertEqual(self.client.get(url).data["name"], recipe.name)
+        self.client.get("/api/recipes/?limit=100")
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client_for(recipe.author).patch(url, {
+                "name": "Новое название",
+                "tags": [self.tags[2].id],
+                "ingredients": [{"id": self.ingredients[5].id, "amount": 7}],
+            }, format="json")
+        self.assertEqual(response.status_code, 200, response.content)
+        for data in (
+            self.client.get(url).data,
+            next(item for item in self.client.get(
+                "/api/recipes/?limit=100").data["results"]
+                if item["id"] == recipe.id),
+        ):
+            self.assertEqual(data["name"], "Новое название")
+            self.assertEqual(
+                [tag["id"] for tag in data["tags"]], [self.tags[2].id])
+            self.assertEqual(
+                [(item["id"], item["amount"])
+                 for item in data["ingredients"]],
+                [(self.ingredients[5].id, 7)])
+
+    def test_late_cache_write_is_not_served(self):
+        recipe = self.recipes[0]
+        url = f"/api/recipes/{recipe.id}/"
+        stale = self.client.get(url).data
+        # Запрос прочитал версию и рецепт до фиксации изменения...
+        old_version = get_recipe_versions([recipe.id])[recipe.id]
+        catalog_versions = get_catalog_versions()
+        Recipe.objects.filter(id=recipe.id).update(name="Новое название")
+        with self.captureOnCommitCallbacks(execute=True):
+            invalidate_recipe_fragments([recipe.id])
+        # ...и положил представление в кэш уже после нее.
+        cache.set(
+            fragment_key(recipe.id, old_version, catalog_versions),
+            {**stale, "tags": [], "author": stale["author"]})
+        self.assertEqual(self.client.get(url).data["name"], "Новое название")
+
+    def test_recipe_deleted_while_serialized_is_not_found(self):
+        with mock.patch(
+                "api.fragments.get_recipe_fragments", return_value={}):
+            response = self.client.get(f"/api/recipes/{self.recipes[0].id}/")
+        self.assertEqual(response.status_code, 404)
+
+
+class IngredientCatalogTest(APITestCase):
+    """Справочник ингредиентов."""
+
+    def test_version_changes_after_commit(self):
+        version = get_catalog_version("ingredients")
+        with self.captureOnCommitCallbacks() as callbacks:
+            Ingredient.objects.create(name="Новый", measurement_unit="г")
+            self.assertEqual(get_catalog_version("ingredients"), version)
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(get_catalog_version("ingredients"), version)
+        response = self.anonymous.get("/api/ingredients/?name=Нов")
+        self.assertEqual(
+            [item["name"] for item in response.data], ["Новый"])
+
+
+class TagCatalogTest(APITestCase):
+    """Готовый ответ со списком тегов и его условные запросы."""
+
+    def test_etag_gives_not_modified(self):
+        response = self.anonymous.get("/api/tags/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), len(self.tags))
+        not_modified = self.anonymous.get(
+            "/api/tags/", HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.content, b"")
+
+    def test_gzip_body(self):
+        response = self.anonymous.get(
+            "/api/tags/", HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(
+            json.loads(gzip.decompress(response.content)),
+            self.anonymous.get("/api/tags/").json())
+
+    def test_tag_edit_changes_catalog_after_commit(self):
+        etag = self.anonymous.get("/api/tags/")["ETag"]
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.tags[0].name = "Завтрак"
+            self.tags[0].save()
+            self.assertEqual(self.anonymous.get(
+                "/api/tags/", HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        for callback in callbacks:
+            callback()
+        response = self.anonymous.get("/api/tags/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertIn("Завтрак", [tag["name"] for tag in response.json()])
+
+
+class SubscriptionsTest(APITestCase):
+    """Подписки с превью рецептов авторов."""
+
+    def setUp(self):
+        super().setUp()
+        for author in self.authors:
+            Subscription.objects.create(user=self.user, following=author)
+
+    def test_previews_are_limited_and_ordered(self):
+        counts = set()
+        for limit in (1, 3, 20):
+            with self.subTest(recipes_limit=limit):
+                response, count = self.count_queries(
+                    self.client,
+                    f"/api/users/subscriptions/?recipes_limit={limit}")
+                counts.add(count)
+                results = response.data["results"]
+                self.assertEqual(len(results), len(self.authors))
+                for author in results:
+                    expected = list(Recipe.objects.filter(
+                        author_id=author["id"]).order_by("id").values_list(
+                            "id", flat=True)[:limit])
+                    self.assertEqual(
+                        [recipe["id"] for recipe in author["recipes"]],
+                        expected)
+                    self.assertEqual(author["recipes_count"], 20)
+        self.assertEqual(len(counts), 1)
+
+    def test_invalid_limit_does_not_subscribe(self):
+        author = create_user("new-author")
+        response = self.client.post(
+            f"/api/users/{author.id}/subscribe/?recipes_limit=abc")
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Subscription.objects.filter(
+            user=self.user, following=author).exists())
+
+
+class FeedTest(APITestCase):
+    """Лента подписок при записи при публикации и при подмешивании."""
+
+    def setUp(self):
+        super().setUp()
+        self.author = self.authors[0]
+        self.followers = [create_user(f"follower-{number}")
+                          for number in range(3)]
+
+    def subscribe(self, user, author=None):
+        """Подписывает пользователя на автора через API."""
+        author = author or self.author
+        response = self.client_for(user).post(
+            f"/api/users/{author.id}/subscribe/")
+        self.assertEqual(response.status_code, 201, response.content)
+
+    def unsubscribe(self, user, author=None):
+        """Отписывает пользователя от автора через API."""
+        author = author or self.author
+        response = self.client_for(user).delete(
+            f"/api/users/{author.id}/subscribe/")
+        self.assertEqual(response.status_code, 204, response.content)
+
+    def feed_ids(self, user):
+        """Возвращает id рецептов ленты пользователя."""
+        response = self.client_for(user).get("/api/recipes/feed/?limit=100")
+        self.assertEqual(response.status_code, 200, response.content)
+        return [recipe["id"] for recipe in response.data["results"]]
+
+    def author_ids(self):
+        """Возвращает id рецептов автора от новых к старым."""
+        return list(Recipe.objects.filter(author=self.author).order_by(
+            "-pub_date", "-id").values_list("id", flat=True))
+
+    def publish(self):
+        """Публикует рецепт автора и возвращает его id."""
+        return create_recipes(
+            self.author, 1, self.tags, self.ingredients)[0].id
+
+    def timeline(self, user):
+        """Возвращает id рецептов автора, записанных в ленту."""
+        return set(FeedEntry.objects.filter(
+            user=user, author=self.author).values_list(
+                "recipe_id", flat=True))
+
+    def test_subscription_backfills_and_publication_fans_out(self):
+        follower = self.followers[0]
+        self.subscribe(follower)
+        self.assertEqual(self.timeline(follower), set(self.author_ids()))
+        recipe_id = self.publish()
+        self.assertIn(recipe_id, self.timeline(follower))
+        self.assertEqual(self.feed_ids(follower), self.author_ids())
+
+    def test_unsubscribe_removes_author(self):
+        follower = self.followers[0]
+        self.subscribe(follower)
+        self.unsubscribe(follower)
+        self.assertEqual(self.timeline(follower), set())
+        self.assertEqual(self.feed_ids(follower), [])
+
+    @mock.patch("recipes.models.FEED_FANOUT_LIMIT", 2)
+    def test_popular_author_is_merged_on_read(self):
+        for follower in self.followers[:2]:
+            self.subscribe(follower)
+        other = self.authors[1]
+        self.subscribe(self.followers[0], other)
+        recipe_id = self.publish()
+        self.assertEqual(self.timeline(self.followers[0]), set())
+        expected = [
+            recipe.id for recipe in sorted(
+                Recipe.objects.filter(author__in=[self.author, other]),
+                key=lambda recipe: (recipe.pub_date, recipe.id),
+                reverse=True)
+        ]
+        self.assertEqual(self.feed_ids(self.followers[0]), expected)
+        self.assertIn(recipe_id, self.feed_ids(self.followers[1]))
+
+    @mock.patch("recipes.models.FEED_FANOUT_LIMIT", 2)
+    def test_threshold_transition_keeps_feeds_complete(self):
+        first, second, third = self.followers
+        self.subscribe(first)
+        self.assertEqual(self.timeline(first), set(self.author_ids()))
+        # Второй подписчик делает автора популярным: записи не нужны.
+        self.subscribe(second)
+        self.assertEqual(self.timeline(first), set())
+        published = self.publish()
+        self.subscribe(third)
+        for user in self.followers:
+            self.assertEqual(self.feed_ids(user), self.author_ids())
+        # Отписки возвращают автора к записи в ленты: рецепт, вышедший
+        # при популярности, и подписка того же периода дописываются.
+        self.unsubscribe(first)
+        self.unsubscribe(second)
+        self.assertIn(published, self.timeline(third))
+        self.assertEqual(self.timeline(third), set(self.author_ids()))
+        self.assertEqual(self.feed_ids(third), self.author_ids())
+        self.assertEqual(self.feed_ids(first), [])
+
+
+class RecipeUpdateTest(APITestCase):
+    """Изменение состава рецепта затрагивает только изменившиеся строки."""
+
+    def patch(self, recipe, ingredients):
+        """Меняет ингредиенты рецепта и возвращает число запросов."""
+        client = self.client_for(recipe.author)
+        with CaptureQueriesContext(connection) as queries:
+            response = client.patch(
+                f"/api/recipes/{recipe.id}/",
+                {"ingredients": ingredients,
+                 "tags": [tag.id for tag in self.tags[:2]]},
+                format="json")
+        self.assertEqual(response.status_code, 200, response.content)
+        return len(queries)
+
+    def rows(self, recipe):
+        """Возвращает строки состава рецепта: id ингредиента -> строка."""
+        return {
+            row.ingredients_id: (row.pk, row.amount)
+            for row in IngredientCount.objects.filter(recipe=recipe)
+        }
+
+    def test_only_changed_rows_are_written(self):
+        recipe = self.recipes[0]
+        before = self.rows(recipe)
+        kept, changed, removed = sorted(before)
+        added = self.ingredients[9].id
+        self.patch(recipe, [
+            {"id": kept, "amount": before[kept][1]},
+            {"id": changed, "amount": before[changed][1] + 10},
+            {"id": added, "amount": 3},
+        ])
+        after = self.rows(recipe)
+        self.assertEqual(set(after), {kept, changed, added})
+        self.assertEqual(after[kept], before[kept])
+        self.assertEqual(
+            after[changed], (before[changed][0], before[changed][1] + 10))
+        self.assertEqual(after[added][1], 3)
+
+    def test_query_count_does_not_depend_on_ingredients(self):
+        recipe = self.recipes[1]
+
+        def bump_amounts():
+            return self.patch(recipe, [
+                {"id": ingredient_id, "amount": amount + 1}
+                for ingredient_id, (_, amount) in self.rows(recipe).items()
+            ])
+
+        # Первый запрос прогревает кэш каталогов.
+        bump_amounts()
+        small = bump_amounts()
+        present = self.rows(recipe)
+        IngredientCount.objects.bulk_create(
+            IngredientCount(recipe=recipe, ingredients=ingredient, amount=1)
+            for ingredient in self.ingredients if ingredient.id not in present
+        )
+        large = bump_amounts()
+        self.assertEqual(len(self.rows(recipe)), len(self.ingredients))
+        self.assertEqual(small, large)
+
+
+class RecipeValidationTest(APITestCase):
+    """Ошибки в id ингредиентов и тегов указываются для каждой позиции."""
+
+    def post(self, ingredients, tags):
+        """Отправляет рецепт на создание, возвращает ответ и запросы."""
+        content = BytesIO()
+        Image.new("RGB", (10, 10)).save(content, "PNG")
+        image = base64.b64encode(content.getvalue()).decode()
+        client = self.client_for(self.authors[0])
+        with CaptureQueriesContext(connection) as queries:
+            response = client.post("/api/recipes/", {
+                "name": "Проверка",
+                "text": "Текст",
+                "cooking_time": 5,
+                "image": f"data:image/png;base64,{image}",
+                "ingredients": [
+                    {"id": ingredient_id, "amount": 1}
+                    for ingredient_id in ingredients
+                ],
+                "tags": tags,
+            }, format="json")
+        return response, queries
+
+    def test_unknown_and_duplicate_ingredients(self):
+        first, second = self.ingredients[0].id, self.ingredients[1].id
+        response, _ = self.post(
+            [first, 0, second, first], [self.tags[0].id])
+        self.assertEqual(response.status_code, 400, response.content)
+        errors = response.json()["ingredients"]
+        self.assertEqual(errors[0], {})
+        self.assertIn("не существует", errors[1]["id"][0])
+        self.assertEqual(errors[2], {})
+        self.assertIn("указан повторно", errors[3]["id"][0])
+
+    def test_unknown_and_duplicate_tags(self):
+        tag = self.tags[0].id
+        response, _ = self.post([self.ingredients[0].id], [tag, 0, tag])
+        self.assertEqual(response.status_code, 400, response.content)
+        errors = response.json()["tags"]
+        self.assertEqual(set(errors), {"1", "2"})
+        self.assertIn("не существует", errors["1"][0])
+        self.assertIn("указан повторно", errors["2"][0])
+
+    def test_one_query_per_collection(self):
+        get_catalog("tags")
+        response, queries = self.post(
+            [ingredient.id for ingredient in self.ingredients] + [0],
+            [tag.id for tag in self.tags] + [0])
+        self.assertEqual(response.status_code, 400, response.content)
+        self.assertEqual(
+            set(response.json()), {"ingredients", "tags"})
+        tables = [
+            query["sql"].split(" FROM ")[1].split()[0]
+            for query in queries.captured_queries
+            if query["sql"].startswith("SELECT")
+        ]
+        self.assertEqual(tables.count('"recipes_ingredient"'), 1)
+        self.assertNotIn('"recipes_tag"', tables)
+
+
+class ShoppingListTest(APITestCase):
+    """Список покупок меняется по шагам и совпадает с пересчетом."""
+
+    def setUp(self):
+        super().setUp()
+        self.other = create_user("other-buyer")
+        ShoppingListIngredient.objects.rebuild()
+
+    def assert_matches_rebuild(self):
+        """Сверяет список покупок с пересчетом с нуля."""
+        rows = ShoppingListIngredient.objects.values_list(
+            "user_id", "ingredient_id", "amount")
+        current = set(rows)
+        ShoppingListIngredient.objects.rebuild()
+        self.assertEqual(current, set(rows.all()))
+
+    def cart(self, user, recipe, method="post"):
+        """Добавляет рецепт в корзину пользователя или убирает из нее."""
+        response = getattr(self.client_for(user), method)(
+            f"/api/recipes/{recipe.id}/shopping_cart/")
+        self.assertIn(response.status_code, (201, 204), response.content)
+
+    def test_add_and_remove_recipes_sharing_ingredients(self):
+        first, second = self.recipes[1], self.recipes[2]
+        for user in (self.user, self.other):
+            self.cart(user, first)
+            self.assert_matches_rebuild()
+            self.cart(user, second)
+            self.assert_matches_rebuild()
+        self.cart(self.user, first, "delete")
+        self.assert_matches_rebuild()
+        self.cart(self.other, second, "delete")
+        self.assert_matches_rebuild()
+        self.cart(self.other, first, "delete")
+        self.assert_matches_rebuild()
+        self.assertFalse(ShoppingListIngredient.objects.filter(
+            user=self.other).exists())
+
+    def test_edit_carted_recipe_amounts(self):
+        recipe = self.recipes[1]
+        self.cart(self.other, recipe)
+        self.cart(self.other, self.recipes[2])
+        current = list(IngredientCount.objects.filter(
+            recipe=recipe).order_by("id").values("ingredients_id", "amount"))
+        ingredients = [
+            {"id": current[0]["ingredients_id"],
+             "amount": current[0]["amount"]},
+            {"id": current[1]["ingredients_id"],
+             "amount": current[1]["amount"] + 5},
+            {"id": self.ingredients[9].id, "amount": 4},
+        ]
+        response = self.client_for(recipe.author).patch(
+            f"/api/recipes/{recipe.id}/",
+            {"ingredients": ingredients, "tags": [self.tags[0].id]},
+            format="json")
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assert_matches_rebuild()
+
+    def test_delete_carted_recipe(self):
+        recipe = self.recipes[1]
+        self.cart(self.other, recipe)
+        self.cart(self.other, self.recipes[2])
+        response = self.client_for(recipe.author).delete(
+            f"/api/recipes/{recipe.id}/")
+        self.assertEqual(response.status_code, 204, response.content)
+        self.assert_matches_rebuild()
+
+
+class CountersTest(APITestCase):
+    """Счетчики избранного, корзин, рецептов и подписчиков."""
+
+    def counters(self, recipe, author):
+        """Возвращает счетчики рецепта и автора из БД."""
+        recipe.refresh_from_db()
+        author.refresh_from_db()
+        return (recipe.favorites_count, recipe.in_carts_count,
+                author.recipes_count, author.followers_count)
+
+    def recount(self):
+        """Возвращает вывод recount_counters --check."""
+        output = StringIO()
+        call_command("recount_counters", check=True, stdout=output)
+        return output.getvalue()
+
+    def test_counters_follow_api_changes(self):
+        other = create_user("counter-user")
+        client = self.client_for(other)
+        author = self.authors[1]
+        recipe = self.recipes[21]
+        before = self.counters(recipe, author)
+        client.post(f"/api/recipes/{recipe.id}/favorite/")
+        client.post(f"/api/recipes/{recipe.id}/shopping_cart/")
+        client.post(f"/api/users/{author.id}/subscribe/")
+        new_recipe = create_recipes(
+            author, 1, self.tags, self.ingredients)[0]
+        self.assertEqual(
+            self.counters(recipe, author),
+            tuple(value + 1 for value in before))
+        self.assertNotIn("найдено", self.recount())
+        client.delete(f"/api/recipes/{recipe.id}/favorite/")
+        client.delete(f"/api/recipes/{recipe.id}/shopping_cart/")
+        client.delete(f"/api/users/{author.id}/subscribe/")
+        new_recipe.delete()
+        self.assertEqual(self.counters(recipe, author), before)
+        self.assertNotIn("найдено", self.recount())
+
+    def test_counters_stay_at_zero(self):
+        recipe = self.recipes[0]
+        author = recipe.author
+        Subscription.objects.create(user=self.user, following=author)
+        Recipe.objects.filter(pk=recipe.pk).update(
+            favorites_count=0, in_carts_count=0)
+        CustomUser.objects.filter(pk=author.pk).update(
+            recipes_count=0, followers_count=0)
+        FavoriteRecipe.objects.filter(recipe=recipe).delete()
+        ShoppingList.objects.filter(recipe=recipe).delete()
+        Subscription.objects.filter(following=author).delete()
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 0)
+        self.assertEqual(recipe.in_carts_count, 0)
+        recipe.delete()
+        author.refresh_from_db()
+        self.assertEqual(author.recipes_count, 0)
+        self.assertEqual(author.followers_count, 0)
+        self.assertIn("найдено", self.recount())
+        call_command("recount_counters", stdout=StringIO())
+        self.assertNotIn("найдено", self.recount())
+
+    def test_generated_dataset_matches_recount(self):
+        call_command(
+            "generate_dataset", users=8, recipes=30, favorites=4, carts=2,
+            subscriptions=3, heavy_cart=5, images=1, prefix="generated",
+            stdout=StringIO())
+        self.assertEqual(self.recount().count("расхождений нет"), 4)
+
+
+class ShoppingCartDownloadTest(APITestCase):
+    """Список покупок большой корзины отдается потоком за один запрос."""
+
+    CART_SIZE = 500
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.buyer = create_user("buyer")
+        ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f"Продукт {number}", measurement_unit="г")
+            for number in range(cls.CART_SIZE)
+        )
+        recipes = Recipe.objects.bulk_create(
+            Recipe(
+                author=cls.authors[0],
+                name=f"Рецепт из корзины {number}",
+                text="Текст рецепта",
+                cooking_time=1,
+                image="recipes/images/test.png",
+            )
+            for number in range(cls.CART_SIZE)
+        )
+        IngredientCount.objects.bulk_create(
+            IngredientCount(
+                recipe=recipe,
+                ingredients=ingredients[(number + shift) % cls.CART_SIZE],
+                amount=shift + 1,
+            )
+            for number, recipe in enumerate(recipes)
+            for shift in range(2)
+        )
+        ShoppingList.objects.bulk_create(
+            ShoppingList(user=cls.buyer, recipe=recipe) for recipe in recipes)
+        ShoppingListIngredient.objects.rebuild([cls.buyer.id])
+
+    def download(self, user):
+        """
+        Скачивает список покупок пользователя и возвращает ответ, части
+        файла и число запросов до отдачи файла и во время нее.
+        """
+        client = APIClient()
+        client.force_authenticate(user=user)
+        with CaptureQueriesContext(connection) as view_queries:
+            response = client.get("/api/recipes/download_shopping_cart/")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        with CaptureQueriesContext(connection) as stream_queries:
+            chunks = list(response.streaming_content)
+        return response, chunks, len(view_queries), len(stream_queries)
+
+    def test_large_cart_is_streamed_with_constant_queries(self):
+        _, _, small_view, small_stream = self.download(self.user)
+        response, chunks, view, stream = self.download(self.buyer)
+        self.assertEqual(len(chunks), self.CART_SIZE)
+        lines = b"".join(chunks).decode().splitlines()
+        self.assertEqual(lines[0], "Продукт 0 (г) -3")
+        self.assertEqual(len(lines), self.CART_SIZE)
+        self.assertEqual(view, small_view)
+        self.assertEqual(stream, small_stream)
+        self.assertEqual(stream, 1)
+
+
+class ImageUploadTest(APITestCase):
+    """Загруженная картинка хранится уменьшенной и без метаданных."""
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def upload(self, image):
+        """Загружает картинку и возвращает сохраненную картинку."""
+        response = self.client.post(
+            "/api/recipes/upload_image/", {"image": image},
+            format="multipart")
+        self.assertEqual(response.status_code, 201, response.content)
+        upload = self.user.image_uploads.get(token=response.data["token"])
+        return Image.open(upload.image)
+
+    def test_original_is_normalized(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        exif[0x010F] = "Camera"
+        stored = self.upload(create_image((3000, 2000), exif=exif))
+        self.assertEqual(stored.format, "JPEG")
+        width, height = stored.size
+        self.assertEqual(height, IMAGE_ORIGINAL_MAX_SIZE)
+        self.assertLess(width, height)
+        self.assertNotIn("exif", stored.info)
+        self.assertEqual(len(stored.getexif()), 0)
+
+    def test_small_png_keeps_size_and_format(self):
+        stored = self.upload(create_image((100, 50), "PNG"))
+        self.assertEqual(stored.format, "PNG")
+        self.assertEqual(stored.size, (100, 50))
+
+    def test_large_upload_is_not_held_in_memory(self):
+        content = BytesIO()
+        Image.merge("RGB", [
+            Image.effect_noise((2000, 2000), 64) for _ in range(3)
+        ]).save(content, "PNG", compress_level=0)
+        image_size = content.tell()
+        self.assertGreater(image_size, 8 * 1024 * 1024)
+        # Тело запроса пишется во временный файл заранее: тестовый
+        # клиент держит его в памяти целиком.
+        boundary = "upload-boundary"
+        body = tempfile.TemporaryFile()
+        self.addCleanup(body.close)
+        body.write(
+            f"--{boundary}\r\nContent-Disposition: form-data; "
+            f'name="image"; filename="big.png"\r\n'
+            f"Content-Type: image/png\r\n\r\n".encode())
+        body.write(content.getvalue())
+        body.write(f"\r\n--{boundary}--\r\n".encode())
+        body_size = body.tell()
+        body.seek(0)
+        del content
+        # Маленькая загрузка заранее импортирует модули, чтобы они не
+        # попали в замер.
+        self.upload(create_image((10, 10), "PNG"))
+        environ = RequestFactory()._base_environ(
+            PATH_INFO="/api/recipes/upload_image/",
+            REQUEST_METHOD="POST",
+            CONTENT_TYPE=f"multipart/form-data; boundary={boundary}",
+            CONTENT_LENGTH=str(body_size),
+            HTTP_AUTHORIZATION=self.client._credentials[
+                "HTTP_AUTHORIZATION"],
+            **{"wsgi.input": body},
+        )
+        tracemalloc.start()
+        try:
+            response = ClientHandler()(environ)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertLess(peak, image_size // 10)
+
+    def test_shared_file_is_deleted_with_last_reference(self):
+        image = create_image((100, 50), "PNG")
+        self.upload(image)
+        image.seek(0)
+        self.upload(image)
+        uploads = list(self.user.image_uploads.all())
+        self.assertEqual(uploads[0].image.name, uploads[1].image.name)
+        with self.captureOnCommitCallbacks(execute=True):
+            uploads[0].delete()
+        self.assertTrue(default_storage.exists(uploads[0].image.name))
+        with self.captureOnCommitCallbacks(execute=True):
+            uploads[1].delete()
+        self.assertFalse(default_storage.exists(uploads[0].image.name))
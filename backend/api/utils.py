@@ -1,33 +1,157 @@
-from io import BytesIO
+import json
+import time
 
-from django.db.models import Sum
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
 
-from recipes.models import IngredientCount
+from rest_framework import serializers
 
+from foodgram.constants import (
+    EXACT_COUNT_THRESHOLD,
+    MAX_RECIPES_LIMIT,
+    RECIPES_LIMIT,
+)
+from recipes.models import Recipe
+from users.models import Subscription
 
-def create_shopping_list_file(shopping_cart, user):
+
+def get_catalog_version(name):
     """
-    Создает файл с списком покупок из корзины покупок.
+    Возвращает текущую версию справочника (тегов или ингредиентов).
+
+    Версия хранится в кэше Django и является временем последнего
+    изменения справочника, поэтому при общем для всех процессов кэше
+    ее изменение видят все воркеры.
 
         Параметры:
-            shopping_cart (IngredientCount): Объект корзины покупок.
-            user (User): Объект пользователя.
+            name (str): Название справочника.
 
         Возвращает:
-            BytesIO: Объект BytesIO, содержащий файл списка покупок.
-
-    """
-    shopping_cart = IngredientCount.objects.filter(
-        recipe__shopping_list_recipe__user=user).values(
-            "ingredients__name", "ingredients__measurement_unit").annotate(
-                amount=Sum("amount")).order_by("ingredients__name")
-    shopping_list = []
-    for ingredient in shopping_cart:
-        shopping_list.append(
-            f"{ingredient['ingredients__name']} "
-            f"({ingredient['ingredients__measurement_unit']}) -"
-            f"{ingredient['amount']}\n")
-    content_str = "".join(shopping_list)
-    buffer = BytesIO()
-    buffer.write(content_str.encode("utf-8"))
-    return buffer
+            float: Время последнего изменения справочника.
+
+    """
+    key = f"catalog_version:{name}"
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_catalog_version(name):
+    """Отмечает справочник как измененный."""
+    cache.set(f"catalog_version:{name}", time.time(), timeout=None)
+
+
+def get_following_ids(request):
+    """
+    Возвращает множество id авторов, на которых подписан пользователь.
+
+    Множество загружается из БД не более одного раза за запрос и хранится
+    в самом запросе, поэтому все вложенные сериализаторы используют его
+    совместно. При изменении подписок в ходе запроса множество нужно
+    обновлять на месте.
+
+        Параметры:
+            request (Request): Объект текущего запроса.
+
+        Возвращает:
+            set: Множество id авторов.
+
+    """
+    following_ids = getattr(request, "_following_ids", None)
+    if following_ids is None:
+        if request.user.is_anonymous:
+            following_ids = set()
+        else:
+            following_ids = set(Subscription.objects.filter(
+                user=request.user).values_list("following_id", flat=True))
+        request._following_ids = following_ids
+    return following_ids
+
+
+def get_recipes_limit(request):
+    """
+    Возвращает число рецептов автора для показа в подписках.
+
+    Значение берется из параметра recipes_limit. Если параметр не передан,
+    используется значение по умолчанию, а слишком большие значения
+    ограничиваются максимумом.
+
+        Параметры:
+            request (Request): Объект текущего запроса.
+
+        Возвращает:
+            int: Число рецептов на одного автора.
+
+    """
+    recipes_limit = request.query_params.get("recipes_limit")
+    if not recipes_limit:
+        return RECIPES_LIMIT
+    try:
+        recipes_limit = int(recipes_limit)
+    except ValueError:
+        raise serializers.ValidationError(
+            {"recipes_limit": "recipes_limit должно быть целым числом."})
+    if recipes_limit <= 0:
+        raise serializers.ValidationError(
+            {"recipes_limit":
+             "recipes_limit должно быть положительным целым числом."})
+    return min(recipes_limit, MAX_RECIPES_LIMIT)
+
+
+def get_authors_recipes(authors, recipes_limit):
+    """
+    Загружает первые рецепты для всех авторов одним оконным запросом.
+
+        Параметры:
+            authors (list): Авторы, для которых нужны рецепты.
+            recipes_limit (int): Число рецептов на одного автора.
+
+        Возвращает:
+            dict: Словарь id автора -> список его рецептов.
+
+    """
+    recipes = Recipe.objects.filter(author__in=authors).annotate(
+        row_number=Window(
+            RowNumber(), partition_by=F("author_id"), order_by=F("id").asc()
+        )
+    ).filter(row_number__lte=recipes_limit).only(
+        "id", "author_id", "name", "image", "image_variants", "cooking_time"
+    ).order_by("author_id", "id")
+    authors_recipes = {}
+    for recipe in recipes:
+        authors_recipes.setdefault(recipe.author_id, []).append(recipe)
+    return authors_recipes
+
+
+def estimate_count(queryset):
+    """
+    Возвращает примерное число записей в queryset.
+
+    На PostgreSQL число строк берется из плана запроса (EXPLAIN), и
+    точный COUNT(*) выполняется, только если оценка меньше
+    EXACT_COUNT_THRESHOLD. На остальных СУБД считается точно.
+
+        Параметры:
+            queryset (QuerySet): Запрос, число записей которого нужно.
+
+        Возвращает:
+            int: Оценка числа записей.
+
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != "postgresql":
+        return queryset.count()
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    estimate = int(plan[0]["Plan"]["Plan Rows"])
+    if estimate < EXACT_COUNT_THRESHOLD:
+        return queryset.count()
+    return estimate
@@ -30,3 +30,20 @@ def not_null(value):
     if value < 1:
         raise ValidationError("Значение не может быть меньше 1 грамма")
     return value
+
+
+def find_invalid_ids(ids, existing_ids):
+    """
+    Находит несуществующие и повторяющиеся id в списке.
+    Возвращает словарь позиция -> список ошибок.
+    """
+
+    errors = {}
+    seen = set()
+    for index, item_id in enumerate(ids):
+        if item_id not in existing_ids:
+            errors[index] = [f"Объект с id={item_id} не существует."]
+        elif item_id in seen:
+            errors[index] = [f"Объект с id={item_id} указан повторно."]
+        seen.add(item_id)
+    return errors
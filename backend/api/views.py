@@ -1,33 +1,50 @@
-from django.db.models import Count
-from django.http import HttpResponse
+from django.conf import settings
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.db import transaction
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
+from rest_framework.parsers import MultiPartParser
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 
+from api.catalog import CatalogListMixin
 from api.filters import IngredientFilter, RecipeFilter
-from api.pagination import PageSizePagination
+from api.fragments import serialize_recipes
+from api.pagination import (
+    CursorPageSizePagination,
+    FeedPagination,
+    PageSizePagination,
+)
+from api.renderers import SHOPPING_LIST_RENDERERS
+from api.search import get_ingredient_index
 from api.serializers import (
     AuthorSubscriptionSerializer,
     CreateRecipeSerializer,
     CustomUserSerializer,
     FavoriteRecipeSerializer,
+    ImageUploadSerializer,
     IngredientSerializer,
     RecipeViewingSerializer,
     ShoppingCartSerializer,
     SubscribeRecipesSerializer,
     TagSerializer,
 )
-from api.utils import create_shopping_list_file
+from api.shopping_list import stream_shopping_list
+from api.utils import get_authors_recipes, get_following_ids, get_recipes_limit
+from foodgram.constants import SEARCH_RESULTS_LIMIT
 from recipes.models import (
     FavoriteRecipe,
+    FeedEntry,
     Ingredient,
     Recipe,
     ShoppingList,
+    ShoppingListIngredient,
     Tag,
 )
 from users.models import CustomUser, Subscription
@@ -47,6 +64,13 @@ class CustomUserViewSet(UserViewSet):
     serializer_class = CustomUserSerializer
     pagination_class = PageSizePagination
     filterset_class = RecipeFilter
+    query_budgets = {
+        "list": 5,
+        "retrieve": 4,
+        "me": 3,
+        "subscribe": 16,
+        "subscriptions": 7,
+    }
 
     @action(
         detail=True,
@@ -54,48 +78,64 @@ class CustomUserViewSet(UserViewSet):
         permission_classes=[IsAuthenticated],
         pagination_class=PageSizePagination)
     def subscribe(self, request, id):
-        queryset = CustomUser.objects.filter(
-            id=self.request.user.id).annotate(
-                recipes_count=Count("recipes")).order_by("-recipes_count")
+        queryset = CustomUser.objects.filter(id=self.request.user.id)
         user = request.user
         author = get_object_or_404(CustomUser, id=id)
+        following_ids = get_following_ids(request)
         if request.method == "POST":
+            # Параметр проверяется до записи, чтобы ошибка в нем не
+            # возвращалась на уже сохраненную подписку.
+            recipes_limit = get_recipes_limit(request)
             if user == author:
                 return Response({
                     "message":
                     "Нельзя подписываться два раза на одного автора"},
                     status=status.HTTP_400_BAD_REQUEST)
-            if Subscription.objects.filter(
-                    user=user, following=author).exists():
+            if author.id in following_ids:
                 return Response({
                     "message": "Нельзя подписываться на самого себя"},
                     status=status.HTTP_400_BAD_REQUEST)
             serializer = AuthorSubscriptionSerializer(
                 data={"user": user.id, "following": author.id})
             serializer.is_valid(raise_exception=True)
-            serializer.save()
+            with transaction.atomic():
+                serializer.save()
+                FeedEntry.objects.add_author(user.id, author.id)
+            following_ids.add(author.id)
             serializer = SubscribeRecipesSerializer(
-                queryset, many=True, context={"request": request})
+                queryset, many=True, context={
+                    "request": request,
+                    "authors_recipes": get_authors_recipes(
+                        queryset, recipes_limit),
+                })
             return Response(serializer.data, status=status.HTTP_201_CREATED)
-        Subscription.objects.filter(user=user, following=author).delete()
+        with transaction.atomic():
+            Subscription.objects.filter(
+                user=user, following=author).delete()
+            FeedEntry.objects.remove_author(user.id, author.id)
+        following_ids.discard(author.id)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(
         methods=["GET"],
         detail=False,
-        permission_classes=(IsAuthenticated,)
+        permission_classes=(IsAuthenticated,),
+        pagination_class=CursorPageSizePagination,
     )
     def subscriptions(self, request):
         queryset = CustomUser.objects.filter(
-            following__user=request.user).annotate(
-                recipes_count=Count("recipes")).order_by("-recipes_count")
+            following__user=request.user).order_by("-recipes_count", "id")
+        recipes_limit = get_recipes_limit(request)
         page = self.paginate_queryset(queryset)
         serializer = SubscribeRecipesSerializer(
-            page, many=True, context={"request": request})
+            page, many=True, context={
+                "request": request,
+                "authors_recipes": get_authors_recipes(page, recipes_limit),
+            })
         return self.get_paginated_response(serializer.data)
 
 
-class IngredientViewSet(viewsets.ModelViewSet):
+class IngredientViewSet(CatalogListMixin, viewsets.ModelViewSet):
     """
     IngredientViewSet - это класс представления для работы
     с ингредиентами в приложении.
@@ -105,9 +145,22 @@ class IngredientViewSet(viewsets.ModelViewSet):
     serializer_class = IngredientSerializer
     filter_backends = (DjangoFilterBackend,)
     filterset_class = IngredientFilter
+    catalog_name = "ingredients"
+    query_budgets = {"list": 2, "retrieve": 2}
+
+    def list(self, request, *args, **kwargs):
+        if settings.INGREDIENT_SEARCH_INDEX:
+            search = request.query_params.get("search")
+            if search:
+                return Response(get_ingredient_index().search(
+                    search, fuzzy=True, limit=SEARCH_RESULTS_LIMIT))
+            name = request.query_params.get("name")
+            if name:
+                return Response(get_ingredient_index().search(name))
+        return super().list(request, *args, **kwargs)
 
 
-class TagViewSet(viewsets.ModelViewSet):
+class TagViewSet(CatalogListMixin, viewsets.ModelViewSet):
     """
     TagViewSet - это класс представления для работы с тегами в приложении.
     Он наследуется от viewsets.ModelViewSet и предоставляет полный набор
@@ -116,6 +169,8 @@ class TagViewSet(viewsets.ModelViewSet):
 
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
+    catalog_name = "tags"
+    query_budgets = {"list": 2, "retrieve": 2}
 
 
 class RecipeViewSet(viewsets.ModelViewSet):
@@ -125,33 +180,95 @@ class RecipeViewSet(viewsets.ModelViewSet):
     полный набор функций для работы с рецептами.
     """
 
-    queryset = Recipe.objects.select_related("author").prefetch_related(
-        "tags", "ingredients")
+    queryset = Recipe.objects.with_related()
 
     serializer_class = RecipeViewingSerializer
-    pagination_class = PageSizePagination
+    pagination_class = CursorPageSizePagination
     permission_classes = (IsOwnerOrAdminOrReadOnly,)
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
+    query_budgets = {
+        "list": 10,
+        "retrieve": 6,
+        "feed": 10,
+        "create": 30,
+        "update": 40,
+        "partial_update": 40,
+        "destroy": 30,
+        "upload_image": 4,
+        "favorite": 10,
+        "shopping_cart": 20,
+        "download_shopping_cart": 2,
+    }
+
+    def initialize_request(self, request, *args, **kwargs):
+        request = super().initialize_request(request, *args, **kwargs)
+        if self.action == "upload_image":
+            # Файл пишется на диск частями, не накапливаясь в памяти.
+            request._request.upload_handlers = [
+                TemporaryFileUploadHandler(request._request)]
+        return request
+
+    def get_queryset(self):
+        if self.action in ("list", "retrieve", "feed"):
+            # Остальные поля рецепта берутся из кэша в serialize_recipes.
+            return Recipe.objects.only(
+                "id", "name", "pub_date", "author_id",
+            ).with_user_flags(self.request.user)
+        return super().get_queryset().with_user_flags(self.request.user)
 
     def get_serializer_class(self):
         if self.request.method == "POST" or self.request.method == "PATCH":
             return CreateRecipeSerializer
         return RecipeViewingSerializer
 
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(
+            self.filter_queryset(self.get_queryset()))
+        return self.get_paginated_response(serialize_recipes(page, request))
+
+    def retrieve(self, request, *args, **kwargs):
+        recipes = serialize_recipes([self.get_object()], request)
+        # Рецепт могли удалить, пока собиралось его представление.
+        if not recipes:
+            raise NotFound
+        return Response(recipes[0])
+
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
     def perform_update(self, serializer):
         serializer.save()
 
+    @action(detail=False, methods=["POST"],
+            permission_classes=[IsAuthenticated],
+            parser_classes=(MultiPartParser,))
+    def upload_image(self, request):
+        serializer = ImageUploadSerializer(
+            data=request.data, context={"request": request})
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            serializer.save(user=request.user)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=["GET"],
+            permission_classes=[IsAuthenticated],
+            pagination_class=FeedPagination)
+    def feed(self, request):
+        page = self.paginate_queryset(self.get_queryset())
+        return self.get_paginated_response(serialize_recipes(page, request))
+
     @action(methods=["POST", "DELETE"], detail=True,
             permission_classes=[IsAuthenticated])
     def shopping_cart(self, request, pk):
         recipe = self.get_object()
         if request.method == "POST":
-            new_cart_item, created = ShoppingList.objects.get_or_create(
-                user=request.user, recipe=recipe)
+            with transaction.atomic():
+                new_cart_item, created = ShoppingList.objects.get_or_create(
+                    user=request.user, recipe=recipe)
+                if created:
+                    ShoppingListIngredient.objects.add_recipe(
+                        [request.user.id], recipe)
             if not created:
                 return Response({
                     "message":
@@ -160,7 +277,12 @@ class RecipeViewSet(viewsets.ModelViewSet):
             serializer = ShoppingCartSerializer(new_cart_item,
                                                 context={"request": request})
             return Response(serializer.data, status=status.HTTP_201_CREATED)
-        ShoppingList.objects.filter(user=request.user, recipe=recipe).delete()
+        with transaction.atomic():
+            deleted, _ = ShoppingList.objects.filter(
+                user=request.user, recipe=recipe).delete()
+            if deleted:
+                ShoppingListIngredient.objects.remove_recipe(
+                    [request.user.id], recipe)
         return Response(
             {"message": "Рецепт успешно удален из списка покупок."},
             status=status.HTTP_204_NO_CONTENT)
@@ -176,8 +298,9 @@ class RecipeViewSet(viewsets.ModelViewSet):
                     "message":
                     "Нельзя добавить один и тот же рецепт два раза"},
                     status=status.HTTP_400_BAD_REQUEST)
-            favorite = FavoriteRecipe.objects.create(
-                user=request.user, recipe=recipe)
+            with transaction.atomic():
+                favorite = FavoriteRecipe.objects.create(
+                    user=request.user, recipe=recipe)
             serializer = FavoriteRecipeSerializer(
                 favorite,
                 context={"request": request})
@@ -188,10 +311,16 @@ class RecipeViewSet(viewsets.ModelViewSet):
                         status=status.HTTP_204_NO_CONTENT)
 
     @action(detail=False, methods=["GET"],
-            permission_classes=[IsAuthenticated])
+            permission_classes=[IsAuthenticated],
+            renderer_classes=SHOPPING_LIST_RENDERERS)
     def download_shopping_cart(self, request):
-        buffer = create_shopping_list_file(None, request.user)
-        filename = f"{request.user.username}_shop_list.txt"
-        response = HttpResponse(buffer.getvalue(), content_type="text/plain")
+        renderer = request.accepted_renderer
+        content_type = renderer.media_type
+        if renderer.charset:
+            content_type = f"{content_type}; charset={renderer.charset}"
+        response = StreamingHttpResponse(
+            stream_shopping_list(request.user, renderer.format),
+            content_type=content_type)
+        filename = f"{request.user.username}_shop_list.{renderer.format}"
         response["Content-Disposition"] = f"attachment; filename={filename}"
         return response
@@ -1,6 +1,37 @@
 CSV_PATH = "data/ingredients.csv"
 PAGE_SIZE = 3
+MAX_PAGE_SIZE = 100
+EXACT_COUNT_THRESHOLD = 10000
+RECIPES_LIMIT = 3
+MAX_RECIPES_LIMIT = 20
 MIN_COOKING_TIME = 1
 MAX_COOKING_TIME = 200
 MIN_AMOUNT = 1
 MAX_AMOUNT = 1000
+IMPORT_BATCH_SIZE = 1000
+IMPORT_CHUNK_SIZE = 64 * 1024
+SEARCH_RESULTS_LIMIT = 50
+TRIGRAM_SIMILARITY = 0.6
+SHOPPING_LIST_CHUNK_SIZE = 2000
+STREAM_CHUNK_SIZE = 64 * 1024
+PDF_SPOOL_SIZE = 1024 * 1024
+PDF_FONT_SIZE = 12
+PDF_MARGIN = 50
+FEED_FANOUT_LIMIT = 1000
+FEED_BACKFILL = 100
+FEED_BATCH_SIZE = 1000
+IMAGE_VARIANTS = {"small": 320, "medium": 640, "large": 1280}
+IMAGE_FORMATS = {"webp": "WEBP", "jpeg": "JPEG"}
+IMAGE_QUALITY = 80
+IMAGE_BACKGROUND = (255, 255, 255)
+IMAGE_VARIANTS_DIR = "recipes/variants/"
+IMAGE_ORIGINAL_MAX_SIZE = 2560
+IMAGE_ORIGINAL_QUALITY = 90
+IMAGE_ORIGINAL_FORMATS = {"JPEG": "jpg", "PNG": "png", "WEBP": "webp"}
+IMAGE_UPLOAD_MAX_SIZE = 20 * 1024 * 1024
+IMAGE_UPLOAD_TTL = 24 * 60 * 60
+MEDIA_GC_GRACE_PERIOD = 60 * 60
+RECIPE_FRAGMENT_VERSION = 1
+RECIPE_FRAGMENT_TIMEOUT = 24 * 60 * 60
+SEARCH_CONFIG = "russian"
+MAX_TAGS = 63
@@ -0,0 +1,171 @@
+import logging
+import os
+import re
+import time
+import traceback
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+
+logger = logging.getLogger(__name__)
+
+IN_LIST = re.compile(r"\((?:\s*%s\s*,)+\s*%s\s*\)")
+LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+
+
+class QueryBudgetExceeded(Exception):
+    """Запрос к API выполнил больше SQL-запросов, чем ему разрешено."""
+
+
+def query_shape(sql):
+    """
+    Приводит SQL к общему виду: убирает литералы и сворачивает списки
+    IN, чтобы одинаковые по сути запросы группировались вместе.
+    """
+    return LITERAL.sub("?", IN_LIST.sub("(...)", sql))
+
+
+def query_location():
+    """
+    Возвращает место в коде проекта, откуда выполнен запрос:
+    последний кадр стека внутри BASE_DIR, не считая этого модуля.
+    """
+    base_dir = str(settings.BASE_DIR)
+    for frame in reversed(traceback.extract_stack()[:-1]):
+        if (frame.filename.startswith(base_dir)
+                and frame.filename != __file__
+                and f"{os.sep}site-packages{os.sep}" not in frame.filename):
+            return f"{frame.filename}:{frame.lineno} in {frame.name}"
+    return "?"
+
+
+class QueryCounter:
+    """
+    Считает и замеряет SQL-запросы всех подключений к БД, выполненные
+    внутри блока with, и группирует их по общему виду.
+
+    Для каждого вида запроса хранится число выполнений, суммарное
+    время и места в коде, откуда он выполнялся.
+    """
+
+    def __init__(self, locations=True):
+        """Создает счетчик; locations включает запись мест в коде."""
+        self.locations = locations
+        self.count = 0
+        self.time = 0.0
+        self.shapes = {}
+        self._stack = None
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        for connection in connections.all():
+            self._stack.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.count += 1
+            self.time += elapsed
+            shape = self.shapes.setdefault(
+                query_shape(sql), {"count": 0, "time": 0.0, "locations": {}})
+            shape["count"] += 1
+            shape["time"] += elapsed
+            if self.locations:
+                location = query_location()
+                shape["locations"][location] = (
+                    shape["locations"].get(location, 0) + 1)
+
+    def repeated(self):
+        """Возвращает виды запросов, выполненные больше одного раза."""
+        return sorted(
+            (
+                (sql, shape) for sql, shape in self.shapes.items()
+                if shape["count"] > 1
+            ),
+            key=lambda item: item[1]["count"],
+            reverse=True,
+        )
+
+    def report(self):
+        """Возвращает отчет о повторяющихся запросах для лога."""
+        lines = [f"{self.count} запросов за {self.time * 1000:.1f} мс"]
+        for sql, shape in self.repeated():
+            lines.append(f"{shape['count']} x {sql}")
+            for location, count in shape["locations"].items():
+                lines.append(f"    {count} x {location}")
+        return "\n".join(lines)
+
+
+@contextmanager
+def assert_max_queries(budget):
+    """
+    Проверяет в тестах, что блок with выполняет не больше budget
+    SQL-запросов, и выводит повторяющиеся запросы, если это не так.
+    """
+    with QueryCounter() as counter:
+        yield counter
+    if counter.count > budget:
+        raise QueryBudgetExceeded(
+            f"Бюджет {budget} превышен: {counter.report()}")
+
+
+def get_query_budget(view_func, method):
+    """
+    Возвращает бюджет запросов представления или None.
+
+    Бюджеты объявляются во ViewSet словарем query_budgets
+    действие -> число SQL-запросов.
+    """
+    budgets = getattr(getattr(view_func, "cls", None), "query_budgets", {})
+    action = getattr(view_func, "actions", {}).get(method.lower())
+    return budgets.get(action)
+
+
+class QueryBudgetMiddleware:
+    """
+    Считает SQL-запросы каждого запроса к сайту и сверяет их число с
+    бюджетом представления.
+
+    Включается настройкой QUERY_BUDGET_ENABLED. Добавляет к ответу
+    заголовки X-DB-Queries и X-DB-Time. При превышении бюджета пишет
+    предупреждение в лог или, если QUERY_BUDGET_RAISE включена (в
+    тестах), выбрасывает QueryBudgetExceeded. Запросы, выполненные при
+    отдаче потокового ответа, не учитываются.
+    """
+
+    def __init__(self, get_response):
+        """Запоминает следующий обработчик цепочки middleware."""
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.QUERY_BUDGET_ENABLED:
+            return self.get_response(request)
+        request.query_budget = None
+        with QueryCounter(locations=settings.QUERY_BUDGET_LOCATIONS) as (
+                counter):
+            response = self.get_response(request)
+        response["X-DB-Queries"] = str(counter.count)
+        response["X-DB-Time"] = f"{counter.time * 1000:.1f}"
+        budget = request.query_budget
+        if budget is not None and counter.count > budget:
+            message = (
+                f"{request.method} {request.path}: бюджет {budget} "
+                f"превышен, {counter.report()}"
+            )
+            if settings.QUERY_BUDGET_RAISE:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if settings.QUERY_BUDGET_ENABLED:
+            request.query_budget = get_query_budget(view_func, request.method)
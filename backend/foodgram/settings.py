@@ -1,4 +1,5 @@
 import os
+import tempfile
 from pathlib import Path
 
 
@@ -26,6 +27,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "rest_framework",
     "rest_framework.authtoken",
     "django_filters",
@@ -40,6 +42,7 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
 
     "django.middleware.security.SecurityMiddleware",
+    "foodgram.querybudget.QueryBudgetMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -81,6 +84,28 @@ DATABASES = {
     }
 }
 
+# Cache shared by all worker processes: it stores catalog versions
+# that tell each process when to rebuild its in-memory indexes.
+CACHES = {
+    "default": {
+        "BACKEND": os.getenv(
+            "CACHE_BACKEND",
+            "django.core.cache.backends.filebased.FileBasedCache"),
+        "LOCATION": os.getenv(
+            "CACHE_LOCATION",
+            os.path.join(tempfile.gettempdir(), "foodgram_cache")),
+    }
+}
+
+# Answer ingredient autocomplete from the in-memory prefix index
+# instead of the database.
+INGREDIENT_SEARCH_INDEX = os.getenv("INGREDIENT_SEARCH_INDEX", "True") == "True"
+
+# TrueType font with Cyrillic glyphs for PDF shopping lists.
+SHOPPING_LIST_PDF_FONT = os.getenv(
+    "SHOPPING_LIST_PDF_FONT",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf")
+
 REST_FRAMEWORK = {
 
     "DEFAULT_PERMISSION_CLASSES": [
@@ -148,6 +173,27 @@ STATIC_ROOT = os.path.join(BASE_DIR, "static/")
 MEDIA_URL = "/media/"
 MEDIA_ROOT = os.path.join(BASE_DIR, "media/")
 
+STORAGES = {
+    "default": {
+        "BACKEND": "foodgram.storage.ContentAddressedStorage",
+    },
+    "staticfiles": {
+        "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage",
+    },
+}
+
+# Число потоков, строящих уменьшенные копии картинок рецептов.
+# При 0 копии строятся сразу после сохранения рецепта.
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", 2))
+
+# Подсчет SQL-запросов на каждый запрос к сайту: заголовки X-DB-Queries
+# и X-DB-Time и проверка бюджетов query_budgets представлений. Превышение
+# бюджета пишется в лог, а при QUERY_BUDGET_RAISE (в тестах) - ошибка.
+QUERY_BUDGET_ENABLED = os.getenv("QUERY_BUDGET_ENABLED", "False") == "True"
+QUERY_BUDGET_RAISE = os.getenv("QUERY_BUDGET_RAISE", "False") == "True"
+QUERY_BUDGET_LOCATIONS = (
+    os.getenv("QUERY_BUDGET_LOCATIONS", "True") == "True")
+
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
@@ -0,0 +1,52 @@
+import hashlib
+import os
+
+from django.core.files.storage import FileSystemStorage
+from django.db import connection
+
+
+def lock_file_name(name):
+    """
+    Берет блокировку имени файла до конца текущей транзакции.
+
+    Сохранение файла и удаление файла, на который больше нет ссылок,
+    идут под этой блокировкой. Поэтому файл, который одна транзакция
+    переиспользует для новой записи, не удалит другая, которая еще не
+    видит эту запись. Блокировка - advisory lock PostgreSQL; на других
+    СУБД и вне транзакции ничего не делается.
+    """
+    if connection.vendor != "postgresql" or not connection.in_atomic_block:
+        return
+    key = int.from_bytes(
+        hashlib.sha256(name.encode()).digest()[:8], "big", signed=True)
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_xact_lock(%s)", [key])
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Файловое хранилище, именующее файлы по SHA-256 их содержимого.
+
+    Файл сохраняется как <каталог>/<первые два символа хэша>/<хэш>.<ext>,
+    где каталог берется из upload_to. Одинаковые файлы получают одно
+    имя и хранятся один раз, а содержимое файла по имени никогда не
+    меняется, поэтому его URL можно кэшировать без срока.
+    """
+
+    def hashed_name(self, name, content):
+        """Возвращает имя файла по хэшу его содержимого."""
+        sha256 = hashlib.sha256()
+        for chunk in content.chunks():
+            sha256.update(chunk)
+        content.seek(0)
+        digest = sha256.hexdigest()
+        directory = os.path.dirname(name)
+        extension = os.path.splitext(name)[1].lower()
+        return os.path.join(directory, digest[:2], f"{digest}{extension}")
+
+    def _save(self, name, content):
+        name = self.hashed_name(name, content)
+        lock_file_name(name)
+        if self.exists(name):
+            return name
+        return super()._save(name, content)
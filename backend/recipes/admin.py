@@ -1,5 +1,7 @@
 from django.contrib import admin
 
+from api.search import update_recipe_search
+
 from .models import (
     FavoriteRecipe,
     Ingredient,
@@ -7,6 +9,7 @@ from .models import (
     Recipe,
     RecipeTag,
     ShoppingList,
+    ShoppingListIngredient,
     Tag,
 )
 
@@ -62,10 +65,17 @@ class RecipeAdmin(admin.ModelAdmin):
         return qs.select_related("author").prefetch_related(
             "ingredients", "tags")
 
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        update_recipe_search([form.instance.pk])
+        ShoppingListIngredient.objects.rebuild(
+            form.instance.shopping_list_recipe.values_list(
+                "user_id", flat=True))
+
     @admin.display(
         description="Общее число добавлений этого рецепта в избранное")
     def favorite_recipe(self, obj: Recipe):
-        return obj.favorite.count()
+        return obj.favorites_count
 
 
 @admin.register(Tag)
@@ -95,6 +105,22 @@ class FavoriteAdmin(admin.ModelAdmin):
         qs = super().get_queryset(request)
         return qs.select_related("user", "recipe")
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        user_ids = {obj.user_id}
+        if change and "user" in form.changed_data:
+            user_ids.add(form.initial["user"])
+        ShoppingListIngredient.objects.rebuild(user_ids)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        ShoppingListIngredient.objects.rebuild([obj.user_id])
+
+    def delete_queryset(self, request, queryset):
+        user_ids = set(queryset.values_list("user_id", flat=True))
+        super().delete_queryset(request, queryset)
+        ShoppingListIngredient.objects.rebuild(user_ids)
+
 
 @admin.register(ShoppingList)
 class ShoppingListAdmin(admin.ModelAdmin):
@@ -109,3 +135,19 @@ class ShoppingListAdmin(admin.ModelAdmin):
     def get_queryset(self, request):
         qs = super().get_queryset(request)
         return qs.select_related("user", "recipe")
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        user_ids = {obj.user_id}
+        if change and "user" in form.changed_data:
+            user_ids.add(form.initial["user"])
+        ShoppingListIngredient.objects.rebuild(user_ids)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        ShoppingListIngredient.objects.rebuild([obj.user_id])
+
+    def delete_queryset(self, request, queryset):
+        user_ids = set(queryset.values_list("user_id", flat=True))
+        super().delete_queryset(request, queryset)
+        ShoppingListIngredient.objects.rebuild(user_ids)
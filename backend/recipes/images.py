@@ -0,0 +1,226 @@
+import logging
+import posixpath
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile, File
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+
+from PIL import Image, ImageOps
+
+from api.fragments import invalidate_recipe_fragments
+from foodgram.constants import (
+    IMAGE_BACKGROUND,
+    IMAGE_FORMATS,
+    IMAGE_ORIGINAL_FORMATS,
+    IMAGE_ORIGINAL_MAX_SIZE,
+    IMAGE_ORIGINAL_QUALITY,
+    IMAGE_QUALITY,
+    IMAGE_VARIANTS,
+    IMAGE_VARIANTS_DIR,
+)
+from foodgram.storage import lock_file_name
+from recipes.models import ImageUpload, Recipe
+
+
+logger = logging.getLogger(__name__)
+
+
+def flatten_image(image):
+    """Заливает прозрачные места картинки фоном и приводит ее к RGB."""
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, IMAGE_BACKGROUND)
+        background.paste(image, mask=image.getchannel("A"))
+        image = background
+    return image.convert("RGB")
+
+
+def normalize_original(file):
+    """
+    Приводит загруженный оригинал картинки к хранимому виду: берет
+    первый кадр, поворачивает по EXIF, отбрасывает EXIF и остальные
+    метаданные и уменьшает до IMAGE_ORIGINAL_MAX_SIZE по большей
+    стороне. JPEG, PNG и WebP перекодируются в свой же формат,
+    остальные форматы сохраняются в PNG.
+
+        Параметры:
+            file (File): Загруженная картинка.
+
+        Возвращает:
+            File: Картинка во временном файле; имя то же, расширение
+            по формату.
+
+    """
+    file.seek(0)
+    with Image.open(file) as image:
+        image_format = (
+            image.format if image.format in IMAGE_ORIGINAL_FORMATS
+            else "PNG")
+        # JPEG сразу декодируется в уменьшенном масштабе.
+        image.draft("RGB", (IMAGE_ORIGINAL_MAX_SIZE, IMAGE_ORIGINAL_MAX_SIZE))
+        icc_profile = image.info.get("icc_profile")
+        image = ImageOps.exif_transpose(image)
+    image.thumbnail(
+        (IMAGE_ORIGINAL_MAX_SIZE, IMAGE_ORIGINAL_MAX_SIZE), Image.LANCZOS)
+    if image_format == "JPEG":
+        image = flatten_image(image)
+    elif image.mode not in ("1", "L", "LA", "P", "RGB", "RGBA"):
+        image = image.convert("RGBA")
+    output = tempfile.TemporaryFile()
+    options = {"quality": IMAGE_ORIGINAL_QUALITY}
+    if icc_profile:
+        options["icc_profile"] = icc_profile
+    image.save(output, image_format, **options)
+    output.seek(0)
+    stem = posixpath.splitext(posixpath.basename(file.name))[0]
+    return File(output, name=f"{stem}.{IMAGE_ORIGINAL_FORMATS[image_format]}")
+
+
+def normalize_image(image):
+    """
+    Приводит картинку к виду для уменьшенных копий: берет первый кадр,
+    поворачивает по EXIF, убирает прозрачность и метаданные и
+    ограничивает размер самой большой копией.
+    """
+    image = flatten_image(ImageOps.exif_transpose(image))
+    largest = max(IMAGE_VARIANTS.values())
+    image.thumbnail((largest, largest), Image.LANCZOS)
+    return image
+
+
+def render_variants(name):
+    """
+    Читает картинку name из хранилища один раз и сохраняет рядом ее
+    уменьшенные копии всех размеров во всех форматах.
+
+        Параметры:
+            name (str): Путь к картинке в хранилище.
+
+        Возвращает:
+            dict: Размер -> формат -> путь к копии в хранилище.
+
+    """
+    with default_storage.open(name) as file, Image.open(file) as image:
+        image = normalize_image(image)
+    stem = posixpath.splitext(posixpath.basename(name))[0]
+    variants = {}
+    for label, size in IMAGE_VARIANTS.items():
+        variant = image.copy()
+        variant.thumbnail((size, size), Image.LANCZOS)
+        variants[label] = {}
+        for extension, image_format in IMAGE_FORMATS.items():
+            buffer = BytesIO()
+            variant.save(buffer, image_format, quality=IMAGE_QUALITY)
+            variants[label][extension] = default_storage.save(
+                posixpath.join(
+                    IMAGE_VARIANTS_DIR, f"{stem}_{label}.{extension}"),
+                ContentFile(buffer.getvalue()),
+            )
+    return variants
+
+
+def count_image_references(name):
+    """
+    Возвращает число ссылок на файл картинки из рецептов и загрузок.
+    Одинаковые картинки хранятся одним файлом, поэтому ссылок может
+    быть несколько.
+    """
+    return (
+        Recipe.objects.filter(image=name).count()
+        + ImageUpload.objects.filter(image=name).count()
+    )
+
+
+def release_image(name, image_variants=None):
+    """
+    Удаляет файл картинки и ее уменьшенные копии, если на картинку
+    больше никто не ссылается. Копии одинаковых картинок совпадают,
+    поэтому они живут столько же, сколько сама картинка.
+
+    Ссылки считаются и файлы удаляются в транзакции под блокировкой
+    имени файла, которую берет и хранилище при сохранении.
+    """
+    if not name:
+        return
+    with transaction.atomic():
+        lock_file_name(name)
+        if count_image_references(name):
+            return
+        default_storage.delete(name)
+        if image_variants and image_variants.get("source") == name:
+            for formats in image_variants["sizes"].values():
+                for path in formats.values():
+                    default_storage.delete(path)
+
+
+def process_recipe_image(recipe_id):
+    """
+    Строит уменьшенные копии картинки рецепта и сохраняет их пути
+    в рецепте. Если картинку успели заменить, готовые копии удаляются,
+    когда на их картинку больше нет ссылок.
+    """
+    recipe = Recipe.objects.filter(pk=recipe_id).values(
+        "image", "image_variants").first()
+    if recipe is None or not recipe["image"]:
+        return
+    image_variants = {
+        "source": recipe["image"],
+        "sizes": render_variants(recipe["image"]),
+    }
+    updated = Recipe.objects.filter(
+        pk=recipe_id, image=recipe["image"]).update(
+            image_variants=image_variants)
+    if updated:
+        invalidate_recipe_fragments([recipe_id])
+    else:
+        release_image(recipe["image"], image_variants)
+
+
+def try_process_recipe_image(recipe_id):
+    """Обрабатывает картинку рецепта, записывая ошибки в лог."""
+    try:
+        process_recipe_image(recipe_id)
+    except Exception:
+        logger.exception(
+            "Не удалось обработать картинку рецепта %s", recipe_id)
+
+
+def run_in_worker(recipe_id):
+    """
+    Обрабатывает картинку рецепта в потоке пула и закрывает
+    соединение с БД этого потока.
+    """
+    try:
+        try_process_recipe_image(recipe_id)
+    finally:
+        connections.close_all()
+
+
+_executor = None
+
+
+def get_executor():
+    """Возвращает пул потоков обработки картинок текущего процесса."""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.IMAGE_WORKERS,
+            thread_name_prefix="image-variants",
+        )
+    return _executor
+
+
+def schedule_image_variants(recipe_id):
+    """
+    Ставит обработку картинки рецепта в пул после фиксации транзакции.
+    При IMAGE_WORKERS = 0 картинка обрабатывается сразу в том же потоке.
+    """
+    if settings.IMAGE_WORKERS:
+        transaction.on_commit(
+            lambda: get_executor().submit(run_in_worker, recipe_id))
+    else:
+        transaction.on_commit(lambda: try_process_recipe_image(recipe_id))
@@ -0,0 +1,269 @@
+import base64
+import json
+import statistics
+import subprocess
+import time
+from io import BytesIO
+from pathlib import Path
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from foodgram.querybudget import QueryCounter
+from recipes.images import release_image
+from recipes.models import Ingredient, Recipe, ShoppingList, Tag
+from users.models import CustomUser, Subscription
+
+
+PERCENTILES = (50, 95, 99)
+BENCHMARKS_DIR = "benchmarks"
+
+
+def percentiles(timings):
+    """Возвращает p50, p95 и p99 времени ответа в миллисекундах."""
+    cuts = statistics.quantiles(timings, n=100, method="inclusive")
+    return {f"p{rank}": round(cuts[rank - 1] * 1000, 2)
+            for rank in PERCENTILES}
+
+
+def get_commit():
+    """Возвращает короткий хэш текущего коммита или unknown."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+            cwd=settings.BASE_DIR,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def image_base64():
+    """Возвращает небольшую картинку в формате поля image рецепта."""
+    buffer = BytesIO()
+    Image.new("RGB", (64, 64), (200, 120, 40)).save(buffer, "PNG")
+    return "data:image/png;base64," + base64.b64encode(
+        buffer.getvalue()).decode()
+
+
+class Command(BaseCommand):
+    help = (
+        "Замер времени ответа и числа SQL-запросов основных эндпоинтов "
+        "API на текущих данных"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--iterations", type=int, default=30,
+            help="Число замеров каждого сценария.")
+        parser.add_argument(
+            "--warmup", type=int, default=3,
+            help="Число прогревочных запросов перед замерами.")
+        parser.add_argument(
+            "--scenario", action="append", default=[],
+            help="Запустить только указанные сценарии.")
+        parser.add_argument(
+            "--output",
+            help="Файл для результатов, по умолчанию "
+                 "benchmarks/<коммит>.json.")
+        parser.add_argument(
+            "--compare",
+            help="Файл результатов, с которым сравнить текущий замер.")
+
+    def handle(self, *args, **options):
+        if options["iterations"] < 2:
+            raise CommandError("--iterations должен быть не меньше двух.")
+        scenarios = self.get_scenarios()
+        unknown = set(options["scenario"]) - set(scenarios)
+        if unknown:
+            raise CommandError(
+                f"Неизвестные сценарии: {', '.join(sorted(unknown))}. "
+                f"Доступны: {', '.join(scenarios)}.")
+        results = {}
+        self.stored_images = set()
+        try:
+            for name, scenario in scenarios.items():
+                if options["scenario"] and name not in options["scenario"]:
+                    continue
+                results[name] = self.run_scenario(
+                    scenario, options["iterations"], options["warmup"])
+                self.stdout.write(self.format_row(name, results[name]))
+        finally:
+            # Записи сценариев откатываются, а сохраненные файлы картинок
+            # остаются в хранилище.
+            for name in self.stored_images:
+                release_image(name)
+        report = {
+            "commit": get_commit(),
+            "created": timezone.now().isoformat(),
+            "database": connection.vendor,
+            "iterations": options["iterations"],
+            "dataset": {
+                "users": CustomUser.objects.count(),
+                "recipes": Recipe.objects.count(),
+                "subscriptions": Subscription.objects.count(),
+                "carts": ShoppingList.objects.count(),
+            },
+            "results": results,
+        }
+        output = Path(options["output"] or Path(
+            settings.BASE_DIR, BENCHMARKS_DIR, f"{report['commit']}.json"))
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(report, ensure_ascii=False, indent=2))
+        self.stdout.write(self.style.SUCCESS(
+            f"Результаты сохранены в {output}"))
+        if options["compare"]:
+            self.compare(json.loads(Path(options["compare"]).read_text()),
+                         report)
+
+    def get_scenarios(self):
+        """
+        Собирает сценарии на текущих данных: пользователь с самой большой
+        корзиной, самый плодовитый автор, популярные теги и рецепт.
+
+        Возвращает:
+            dict: имя сценария -> (клиент, метод, url, тело, запись).
+
+        """
+        user = self.largest_cart_user()
+        if user is None:
+            raise CommandError(
+                "Нет данных для замеров: сначала выполните generate_dataset.")
+        token, _ = Token.objects.get_or_create(user=user)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+        anonymous = APIClient()
+        author = CustomUser.objects.order_by("-recipes_count", "id").first()
+        recipe = Recipe.objects.order_by("-favorites_count", "id").first()
+        own_recipe = Recipe.objects.filter(author=user).first()
+        slugs = list(Tag.objects.values_list("slug", flat=True)[:2])
+        word = recipe.name.split(":")[0].split()[0]
+        body = {
+            "name": "Замер",
+            "text": "Рецепт для замера записи.",
+            "cooking_time": 10,
+            "image": image_base64(),
+            "tags": list(Tag.objects.values_list("id", flat=True)[:2]),
+            "ingredients": [
+                {"id": ingredient_id, "amount": 10}
+                for ingredient_id in Ingredient.objects.values_list(
+                    "id", flat=True)[:5]
+            ],
+        }
+        tags = "&".join(f"tags={slug}" for slug in slugs)
+        tags_all = "&".join(f"tags_all={slug}" for slug in slugs)
+        scenarios = {
+            "recipes": (anonymous, "get", "/api/recipes/", None, False),
+            "recipes_auth": (client, "get", "/api/recipes/", None, False),
+            "recipes_tags": (
+                anonymous, "get", f"/api/recipes/?{tags}", None, False),
+            "recipes_tags_all": (
+                anonymous, "get", f"/api/recipes/?{tags_all}", None, False),
+            "recipes_author": (
+                anonymous, "get", f"/api/recipes/?author={author.id}",
+                None, False),
+            "recipes_favorited": (
+                client, "get", "/api/recipes/?is_favorited=1", None, False),
+            "recipes_in_cart": (
+                client, "get", "/api/recipes/?is_in_shopping_cart=1",
+                None, False),
+            "recipes_combined": (
+                client, "get",
+                f"/api/recipes/?{tags}&is_favorited=1&is_in_shopping_cart=1",
+                None, False),
+            "recipes_search": (
+                anonymous, "get",
+                f"/api/recipes/?{urlencode({'search': word})}", None, False),
+            "recipe_detail": (
+                client, "get", f"/api/recipes/{recipe.id}/", None, False),
+            "feed": (client, "get", "/api/recipes/feed/", None, False),
+            "subscriptions": (
+                client, "get", "/api/users/subscriptions/", None, False),
+            "download_shopping_cart": (
+                client, "get", "/api/recipes/download_shopping_cart/",
+                None, False),
+            "recipe_create": (client, "post", "/api/recipes/", body, True),
+        }
+        if own_recipe is not None:
+            scenarios["recipe_update"] = (
+                client, "patch", f"/api/recipes/{own_recipe.id}/", body, True)
+        return scenarios
+
+    def largest_cart_user(self):
+        """Возвращает пользователя с самой большой корзиной или None."""
+        user_id = ShoppingList.objects.values("user_id").annotate(
+            total=Count("id")).order_by("-total", "user_id").values_list(
+                "user_id", flat=True).first()
+        return CustomUser.objects.filter(pk=user_id).first()
+
+    def run_scenario(self, scenario, iterations, warmup):
+        """
+        Выполняет сценарий warmup + iterations раз и возвращает
+        перцентили времени ответа, число запросов к БД и ошибок.
+        Изменения сценариев записи откатываются после каждого запроса,
+        а имена сохраненных ими картинок запоминаются в stored_images.
+        """
+        client, method, url, body, writes = scenario
+        kwargs = {} if body is None else {"data": body, "format": "json"}
+        timings = []
+        queries = []
+        errors = 0
+        for iteration in range(warmup + iterations):
+            with transaction.atomic():
+                with QueryCounter(locations=False) as counter:
+                    started = time.perf_counter()
+                    response = getattr(client, method)(url, **kwargs)
+                    if response.streaming:
+                        b"".join(response.streaming_content)
+                    elapsed = time.perf_counter() - started
+                if writes:
+                    self.stored_images.update(Recipe.objects.filter(
+                        pk=response.data.get("id")).values_list(
+                            "image", flat=True))
+                    transaction.set_rollback(True)
+            if iteration < warmup:
+                continue
+            timings.append(elapsed)
+            queries.append(counter.count)
+            errors += response.status_code >= 400
+        return {
+            **percentiles(timings),
+            "mean": round(statistics.mean(timings) * 1000, 2),
+            "queries": max(queries),
+            "errors": errors,
+            "status": response.status_code,
+        }
+
+    def format_row(self, name, result):
+        """Возвращает строку отчета по сценарию."""
+        row = (
+            f"{name:<24} p50 {result['p50']:>8.2f} мс  "
+            f"p95 {result['p95']:>8.2f} мс  p99 {result['p99']:>8.2f} мс  "
+            f"запросов {result['queries']:>3}"
+        )
+        if result["errors"]:
+            row += f"  ошибок {result['errors']} ({result['status']})"
+        return row
+
+    def compare(self, baseline, report):
+        """Печатает изменение p50, p95 и числа запросов против baseline."""
+        self.stdout.write(
+            f"Сравнение с {baseline['commit']} ({baseline['created']}):")
+        for name, result in report["results"].items():
+            old = baseline["results"].get(name)
+            if old is None:
+                continue
+            changes = []
+            for key in ("p50", "p95"):
+                change = (result[key] - old[key]) / max(old[key], 1e-6)
+                changes.append(f"{key} {change:+.0%}")
+            changes.append(f"запросов {result['queries'] - old['queries']:+d}")
+            self.stdout.write(f"{name:<24} " + "  ".join(changes))
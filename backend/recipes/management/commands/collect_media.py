@@ -0,0 +1,72 @@
+import posixpath
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from foodgram.constants import IMAGE_UPLOAD_TTL, MEDIA_GC_GRACE_PERIOD
+from foodgram.storage import lock_file_name
+from recipes.images import count_image_references
+from recipes.models import ImageUpload, Recipe
+
+
+def walk_storage(directory=""):
+    """Возвращает пути всех файлов хранилища внутри directory."""
+    directories, files = default_storage.listdir(directory)
+    for name in files:
+        yield posixpath.join(directory, name)
+    for name in directories:
+        yield from walk_storage(posixpath.join(directory, name))
+
+
+class Command(BaseCommand):
+    help = (
+        "Удаление из media/ файлов, на которые не ссылаются рецепты "
+        "и загрузки, и неиспользованных загрузок"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run", action="store_true",
+            help="Только найти лишние файлы, не удаляя их.")
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        stale_uploads = ImageUpload.objects.filter(
+            created__lt=now - timedelta(seconds=IMAGE_UPLOAD_TTL))
+        if options["dry_run"]:
+            uploads = stale_uploads.count()
+        else:
+            uploads, _ = stale_uploads.delete()
+        referenced = set(ImageUpload.objects.values_list("image", flat=True))
+        for image, image_variants in Recipe.objects.values_list(
+                "image", "image_variants").iterator():
+            referenced.add(image)
+            if image_variants.get("source") == image:
+                for formats in image_variants["sizes"].values():
+                    referenced.update(formats.values())
+        grace = now - timedelta(seconds=MEDIA_GC_GRACE_PERIOD)
+        removed = freed = 0
+        for name in walk_storage():
+            if name in referenced or default_storage.get_modified_time(
+                    name) > grace:
+                continue
+            if options["dry_run"]:
+                removed += 1
+                freed += default_storage.size(name)
+                continue
+            with transaction.atomic():
+                # Файл могли переиспользовать после выборки ссылок.
+                lock_file_name(name)
+                if count_image_references(name):
+                    continue
+                removed += 1
+                freed += default_storage.size(name)
+                default_storage.delete(name)
+        self.stdout.write(self.style.SUCCESS(
+            f"{'Найдено' if options['dry_run'] else 'Удалено'}: "
+            f"загрузок {uploads}, файлов {removed} "
+            f"({freed / 1024 / 1024:.1f} МБ)."
+        ))
@@ -0,0 +1,362 @@
+import random
+import time
+from datetime import timedelta
+from io import BytesIO, StringIO
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from PIL import Image
+
+from api.search import update_recipe_search
+from foodgram.constants import (
+    IMPORT_BATCH_SIZE,
+    MAX_AMOUNT,
+    MAX_COOKING_TIME,
+    MIN_AMOUNT,
+    MIN_COOKING_TIME,
+)
+from recipes.images import render_variants
+from recipes.models import (
+    FavoriteRecipe,
+    FeedEntry,
+    Ingredient,
+    IngredientCount,
+    Recipe,
+    RecipeTag,
+    ShoppingList,
+    ShoppingListIngredient,
+    Tag,
+)
+from users.models import CustomUser, Subscription
+
+
+DEFAULT_TAGS = (
+    ("Завтрак", "#E26C2D", "breakfast"),
+    ("Обед", "#49B64E", "lunch"),
+    ("Ужин", "#8775D2", "dinner"),
+    ("Десерт", "#D25D75", "dessert"),
+    ("Выпечка", "#C2A55D", "baking"),
+    ("Постное", "#5DA6C2", "lenten"),
+)
+FIRST_NAMES = (
+    "Анна", "Мария", "Елена", "Ольга", "Наталья", "Ирина", "Алексей",
+    "Дмитрий", "Сергей", "Андрей", "Иван", "Михаил", "Павел", "Никита",
+)
+LAST_NAMES = (
+    "Иванова", "Смирнова", "Кузнецова", "Попова", "Соколов", "Лебедев",
+    "Козлов", "Новиков", "Морозов", "Волков", "Федоров", "Орлов",
+)
+DISHES = (
+    "Салат", "Суп", "Рагу", "Запеканка", "Паста", "Пирог", "Омлет",
+    "Каша", "Плов", "Смузи", "Котлеты", "Оладьи", "Гратен", "Боул",
+)
+STEPS = (
+    "Нарежьте ингредиенты небольшими кубиками.",
+    "Разогрейте духовку до 180 градусов.",
+    "Обжарьте на среднем огне до золотистой корочки.",
+    "Тушите под крышкой 20 минут, периодически помешивая.",
+    "Посолите и поперчите по вкусу.",
+    "Выложите в форму и запекайте до готовности.",
+    "Подавайте горячим, посыпав зеленью.",
+    "Перемешайте все ингредиенты в большой миске.",
+    "Дайте настояться в холодильнике не менее часа.",
+    "Взбейте блендером до однородности.",
+)
+PUB_DATE_SPREAD = timedelta(days=365)
+PARETO_ALPHA = 2.0
+IMAGE_SIZE = (1600, 1200)
+
+
+def popularity(size, exponent):
+    """
+    Возвращает накопленные веса закона Ципфа для size объектов:
+    объект с рангом k выбирается с вероятностью ~ 1 / k ** exponent.
+    """
+    return list(accumulate(
+        1 / (rank + 1) ** exponent for rank in range(size)))
+
+
+def sample_popular(rng, population, cum_weights, count):
+    """
+    Выбирает до count разных объектов population с учетом их
+    популярности.
+    """
+    count = min(count, len(population))
+    indexes = range(len(population))
+    chosen = set()
+    for _ in range(count * 10):
+        if len(chosen) >= count:
+            break
+        chosen.update(rng.choices(
+            indexes, cum_weights=cum_weights, k=count - len(chosen)))
+    return [population[index] for index in sorted(chosen)]
+
+
+def power_count(rng, mean):
+    """
+    Возвращает случайное число с распределением Парето и средним mean:
+    у большинства объектов их мало, у немногих - очень много.
+    """
+    return int(
+        mean * rng.paretovariate(PARETO_ALPHA)
+        * (PARETO_ALPHA - 1) / PARETO_ALPHA)
+
+
+class Command(BaseCommand):
+    help = (
+        "Генерация воспроизводимого синтетического набора пользователей, "
+        "рецептов, избранного, корзин и подписок для нагрузочных замеров"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--users", type=int, default=200,
+            help="Число пользователей.")
+        parser.add_argument(
+            "--recipes", type=int, default=2000,
+            help="Число рецептов.")
+        parser.add_argument(
+            "--favorites", type=float, default=20,
+            help="Среднее число рецептов в избранном у пользователя.")
+        parser.add_argument(
+            "--carts", type=float, default=5,
+            help="Среднее число рецептов в корзине у пользователя.")
+        parser.add_argument(
+            "--subscriptions", type=float, default=10,
+            help="Среднее число подписок у пользователя.")
+        parser.add_argument(
+            "--heavy-cart", type=int, default=500,
+            help="Число рецептов в корзине первого пользователя.")
+        parser.add_argument(
+            "--images", type=int, default=5,
+            help="Число разных картинок рецептов.")
+        parser.add_argument(
+            "--exponent", type=float, default=1.1,
+            help="Показатель закона Ципфа для популярности объектов.")
+        parser.add_argument(
+            "--seed", type=int, default=1,
+            help="Начальное значение генератора случайных чисел.")
+        parser.add_argument(
+            "--prefix", default="synthetic",
+            help="Префикс имен и почты создаваемых пользователей.")
+        parser.add_argument(
+            "--password", default="synthetic-password",
+            help="Пароль всех создаваемых пользователей.")
+
+    def handle(self, *args, **options):
+        for option in ("users", "recipes", "images"):
+            if options[option] < 1:
+                raise CommandError(f"--{option} должен быть больше нуля.")
+        prefix = options["prefix"]
+        if CustomUser.objects.filter(username__startswith=prefix).exists():
+            raise CommandError(
+                f"Пользователи с префиксом {prefix} уже есть, "
+                "укажите другой --prefix.")
+        ingredient_ids = list(Ingredient.objects.values_list("id", flat=True))
+        if not ingredient_ids:
+            raise CommandError(
+                "Справочник ингредиентов пуст: сначала выполните "
+                "import_ingredient.")
+        self.rng = random.Random(options["seed"])
+        self.exponent = options["exponent"]
+        started = time.monotonic()
+        tags = self.get_tags()
+        images = self.create_images(options["images"])
+        with transaction.atomic():
+            users = self.create_users(
+                prefix, options["users"], options["password"])
+            recipes = self.create_recipes(
+                users, options["recipes"], images, tags, ingredient_ids)
+            favorites = self.create_links(
+                FavoriteRecipe, users, recipes, options["favorites"])
+            carts = self.create_links(
+                ShoppingList, users, recipes, options["carts"],
+                heavy=options["heavy_cart"])
+            subscriptions = self.create_subscriptions(
+                users, options["subscriptions"])
+        self.update_derived_data(users)
+        self.stdout.write(self.style.SUCCESS(
+            f"Создано за {time.monotonic() - started:.1f} с: "
+            f"пользователей {len(users)}, рецептов {len(recipes)}, "
+            f"в избранном {favorites}, в корзинах {carts}, "
+            f"подписок {subscriptions}. Пароль: {options['password']}"
+        ))
+
+    def popular_order(self, objects):
+        """
+        Перемешивает объекты и возвращает их вместе с весами закона
+        Ципфа: первые объекты списка самые популярные.
+        """
+        objects = list(objects)
+        self.rng.shuffle(objects)
+        return objects, popularity(len(objects), self.exponent)
+
+    def get_tags(self):
+        """Возвращает теги, создавая стандартные, если тегов нет."""
+        if not Tag.objects.exists():
+            for name, color, slug in DEFAULT_TAGS:
+                Tag.objects.create(name=name, color=color, slug=slug)
+        return list(Tag.objects.values_list("id", flat=True))
+
+    def create_images(self, count):
+        """
+        Сохраняет count картинок-градиентов и их уменьшенные копии.
+        Возвращает пары (путь к картинке, image_variants).
+        """
+        images = []
+        for _ in range(count):
+            color = tuple(self.rng.randrange(256) for _ in range(3))
+            gradient = Image.linear_gradient("L").resize(IMAGE_SIZE)
+            image = Image.blend(
+                gradient.convert("RGB"),
+                Image.new("RGB", IMAGE_SIZE, color),
+                0.6,
+            )
+            buffer = BytesIO()
+            image.save(buffer, "JPEG", quality=85)
+            name = default_storage.save(
+                "recipes/synthetic.jpg", ContentFile(buffer.getvalue()))
+            images.append(
+                (name, {"source": name, "sizes": render_variants(name)}))
+        return images
+
+    def create_users(self, prefix, count, password):
+        """Создает пользователей с одним заранее посчитанным паролем."""
+        password = make_password(password)
+        return CustomUser.objects.bulk_create(
+            [
+                CustomUser(
+                    username=f"{prefix}{number}",
+                    email=f"{prefix}{number}@example.com",
+                    first_name=self.rng.choice(FIRST_NAMES),
+                    last_name=self.rng.choice(LAST_NAMES),
+                    password=password,
+                )
+                for number in range(count)
+            ],
+            batch_size=IMPORT_BATCH_SIZE,
+        )
+
+    def create_recipes(self, users, count, images, tags, ingredient_ids):
+        """
+        Создает рецепты: авторы, ингредиенты и теги выбираются по
+        популярности, даты публикации разбросаны за последний год.
+        """
+        authors, author_weights = self.popular_order(users)
+        ingredients, ingredient_weights = self.popular_order(ingredient_ids)
+        tags, tag_weights = self.popular_order(tags)
+        names = dict(Ingredient.objects.values_list("id", "name"))
+        recipes = []
+        recipe_ingredients = []
+        recipe_tags = []
+        for _ in range(count):
+            chosen = sample_popular(
+                self.rng, ingredients, ingredient_weights,
+                self.rng.randint(3, 12))
+            image, image_variants = self.rng.choice(images)
+            recipes.append(Recipe(
+                author=self.rng.choices(
+                    authors, cum_weights=author_weights)[0],
+                name=(
+                    f"{self.rng.choice(DISHES)}: "
+                    + ", ".join(names[ingredient] for ingredient in chosen[:3])
+                )[:200],
+                text=" ".join(self.rng.sample(STEPS, 4)),
+                cooking_time=self.rng.randint(
+                    MIN_COOKING_TIME, MAX_COOKING_TIME),
+                image=image,
+                image_variants=image_variants,
+            ))
+            recipe_ingredients.append(chosen)
+            recipe_tags.append(sample_popular(
+                self.rng, tags, tag_weights, self.rng.randint(1, 3)))
+        recipes = Recipe.objects.bulk_create(
+            recipes, batch_size=IMPORT_BATCH_SIZE)
+        now = timezone.now()
+        for recipe in recipes:
+            recipe.pub_date = now - self.rng.random() * PUB_DATE_SPREAD
+        Recipe.objects.bulk_update(
+            recipes, ["pub_date"], batch_size=IMPORT_BATCH_SIZE)
+        IngredientCount.objects.bulk_create(
+            (
+                IngredientCount(
+                    recipe=recipe,
+                    ingredients_id=ingredient,
+                    amount=self.rng.randint(MIN_AMOUNT, MAX_AMOUNT // 2),
+                )
+                for recipe, chosen in zip(recipes, recipe_ingredients)
+                for ingredient in chosen
+            ),
+            batch_size=IMPORT_BATCH_SIZE,
+        )
+        RecipeTag.objects.bulk_create(
+            (
+                RecipeTag(recipe=recipe, tag_id=tag)
+                for recipe, chosen in zip(recipes, recipe_tags)
+                for tag in chosen
+            ),
+            batch_size=IMPORT_BATCH_SIZE,
+        )
+        return recipes
+
+    def create_links(self, model, users, recipes, mean, heavy=0):
+        """
+        Добавляет рецепты в избранное или корзины пользователей: число
+        рецептов у пользователя распределено по Парето, рецепты
+        выбираются по популярности. У первого пользователя в корзине
+        heavy рецептов.
+        """
+        recipes, weights = self.popular_order(recipes)
+        links = []
+        for number, user in enumerate(users):
+            count = heavy if number == 0 and heavy else power_count(
+                self.rng, mean)
+            links.extend(
+                model(user=user, recipe=recipe)
+                for recipe in sample_popular(self.rng, recipes, weights, count)
+            )
+        model.objects.bulk_create(links, batch_size=IMPORT_BATCH_SIZE)
+        return len(links)
+
+    def create_subscriptions(self, users, mean):
+        """
+        Подписывает пользователей на авторов: популярность авторов и
+        число подписок у пользователя подчиняются степенному закону.
+        """
+        authors, weights = self.popular_order(users)
+        subscriptions = []
+        for user in users:
+            subscriptions.extend(
+                Subscription(user=user, following=author)
+                for author in sample_popular(
+                    self.rng, authors, weights,
+                    power_count(self.rng, mean))
+                if author != user
+            )
+        Subscription.objects.bulk_create(
+            subscriptions, batch_size=IMPORT_BATCH_SIZE)
+        return len(subscriptions)
+
+    def update_derived_data(self, users):
+        """
+        Пересчитывает данные, которые при обычной работе ведут сигналы:
+        маски тегов, поисковые документы, счетчики, списки покупок
+        и ленты подписок.
+        """
+        recipe_ids = list(Recipe.objects.filter(
+            author__in=users).values_list("id", flat=True))
+        for start in range(0, len(recipe_ids), IMPORT_BATCH_SIZE):
+            batch = recipe_ids[start:start + IMPORT_BATCH_SIZE]
+            Recipe.objects.filter(id__in=batch).update_tags_masks()
+            update_recipe_search(batch)
+        call_command("recount_counters", stdout=StringIO())
+        user_ids = [user.id for user in users]
+        ShoppingListIngredient.objects.rebuild(user_ids)
+        FeedEntry.objects.rebuild(user_ids)
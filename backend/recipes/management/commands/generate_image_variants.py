@@ -0,0 +1,38 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.images import run_in_worker
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = "Построение уменьшенных копий картинок существующих рецептов"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--force", action="store_true",
+            help="Перестроить копии и для рецептов, у которых они уже есть.")
+        parser.add_argument(
+            "--workers", type=int, default=max(settings.IMAGE_WORKERS, 1),
+            help="Число потоков обработки картинок.")
+
+    def handle(self, *args, **options):
+        if options["workers"] < 1:
+            raise CommandError("--workers должен быть больше нуля.")
+        recipe_ids = [
+            recipe_id
+            for recipe_id, image, image_variants in Recipe.objects.exclude(
+                image="").values_list(
+                    "id", "image", "image_variants").iterator()
+            if options["force"] or image_variants.get("source") != image
+        ]
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=options["workers"]) as executor:
+            list(executor.map(run_in_worker, recipe_ids))
+        self.stdout.write(self.style.SUCCESS(
+            f"Обработано картинок: {len(recipe_ids)} "
+            f"за {time.monotonic() - started:.2f} с."
+        ))
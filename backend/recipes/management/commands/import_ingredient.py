@@ -1,20 +1,168 @@
 import csv
+import json
+import time
+from itertools import islice
+from pathlib import Path
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 
-from foodgram.constants import CSV_PATH
+from api.utils import bump_catalog_version
+from foodgram.constants import CSV_PATH, IMPORT_BATCH_SIZE, IMPORT_CHUNK_SIZE
 from recipes.models import Ingredient
 
 
+def iter_json_array(file, chunk_size=IMPORT_CHUNK_SIZE):
+    """
+    Читает JSON-массив из файла частями по chunk_size символов и по
+    одному отдает его элементы, не загружая весь файл в память.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    eof = False
+    need_more = True
+    error = "файл оборвался внутри массива"
+    opened = empty = expect_value = False
+    while True:
+        if need_more:
+            if eof:
+                raise CommandError(f"Ошибка в JSON-файле: {error}.")
+            chunk = file.read(chunk_size)
+            eof = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+            need_more = False
+        while position < len(buffer) and buffer[position].isspace():
+            position += 1
+        if position == len(buffer):
+            need_more = True
+            continue
+        char = buffer[position]
+        if not opened:
+            if char != "[":
+                raise CommandError("JSON-файл должен содержать массив.")
+            opened = empty = expect_value = True
+            position += 1
+        elif char == "]" and (empty or not expect_value):
+            return
+        elif char == "," and not expect_value:
+            expect_value = True
+            position += 1
+        elif expect_value:
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError as decode_error:
+                # Элемент может не поместиться в прочитанную часть.
+                error = decode_error.msg
+                need_more = True
+                continue
+            if end == len(buffer) and not eof:
+                need_more = True
+                continue
+            position = end
+            empty = expect_value = False
+            yield item
+        else:
+            raise CommandError(
+                f"Ошибка в JSON-файле: неожиданный символ {char!r}.")
+
+
+def read_ingredients(path):
+    """
+    Построчно читает ингредиенты из CSV- или JSON-файла.
+    Возвращает генератор пар (наименование, единица измерения).
+    """
+    with open(path, encoding="utf-8") as file:
+        if path.suffix == ".json":
+            rows = (
+                (item["name"], item["measurement_unit"])
+                for item in iter_json_array(file)
+            )
+        else:
+            rows = (row for row in csv.reader(file) if row)
+        for name, measurement_unit in rows:
+            if (name, measurement_unit) == ("name", "measurement_unit"):
+                continue
+            yield name.strip(), measurement_unit.strip()
+
+
 class Command(BaseCommand):
-    help = "Загрузка данных из CSV-файла в БД"
-
-    def handle(self, *args, **kwargs):
-        with open(CSV_PATH, encoding="utf-8") as file:
-            csvreader = csv.reader(file)
-            next(csvreader)
-            for row in csvreader:
-                Ingredient.objects.get_or_create(
-                    name=row[0],
-                    measurement_unit=row[1],
-                )
+    help = "Загрузка ингредиентов из CSV- или JSON-файла в БД"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "path", nargs="?", default=CSV_PATH,
+            help="Путь к файлу .csv или .json с ингредиентами.")
+        parser.add_argument(
+            "--batch-size", type=int, default=IMPORT_BATCH_SIZE,
+            help="Количество строк, вставляемых одним запросом.")
+        parser.add_argument(
+            "--update", action="store_true",
+            help="Обновлять единицу измерения у существующих ингредиентов.")
+        parser.add_argument(
+            "--dry-run", action="store_true",
+            help="Только подсчитать изменения, не записывая их в БД.")
+
+    def handle(self, *args, **options):
+        path = Path(options["path"])
+        if not path.exists():
+            raise CommandError(f"Файл {path} не найден.")
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size должен быть больше нуля.")
+        self.update = options["update"]
+        self.dry_run = options["dry_run"]
+        self.seen = set()
+        self.inserted = self.updated = self.skipped = 0
+        rows_total = 0
+        started = time.monotonic()
+        rows = read_ingredients(path)
+        while True:
+            batch = list(islice(rows, options["batch_size"]))
+            if not batch:
+                break
+            rows_total += len(batch)
+            self.import_batch(batch)
+        elapsed = time.monotonic() - started
+        if not self.dry_run and (self.inserted or self.updated):
+            bump_catalog_version("ingredients")
+        self.stdout.write(self.style.SUCCESS(
+            f"{'Проверено' if self.dry_run else 'Загружено'} "
+            f"{rows_total} строк за {elapsed:.2f} с "
+            f"({rows_total / max(elapsed, 1e-6):.0f} строк/с): "
+            f"добавлено {self.inserted}, обновлено {self.updated}, "
+            f"пропущено {self.skipped}."
+        ))
+
+    def import_batch(self, batch):
+        units = {}
+        for name, measurement_unit in batch:
+            if name in self.seen or name in units:
+                self.skipped += 1
+                continue
+            units[name] = measurement_unit
+        self.seen.update(units)
+        existing = dict(Ingredient.objects.filter(
+            name__in=units).values_list("name", "measurement_unit"))
+        to_insert = []
+        to_update = []
+        for name, measurement_unit in units.items():
+            if name not in existing:
+                to_insert.append(Ingredient(
+                    name=name, measurement_unit=measurement_unit))
+            elif self.update and existing[name] != measurement_unit:
+                to_update.append(Ingredient(
+                    name=name, measurement_unit=measurement_unit))
+            else:
+                self.skipped += 1
+        self.inserted += len(to_insert)
+        self.updated += len(to_update)
+        if self.dry_run:
+            return
+        Ingredient.objects.bulk_create(to_insert, ignore_conflicts=True)
+        if to_update:
+            Ingredient.objects.bulk_create(
+                to_update,
+                update_conflicts=True,
+                unique_fields=["name"],
+                update_fields=["measurement_unit"],
+            )
@@ -0,0 +1,656 @@
+import json
+import os
+import re
+import secrets
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+import requests
+
+from recipes.management.commands.benchmark_api import get_commit
+from users.models import CustomUser
+
+
+COLLECTION = Path(
+    "postman-collection", "diploma.postman_collection.json")
+PERCENTILES = (50, 95, 99)
+HISTOGRAM_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+HISTOGRAM_WIDTH = 40
+SERVER_START_TIMEOUT = 30
+REQUEST_TIMEOUT = 30
+BENCHMARKS_DIR = "benchmarks"
+
+VARIABLE = re.compile(r"\{\{(\w+)\}\}")
+SET_VARIABLE = re.compile(
+    r"pm\.(?:collectionVariables|environment|variables|globals)\.set\("
+    r"\s*[\"'](\w+)[\"']\s*,\s*(.+?)\)\s*;?\s*$",
+    re.M,
+)
+CONSTANT = re.compile(r"(?:const|let|var)\s+(\w+)\s*=\s*(.+?);?\s*$", re.M)
+LODASH_GET = re.compile(
+    r"_\.get\(\s*responseData\s*,\s*[\"']([\w.]+)[\"']\s*\)")
+PATH_STEP = re.compile(
+    r"\[(\d+)\]|\.slice\(\s*(\d+)\s*,\s*(\d+)\s*\)|\.(\w+)")
+EXPECTED_STATUS = re.compile(r"to\.be\.eql\(\s*\"([A-Za-z ]+)\"\s*\)")
+STATUS_PHRASES = {status.phrase: status.value for status in HTTPStatus}
+# Запросы коллекции, меняющие общие для всех итераций справочники.
+CATALOG_WRITE = re.compile(r"/api/(?:tags|ingredients)/")
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+def parse_response_path(expression):
+    """
+    Разбирает выражение скрипта Postman над responseData в путь
+    по JSON ответа: ключи, индексы и срезы строк.
+
+    Понимает _.get(responseData, "a.b") и responseData[0].name.slice(0,1).
+    Возвращает None, если выражение не поддерживается.
+    """
+    match = LODASH_GET.fullmatch(expression)
+    if match:
+        return match.group(1).split(".")
+    if not expression.startswith("responseData"):
+        return None
+    rest = expression[len("responseData"):]
+    path = []
+    position = 0
+    for step in PATH_STEP.finditer(rest):
+        if step.start() != position:
+            return None
+        index, start, stop, key = step.groups()
+        if index is not None:
+            path.append(int(index))
+        elif start is not None:
+            path.append(slice(int(start), int(stop)))
+        else:
+            path.append(key)
+        position = step.end()
+    return path if position == len(rest) else None
+
+
+def extract(data, path):
+    """Возвращает значение по пути из JSON ответа или None."""
+    for step in path:
+        try:
+            data = data[step]
+        except (KeyError, IndexError, TypeError):
+            return None
+    return data
+
+
+def parse_script(script):
+    """
+    Достает из тестового скрипта запроса ожидаемый статус ответа и
+    переменные, которые скрипт сохраняет из ответа.
+
+    JavaScript не выполняется: распознаются только вызовы
+    pm.*.set(...) и проверка pm.response.status.
+
+        Возвращает:
+            tuple: (статус или None, [(переменная, путь)], [выражения,
+            которые не удалось разобрать]).
+
+    """
+    match = EXPECTED_STATUS.search(script)
+    expected = STATUS_PHRASES.get(match.group(1)) if match else None
+    constants = dict(CONSTANT.findall(script))
+    extractors = []
+    unsupported = []
+    for variable, expression in SET_VARIABLE.findall(script):
+        expression = constants.get(expression, expression)
+        path = parse_response_path(expression)
+        if path is None:
+            unsupported.append(f"{variable} = {expression}")
+        else:
+            extractors.append((variable, path))
+    return expected, extractors, unsupported
+
+
+def parse_auth(auth):
+    """Возвращает заголовок авторизации Postman (ключ, значение) или None."""
+    if not auth or auth.get("type") != "apikey":
+        return None
+    options = {option["key"]: option["value"] for option in auth["apikey"]}
+    if options.get("in", "header") != "header":
+        return None
+    return options["key"], options["value"]
+
+
+def parse_collection(items, auth=None, folder=()):
+    """
+    Разворачивает папки коллекции Postman в список запросов в порядке
+    выполнения. Запрос без своей авторизации наследует ее от папки,
+    type noauth отключает авторизацию.
+
+        Возвращает:
+            tuple: (список запросов, список неразобранных выражений).
+
+    """
+    parsed = []
+    unsupported = []
+    for item in items:
+        item_auth = item.get("auth") or auth
+        path = (*folder, item["name"])
+        if "item" in item:
+            children, skipped = parse_collection(
+                item["item"], item_auth, path)
+            parsed.extend(children)
+            unsupported.extend(skipped)
+            continue
+        request = item["request"]
+        url = request["url"]
+        body = request.get("body") or {}
+        script = "\n".join(
+            "\n".join(event["script"].get("exec", []))
+            for event in item.get("event", [])
+            if event["listen"] == "test"
+        )
+        expected, extractors, skipped = parse_script(script)
+        name = "/".join(path)
+        unsupported.extend(f"{name}: {line}" for line in skipped)
+        headers = [
+            (header["key"], header["value"])
+            for header in request.get("header", [])
+            if not header.get("disabled")
+        ]
+        is_json = (
+            body.get("options", {}).get("raw", {}).get("language") == "json")
+        if is_json:
+            headers.append(("Content-Type", "application/json"))
+        parsed.append({
+            "name": name,
+            "method": request["method"],
+            "url": url["raw"] if isinstance(url, dict) else url,
+            "headers": headers,
+            "auth": parse_auth(request.get("auth") or item_auth),
+            "body": body.get("raw") if body.get("mode") == "raw" else None,
+            "expected": expected,
+            "extractors": extractors,
+        })
+    return parsed, unsupported
+
+
+def is_catalog_write(request):
+    """Проверяет, меняет ли запрос коллекции теги или ингредиенты."""
+    return (request["method"].upper() not in SAFE_METHODS
+            and CATALOG_WRITE.search(request["url"]) is not None)
+
+
+def is_unexpected_success(expected, status):
+    """
+    Проверяет, что запрос, который по коллекции должен быть отклонен
+    с 4xx, выполнился успешно и, возможно, изменил данные.
+    """
+    return (expected is not None and 400 <= expected < 500
+            and isinstance(status, int) and 200 <= status < 300)
+
+
+def render(template, variables):
+    """Подставляет {{переменные}} Postman; неизвестные остаются как есть."""
+    return VARIABLE.sub(
+        lambda match: str(variables.get(match.group(1), match.group(0))),
+        template,
+    )
+
+
+def personalize(variables, tag):
+    """
+    Делает имена и почты пользователей коллекции уникальными для
+    итерации виртуального пользователя, чтобы параллельные итерации
+    не мешали друг другу. Заведомо неверные значения (tooLong*) не
+    меняются.
+    """
+    personal = dict(variables)
+    for key, value in variables.items():
+        lowered = key.lower()
+        if (lowered.startswith("toolong")
+                or not lowered.endswith(("username", "email"))):
+            continue
+        quoted = value.startswith('"')
+        text = json.loads(value) if quoted else value
+        if "@" in text:
+            local, _, domain = text.partition("@")
+            text = f"{local}.{tag}@{domain}"
+        else:
+            text = f"{text}-{tag}"
+        personal[key] = json.dumps(text) if quoted else text
+    return personal
+
+
+def percentiles(timings):
+    """Возвращает p50, p95 и p99 времени ответа в миллисекундах."""
+    if len(timings) == 1:
+        return {f"p{rank}": round(timings[0] * 1000, 2)
+                for rank in PERCENTILES}
+    cuts = statistics.quantiles(timings, n=100, method="inclusive")
+    return {f"p{rank}": round(cuts[rank - 1] * 1000, 2)
+            for rank in PERCENTILES}
+
+
+def histogram(timings):
+    """Раскладывает время ответа по корзинам HISTOGRAM_BUCKETS в мс."""
+    counts = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+    for elapsed in timings:
+        counts[bisect_left(HISTOGRAM_BUCKETS, elapsed * 1000)] += 1
+    labels = [f"<={bucket}" for bucket in HISTOGRAM_BUCKETS]
+    labels.append(f">{HISTOGRAM_BUCKETS[-1]}")
+    return dict(zip(labels, counts))
+
+
+def summarize(timings, errors, unexpected, statuses, wall_time):
+    """
+    Сводит замеры одного запроса или всей нагрузки в отчет. Запросы,
+    которые должны были быть отклонены, но выполнились, входят в
+    errors и отдельно считаются в unexpected_successes.
+    """
+    count = len(timings)
+    return {
+        "count": count,
+        "rps": round(count / wall_time, 2),
+        **percentiles(timings),
+        "mean": round(statistics.mean(timings) * 1000, 2),
+        "max": round(max(timings) * 1000, 2),
+        "errors": errors,
+        "error_rate": round(errors / count, 4),
+        "unexpected_successes": unexpected,
+        "statuses": dict(sorted(statuses.items())),
+        "histogram": histogram(timings),
+    }
+
+
+def free_port():
+    """Возвращает свободный TCP-порт на локальном интерфейсе."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class Command(BaseCommand):
+    help = (
+        "Нагрузочный прогон коллекции Postman: каждый виртуальный "
+        "пользователь проходит коллекцию целиком от своих пользователей"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--collection",
+            default=str(Path(settings.BASE_DIR).parent / COLLECTION),
+            help="Файл коллекции Postman.")
+        parser.add_argument(
+            "--exclude", action="append", default=[],
+            help="Регулярное выражение: пропустить запросы, в пути "
+                 "которых оно находится (папка/имя запроса).")
+        parser.add_argument(
+            "--catalog-writes", action="store_true",
+            help="Выполнять запросы, меняющие теги и ингредиенты. Они "
+                 "меняют общие справочники БД, поэтому по умолчанию "
+                 "пропускаются.")
+        parser.add_argument(
+            "--strict", action="store_true",
+            help="Остановить прогон, если запрос, который должен быть "
+                 "отклонен, выполнился успешно.")
+        parser.add_argument(
+            "--users", type=int, default=10,
+            help="Число одновременных виртуальных пользователей.")
+        parser.add_argument(
+            "--iterations", type=int, default=1,
+            help="Число проходов коллекции каждым пользователем.")
+        parser.add_argument(
+            "--duration", type=float,
+            help="Ограничение прогона в секундах: новые проходы после "
+                 "него не начинаются.")
+        parser.add_argument(
+            "--ramp-up", type=float, default=0,
+            help="За сколько секунд запустить всех пользователей.")
+        parser.add_argument(
+            "--url",
+            help="Адрес уже запущенного сервера. По умолчанию на "
+                 "свободном порту запускается gunicorn.")
+        parser.add_argument(
+            "--workers", type=int, default=4,
+            help="Число процессов gunicorn.")
+        parser.add_argument(
+            "--threads", type=int, default=1,
+            help="Число потоков в процессе gunicorn.")
+        parser.add_argument(
+            "--keep-data", action="store_true",
+            help="Не удалять из БД пользователей, созданных прогоном.")
+        parser.add_argument(
+            "--output",
+            help="Файл для результатов, по умолчанию "
+                 "benchmarks/load-<коммит>.json.")
+
+    def handle(self, *args, **options):
+        if options["users"] < 1 or options["iterations"] < 1:
+            raise CommandError(
+                "--users и --iterations должны быть положительными.")
+        try:
+            collection = json.loads(
+                Path(options["collection"]).read_text(encoding="utf-8"))
+        except (OSError, ValueError) as error:
+            raise CommandError(
+                f"Не удалось прочитать коллекцию: {error}") from error
+        workload, unsupported = parse_collection(
+            collection["item"], collection.get("auth"))
+        try:
+            excluded = [re.compile(pattern) for pattern in options["exclude"]]
+        except re.error as error:
+            raise CommandError(
+                f"Неверный шаблон --exclude: {error}") from error
+        workload = [
+            request for request in workload
+            if not any(pattern.search(request["name"])
+                       for pattern in excluded)
+        ]
+        if not options["catalog_writes"]:
+            skipped = [
+                request for request in workload if is_catalog_write(request)]
+            if skipped:
+                self.stderr.write(
+                    f"Пропущено запросов, меняющих справочники: "
+                    f"{len(skipped)} (включаются --catalog-writes).")
+            workload = [
+                request for request in workload
+                if not is_catalog_write(request)]
+        if not workload:
+            raise CommandError("Все запросы коллекции исключены.")
+        for line in unsupported:
+            self.stderr.write(f"Переменная не будет заполнена: {line}")
+        variables = {
+            variable["key"]: variable["value"]
+            for variable in collection.get("variable", [])
+            if not variable.get("disabled")
+        }
+        self.verbosity = options["verbosity"]
+        self.run_id = secrets.token_hex(3)
+        self.stopped = threading.Event()
+        server = None
+        if options["url"]:
+            variables["baseUrl"] = options["url"].rstrip("/")
+        else:
+            variables["baseUrl"], server = self.start_server(
+                options["workers"], options["threads"])
+        try:
+            wall_time, samples = self.run_load(workload, variables, options)
+        finally:
+            if server is not None:
+                self.stop_server(server)
+            if not options["keep_data"]:
+                CustomUser.objects.filter(
+                    username__contains=f"-{self.run_id}-").delete()
+        report = self.build_report(workload, samples, wall_time, options)
+        report["url"] = variables["baseUrl"] if options["url"] else "gunicorn"
+        report["stopped"] = self.stopped.is_set()
+        self.print_report(report)
+        output = Path(options["output"] or Path(
+            settings.BASE_DIR, BENCHMARKS_DIR,
+            f"load-{report['commit']}.json"))
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(report, ensure_ascii=False, indent=2))
+        self.stdout.write(self.style.SUCCESS(
+            f"Результаты сохранены в {output}"))
+        if self.stopped.is_set():
+            raise CommandError(
+                "Прогон остановлен: запрос, который должен быть "
+                "отклонен, выполнился успешно (--strict).")
+
+    def start_server(self, workers, threads):
+        """
+        Запускает gunicorn с настройками текущего процесса на свободном
+        порту и ждет, пока он начнет отвечать.
+
+            Возвращает:
+                tuple: (адрес сервера, процесс gunicorn).
+
+        """
+        port = free_port()
+        url = f"http://127.0.0.1:{port}"
+        output = None if self.verbosity > 1 else subprocess.DEVNULL
+        server = subprocess.Popen(
+            [
+                sys.executable, "-m", "gunicorn", "foodgram.wsgi",
+                "--bind", f"127.0.0.1:{port}",
+                "--workers", str(workers),
+                "--threads", str(threads),
+            ],
+            cwd=settings.BASE_DIR,
+            env={
+                **os.environ,
+                "DJANGO_SETTINGS_MODULE": settings.SETTINGS_MODULE,
+            },
+            stdout=output,
+            stderr=output,
+        )
+        deadline = time.monotonic() + SERVER_START_TIMEOUT
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError(
+                    "gunicorn завершился при запуске, подробности "
+                    "выводятся с --verbosity 2.")
+            try:
+                requests.get(f"{url}/api/tags/", timeout=1)
+            except requests.RequestException:
+                time.sleep(0.2)
+                continue
+            self.stdout.write(
+                f"gunicorn запущен на {url}: процессов {workers}, "
+                f"потоков {threads}")
+            return url, server
+        self.stop_server(server)
+        raise CommandError(
+            f"gunicorn не ответил за {SERVER_START_TIMEOUT} секунд.")
+
+    def stop_server(self, server):
+        """Останавливает gunicorn, дожидаясь завершения его процессов."""
+        server.terminate()
+        try:
+            server.wait(timeout=SERVER_START_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            server.kill()
+            server.wait()
+
+    def run_load(self, workload, variables, options):
+        """
+        Запускает виртуальных пользователей в потоках и собирает замеры.
+
+            Возвращает:
+                tuple: (время прогона в секундах, список замеров
+                (запрос, время, ошибка, статус)).
+
+        """
+        users = options["users"]
+        deadline = (
+            time.monotonic() + options["duration"]
+            if options["duration"] else None)
+        lock = threading.Lock()
+        samples = []
+
+        def virtual_user(number):
+            time.sleep(options["ramp_up"] * number / users)
+            session = requests.Session()
+            user_samples = []
+            for iteration in range(options["iterations"]):
+                if self.stopped.is_set() or (
+                        deadline is not None
+                        and time.monotonic() >= deadline):
+                    break
+                user_samples.extend(self.run_iteration(
+                    session, workload, personalize(
+                        variables, f"{self.run_id}-{number}-{iteration}"),
+                    options["strict"]))
+            with lock:
+                samples.extend(user_samples)
+
+        self.stdout.write(
+            f"Прогон {self.run_id}: пользователей {users}, проходов "
+            f"{options['iterations']}, запросов в проходе {len(workload)}")
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=users) as executor:
+            for future in [
+                executor.submit(virtual_user, number)
+                for number in range(users)
+            ]:
+                future.result()
+        return time.perf_counter() - started, samples
+
+    def run_iteration(self, session, workload, variables, strict=False):
+        """
+        Выполняет запросы коллекции по порядку, сохраняя переменные из
+        ответов. Ошибкой считается статус, отличный от ожидаемого в
+        тесте запроса (или 5xx, если тест его не проверяет), и сбой
+        соединения.
+
+        Успешный ответ на запрос, который должен быть отклонен, значит,
+        что прогон изменил данные, которые коллекция менять не
+        собиралась: о нем пишется предупреждение, а при strict прогон
+        останавливается.
+        """
+        variables = dict(variables)
+        samples = []
+        for request in workload:
+            if self.stopped.is_set():
+                break
+            headers = {
+                key: render(value, variables)
+                for key, value in request["headers"]
+            }
+            if request["auth"] is not None:
+                key, value = request["auth"]
+                headers[key] = render(value, variables)
+            body = request["body"]
+            started = time.perf_counter()
+            try:
+                response = session.request(
+                    request["method"],
+                    render(request["url"], variables),
+                    data=(
+                        None if body is None
+                        else render(body, variables).encode()),
+                    headers=headers,
+                    timeout=REQUEST_TIMEOUT,
+                )
+            except requests.RequestException:
+                samples.append((
+                    request["name"], time.perf_counter() - started,
+                    True, "error"))
+                continue
+            elapsed = time.perf_counter() - started
+            status = response.status_code
+            error = (
+                status >= 500 if request["expected"] is None
+                else status != request["expected"])
+            samples.append((request["name"], elapsed, error, status))
+            if is_unexpected_success(request["expected"], status):
+                self.stderr.write(
+                    f"{request['name']}: ожидался ответ "
+                    f"{request['expected']}, получен {status}.")
+                if strict:
+                    self.stopped.set()
+            if error or not request["extractors"]:
+                continue
+            try:
+                data = response.json()
+            except ValueError:
+                continue
+            for variable, path in request["extractors"]:
+                value = extract(data, path)
+                if value not in (None, ""):
+                    variables[variable] = value
+        return samples
+
+    def build_report(self, workload, samples, wall_time, options):
+        """Сводит замеры по запросам коллекции и по всей нагрузке."""
+        expected = {request["name"]: request["expected"]
+                    for request in workload}
+        grouped = {request["name"]: ([], [0, 0], Counter())
+                   for request in workload}
+        for name, elapsed, error, status in samples:
+            timings, errors, statuses = grouped[name]
+            timings.append(elapsed)
+            errors[0] += error
+            errors[1] += is_unexpected_success(expected[name], status)
+            statuses[str(status)] += 1
+        timings = [elapsed for _, elapsed, _, _ in samples]
+        return {
+            "commit": get_commit(),
+            "created": timezone.now().isoformat(),
+            "users": options["users"],
+            "iterations": options["iterations"],
+            "duration": options["duration"],
+            "workers": options["workers"],
+            "threads": options["threads"],
+            "wall_time": round(wall_time, 2),
+            "total": summarize(
+                timings,
+                sum(error for _, _, error, _ in samples),
+                sum(errors[1] for _, errors, _ in grouped.values()),
+                Counter(str(status) for *_, status in samples),
+                wall_time,
+            ) if samples else None,
+            "requests": {
+                name: summarize(
+                    timings, errors[0], errors[1], statuses, wall_time)
+                for name, (timings, errors, statuses) in grouped.items()
+                if timings
+            },
+        }
+
+    def print_report(self, report):
+        """
+        Печатает таблицу по запросам и гистограмму времени ответа всей
+        нагрузки; с --verbosity 2 — гистограммы каждого запроса.
+        """
+        for name, result in report["requests"].items():
+            self.stdout.write(self.format_row(name, result))
+            if self.verbosity > 1:
+                self.write_histogram(result["histogram"])
+        total = report["total"]
+        if total is None:
+            self.stdout.write("Ни один запрос не выполнен.")
+            return
+        self.stdout.write(
+            f"Всего {total['count']} запросов за {report['wall_time']} с: "
+            f"{total['rps']} запросов/с, p50 {total['p50']} мс, "
+            f"p95 {total['p95']} мс, p99 {total['p99']} мс, "
+            f"ошибок {total['error_rate']:.1%}")
+        if total["unexpected_successes"]:
+            self.stdout.write(self.style.WARNING(
+                f"Из них выполнились запросы, которые должны были быть "
+                f"отклонены: {total['unexpected_successes']}. Такие "
+                f"запросы могли изменить данные в БД."))
+        self.write_histogram(total["histogram"])
+
+    def format_row(self, name, result):
+        """Возвращает строку отчета по запросу коллекции."""
+        row = (
+            f"{name[-60:]:<60} {result['rps']:>7.2f}/с  "
+            f"p50 {result['p50']:>8.2f}  p95 {result['p95']:>8.2f}  "
+            f"p99 {result['p99']:>8.2f} мс"
+        )
+        if result["errors"]:
+            row += (
+                f"  ошибок {result['error_rate']:.0%} "
+                f"{result['statuses']}")
+        if result["unexpected_successes"]:
+            row += "  неожиданный успех"
+        return row
+
+    def write_histogram(self, buckets):
+        """Печатает гистограмму времени ответа столбиками."""
+        largest = max(buckets.values()) or 1
+        for label, count in buckets.items():
+            bar = "#" * round(HISTOGRAM_WIDTH * count / largest)
+            self.stdout.write(f"    {label:>7} мс {count:>7} {bar}")
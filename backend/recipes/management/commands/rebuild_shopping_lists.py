@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F, Sum
+
+from recipes.models import IngredientCount, ShoppingListIngredient
+
+
+class Command(BaseCommand):
+    help = (
+        "Проверка и пересчет суммарных списков покупок по корзинам "
+        "пользователей"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check", action="store_true",
+            help="Только найти расхождения, не пересчитывая списки.")
+        parser.add_argument(
+            "--full", action="store_true",
+            help="Пересчитать списки всех пользователей с нуля.")
+
+    def handle(self, *args, **options):
+        if options["full"]:
+            ShoppingListIngredient.objects.rebuild()
+            self.stdout.write(self.style.SUCCESS(
+                "Все списки покупок пересчитаны."))
+            return
+        expected = {
+            (row["user_id"], row["ingredients_id"]): row["total"]
+            for row in IngredientCount.objects.filter(
+                recipe__shopping_list_recipe__isnull=False,
+            ).values(
+                "ingredients_id",
+                user_id=F("recipe__shopping_list_recipe__user_id"),
+            ).annotate(total=Sum("amount")).order_by().iterator()
+        }
+        stored = {
+            (user_id, ingredient_id): amount
+            for user_id, ingredient_id, amount
+            in ShoppingListIngredient.objects.values_list(
+                "user_id", "ingredient_id", "amount").iterator()
+        }
+        drifted = {
+            user_id
+            for user_id, ingredient_id in expected.keys() | stored.keys()
+            if expected.get((user_id, ingredient_id))
+            != stored.get((user_id, ingredient_id))
+        }
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS(
+                "Списки покупок совпадают с корзинами."))
+            return
+        self.stdout.write(self.style.WARNING(
+            f"Расхождения в списках покупок {len(drifted)} пользователей."))
+        if options["check"]:
+            return
+        ShoppingListIngredient.objects.rebuild(drifted)
+        self.stdout.write(self.style.SUCCESS("Списки покупок пересчитаны."))
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import FavoriteRecipe, Recipe, ShoppingList
+from users.models import CustomUser, Subscription
+
+
+COUNTERS = (
+    (Recipe, "favorites_count", FavoriteRecipe, "recipe"),
+    (Recipe, "in_carts_count", ShoppingList, "recipe"),
+    (CustomUser, "recipes_count", Recipe, "author"),
+    (CustomUser, "followers_count", Subscription, "following"),
+)
+
+
+def actual_count(related_model, field):
+    """Подзапрос с фактическим числом связанных объектов."""
+    return Coalesce(
+        Subquery(
+            related_model.objects.filter(**{field: OuterRef("pk")})
+            .order_by().values(field).annotate(total=Count("pk"))
+            .values("total")
+        ),
+        0,
+    )
+
+
+class Command(BaseCommand):
+    help = "Проверка и пересчет счетчиков избранного, корзин и подписок"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check", action="store_true",
+            help="Только найти расхождения, не исправляя счетчики.")
+
+    def handle(self, *args, **options):
+        for model, counter, related_model, field in COUNTERS:
+            actual = actual_count(related_model, field)
+            drifted = model.objects.annotate(actual=actual).exclude(
+                **{counter: F("actual")})
+            total = drifted.count()
+            name = f"{model._meta.model_name}.{counter}"
+            if not total:
+                self.stdout.write(f"{name}: расхождений нет.")
+                continue
+            if not options["check"]:
+                model.objects.filter(pk__in=drifted.values("pk")).update(
+                    **{counter: actual})
+            self.stdout.write(self.style.WARNING(
+                f"{name}: {'найдено' if options['check'] else 'исправлено'} "
+                f"расхождений {total}."))
@@ -0,0 +1,33 @@
+from django.db import migrations
+
+
+INDEX_NAME = "ingredient_name_upper_prefix"
+
+
+def create_index(apps, schema_editor):
+    # istartswith compiles to UPPER("name"::text) LIKE UPPER('...%') on
+    # PostgreSQL; only a matching expression index with text_pattern_ops
+    # can serve that prefix search.
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(
+        f"CREATE INDEX IF NOT EXISTS {INDEX_NAME} ON recipes_ingredient "
+        "(UPPER(name::text) text_pattern_ops)"
+    )
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(f"DROP INDEX IF EXISTS {INDEX_NAME}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_alter_ingredient_options_alter_recipetag_recipe_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 4.2.9 on 2026-10-18 06:00
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_shopping_list_ingredients(apps, schema_editor):
+    IngredientCount = apps.get_model('recipes', 'IngredientCount')
+    ShoppingListIngredient = apps.get_model(
+        'recipes', 'ShoppingListIngredient')
+    totals = IngredientCount.objects.filter(
+        recipe__shopping_list_recipe__isnull=False,
+    ).values(
+        user_id=models.F('recipe__shopping_list_recipe__user_id'),
+        ingredient_id=models.F('ingredients_id'),
+    ).annotate(total=models.Sum('amount')).order_by()
+    ShoppingListIngredient.objects.bulk_create(
+        (
+            ShoppingListIngredient(
+                user_id=row['user_id'],
+                ingredient_id=row['ingredient_id'],
+                amount=row['total'],
+            )
+            for row in totals.iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0009_ingredient_name_trigram_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShoppingListIngredient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.IntegerField(verbose_name='Количество')),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_list_ingredients', to='recipes.ingredient', verbose_name='Ингредиент')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_list_ingredients', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Ингредиент списка покупок',
+                'verbose_name_plural': 'Ингредиенты списков покупок',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='shoppinglistingredient',
+            constraint=models.UniqueConstraint(fields=('user', 'ingredient'), name='shopping_list_ingredient'),
+        ),
+        migrations.RunPython(
+            fill_shopping_list_ingredients, migrations.RunPython.noop),
+    ]
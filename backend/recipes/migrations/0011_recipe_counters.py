@@ -0,0 +1,50 @@
+# Generated by Django 4.2.9 on 2026-10-18 06:03
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+COUNTERS = (
+    ('recipes.Recipe', 'favorites_count', 'recipes.FavoriteRecipe', 'recipe'),
+    ('recipes.Recipe', 'in_carts_count', 'recipes.ShoppingList', 'recipe'),
+    ('users.CustomUser', 'recipes_count', 'recipes.Recipe', 'author'),
+    ('users.CustomUser', 'followers_count', 'users.Subscription', 'following'),
+)
+
+
+def fill_counters(apps, schema_editor):
+    for model_name, counter, related_name, field in COUNTERS:
+        related_model = apps.get_model(related_name)
+        apps.get_model(model_name).objects.update(**{
+            counter: Coalesce(
+                models.Subquery(
+                    related_model.objects.filter(
+                        **{field: models.OuterRef('pk')}
+                    ).order_by().values(field).annotate(
+                        total=models.Count('pk')).values('total')
+                ),
+                0,
+            )
+        })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_shoppinglistingredient'),
+        ('users', '0003_customuser_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Число добавлений в избранное'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='in_carts_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Число добавлений в список покупок'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
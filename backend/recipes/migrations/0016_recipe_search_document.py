@@ -0,0 +1,59 @@
+# Generated by Django 4.2.9 on 2026-10-18 06:20
+
+from django.db import migrations, models
+
+
+# Copy of foodgram.constants.SEARCH_CONFIG at the time of this migration.
+SEARCH_CONFIG = 'russian'
+
+INDEX_NAME = 'recipe_search_document'
+
+
+def fill_search_documents(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    IngredientCount = apps.get_model('recipes', 'IngredientCount')
+    ingredient_names = {}
+    for recipe_id, name in IngredientCount.objects.values_list(
+            'recipe_id', 'ingredients__name').order_by('id').iterator():
+        ingredient_names.setdefault(recipe_id, []).append(name)
+    recipes = list(Recipe.objects.only('id', 'name', 'text'))
+    for recipe in recipes:
+        recipe.search_document = '\n'.join(
+            [recipe.name, recipe.text] + ingredient_names.get(recipe.id, []))
+    Recipe.objects.bulk_update(
+        recipes, ['search_document'], batch_size=1000)
+
+
+def create_index(apps, schema_editor):
+    # Serves SearchVector("search_document") in api.search.search_recipes.
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        f"CREATE INDEX IF NOT EXISTS {INDEX_NAME} ON recipes_recipe "
+        f"USING gin (to_tsvector('{SEARCH_CONFIG}'::regconfig, "
+        "COALESCE(search_document, '')))"
+    )
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(f"DROP INDEX IF EXISTS {INDEX_NAME}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0015_imageupload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_document',
+            field=models.TextField(blank=True, default='', editable=False, verbose_name='Поисковый документ'),
+        ),
+        migrations.RunPython(
+            fill_search_documents, migrations.RunPython.noop),
+        migrations.RunPython(create_index, drop_index),
+    ]
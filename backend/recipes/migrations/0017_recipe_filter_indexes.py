@@ -0,0 +1,27 @@
+# Generated by Django 4.2.9 on 2026-10-18 06:24
+
+from django.db import migrations, models
+
+
+# Covers the EXISTS probe of RecipeFilter.get_tags when the planner
+# starts from the tags: the auto-created M2M table only has (recipe, tag).
+TAG_INDEX_NAME = 'recipe_tags_tag_recipe'
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0016_recipe_search_document'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['author', 'name', 'id'], name='recipe_author_name_id'),
+        ),
+        migrations.RunSQL(
+            f'CREATE INDEX {TAG_INDEX_NAME} '
+            'ON recipes_recipe_tags (tag_id, recipe_id)',
+            f'DROP INDEX {TAG_INDEX_NAME}',
+        ),
+    ]
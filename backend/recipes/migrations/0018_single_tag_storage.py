@@ -0,0 +1,115 @@
+# Generated by Django 4.2.9 on 2026-10-18 06:26
+
+from django.db import migrations, models
+
+
+# Copy of foodgram.constants.MAX_TAGS at the time of this migration.
+MAX_TAGS = 63
+
+
+def assign_tag_bits(apps, schema_editor):
+    Tag = apps.get_model('recipes', 'Tag')
+    tags = list(Tag.objects.order_by('id'))
+    if len(tags) > MAX_TAGS:
+        raise ValueError(f'Tags bitmask holds at most {MAX_TAGS} tags.')
+    for bit, tag in enumerate(tags):
+        tag.bit = bit
+    Tag.objects.bulk_update(tags, ['bit'])
+
+
+def merge_recipe_tags(apps, schema_editor):
+    # Tags set through the API live in the auto-created M2M table and
+    # tags set in the admin live in RecipeTag: keep both.
+    Recipe = apps.get_model('recipes', 'Recipe')
+    RecipeTag = apps.get_model('recipes', 'RecipeTag')
+    RecipeTag.objects.bulk_create(
+        [
+            RecipeTag(recipe_id=recipe_id, tag_id=tag_id)
+            for recipe_id, tag_id in Recipe.tags.through.objects.values_list(
+                'recipe_id', 'tag_id').iterator()
+        ],
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+
+
+def restore_recipe_tags(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    RecipeTag = apps.get_model('recipes', 'RecipeTag')
+    Recipe.tags.through.objects.bulk_create(
+        [
+            Recipe.tags.through(recipe_id=recipe_id, tag_id=tag_id)
+            for recipe_id, tag_id in RecipeTag.objects.values_list(
+                'recipe_id', 'tag_id').iterator()
+        ],
+        batch_size=1000,
+    )
+
+
+def fill_tags_masks(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    RecipeTag = apps.get_model('recipes', 'RecipeTag')
+    masks = {}
+    for recipe_id, bit in RecipeTag.objects.values_list(
+            'recipe_id', 'tag__bit').iterator():
+        masks[recipe_id] = masks.get(recipe_id, 0) | 1 << bit
+    Recipe.objects.bulk_update(
+        [
+            Recipe(id=recipe_id, tags_mask=mask)
+            for recipe_id, mask in masks.items()
+        ],
+        ['tags_mask'],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0017_recipe_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tag',
+            name='bit',
+            field=models.PositiveSmallIntegerField(editable=False, null=True, verbose_name='Бит в маске тегов'),
+        ),
+        migrations.RunPython(assign_tag_bits, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='tag',
+            name='bit',
+            field=models.PositiveSmallIntegerField(editable=False, unique=True, verbose_name='Бит в маске тегов'),
+        ),
+        migrations.RunPython(merge_recipe_tags, restore_recipe_tags),
+        # The (tag, recipe) index from 0017 goes away with the M2M table;
+        # it is rebuilt when the table comes back on reverse, so that
+        # reversing 0017 finds it.
+        migrations.RunSQL(
+            'DROP INDEX recipe_tags_tag_recipe',
+            'CREATE INDEX recipe_tags_tag_recipe '
+            'ON recipes_recipe_tags (tag_id, recipe_id)',
+        ),
+        # Django cannot add through= to an existing M2M field, so the
+        # auto-created table is dropped and the field is re-added on
+        # top of RecipeTag.
+        migrations.RemoveField(
+            model_name='recipe',
+            name='tags',
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='tags',
+            field=models.ManyToManyField(related_name='recipes', through='recipes.RecipeTag', to='recipes.tag', verbose_name='Теги'),
+        ),
+        migrations.AddIndex(
+            model_name='recipetag',
+            index=models.Index(fields=['tag', 'recipe'], name='recipe_tag_tag_recipe'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='tags_mask',
+            field=models.BigIntegerField(default=0, editable=False, verbose_name='Маска тегов'),
+        ),
+        migrations.RunPython(fill_tags_masks, migrations.RunPython.noop),
+    ]
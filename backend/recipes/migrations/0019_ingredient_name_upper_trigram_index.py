@@ -0,0 +1,34 @@
+from django.db import migrations
+
+
+INDEX_NAME = "ingredient_name_upper_trigram"
+
+
+def create_index(apps, schema_editor):
+    # icontains compiles to UPPER("name"::text) LIKE UPPER('%...%') on
+    # PostgreSQL; the trigram index on the plain column only serves the
+    # word similarity operator, so the substring match needs its own
+    # expression index.
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(
+        f"CREATE INDEX IF NOT EXISTS {INDEX_NAME} ON recipes_ingredient "
+        "USING gin (UPPER(name::text) gin_trgm_ops)"
+    )
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(f"DROP INDEX IF EXISTS {INDEX_NAME}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0018_single_tag_storage'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -1,16 +1,24 @@
+import uuid
+
+from django.core.exceptions import ValidationError
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models
-from django.db.models import UniqueConstraint
+from django.db import models, transaction
+from django.db.models import Case, F, Sum, UniqueConstraint, Value, When
 
 from colorfield import fields
 
 from foodgram.constants import (
+    FEED_BACKFILL,
+    FEED_BATCH_SIZE,
+    FEED_FANOUT_LIMIT,
+    IMPORT_BATCH_SIZE,
     MAX_AMOUNT,
     MAX_COOKING_TIME,
+    MAX_TAGS,
     MIN_AMOUNT,
     MIN_COOKING_TIME,
 )
-from users.models import CustomUser
+from users.models import CustomUser, Subscription
 
 
 class Ingredient(models.Model):
@@ -52,6 +60,11 @@ class Tag(models.Model):
         unique=True,
     )
     slug = models.SlugField(verbose_name="Слаг", max_length=200, unique=True)
+    bit = models.PositiveSmallIntegerField(
+        verbose_name="Бит в маске тегов",
+        unique=True,
+        editable=False,
+    )
 
     class Meta:
         ordering = ("id",)
@@ -61,6 +74,102 @@ class Tag(models.Model):
     def __str__(self):
         return self.name
 
+    @property
+    def mask(self):
+        """Маска тега в Recipe.tags_mask."""
+        return 1 << self.bit
+
+    @staticmethod
+    def get_free_bit():
+        """
+        Возвращает младший свободный бит маски тегов. Маска хранится
+        в BigIntegerField, поэтому тегов не больше MAX_TAGS.
+        """
+        used = set(Tag.objects.values_list("bit", flat=True))
+        for bit in range(MAX_TAGS):
+            if bit not in used:
+                return bit
+        raise ValidationError(f"Нельзя создать больше {MAX_TAGS} тегов.")
+
+    def clean(self):
+        if self.bit is None:
+            self.get_free_bit()
+
+    def save(self, *args, **kwargs):
+        if self.bit is None:
+            self.bit = self.get_free_bit()
+        super().save(*args, **kwargs)
+
+
+class RecipeQuerySet(models.QuerySet):
+    """Набор запросов для рецептов с флагами текущего пользователя."""
+
+    def with_related(self):
+        """
+        Подгружает автора, теги и ингредиенты рецепта вместе с данными
+        самих ингредиентов, чтобы сериализация не делала запросов
+        на каждый рецепт.
+        """
+        return self.select_related("author").prefetch_related(
+            "tags",
+            models.Prefetch(
+                "ingredient_count_recipe",
+                queryset=IngredientCount.objects.select_related(
+                    "ingredients"),
+            ),
+        )
+
+    def update_search_documents(self):
+        """
+        Пересобирает поисковые документы рецептов: название, описание
+        и наименования ингредиентов одной строкой.
+        """
+        recipes = list(self.only("id", "name", "text"))
+        ingredient_names = {}
+        for recipe_id, name in IngredientCount.objects.filter(
+                recipe__in=recipes).values_list(
+                    "recipe_id", "ingredients__name").order_by("id"):
+            ingredient_names.setdefault(recipe_id, []).append(name)
+        for recipe in recipes:
+            recipe.search_document = "\n".join(
+                [recipe.name, recipe.text]
+                + ingredient_names.get(recipe.id, []))
+        Recipe.objects.bulk_update(
+            recipes, ["search_document"], batch_size=IMPORT_BATCH_SIZE)
+
+    def update_tags_masks(self):
+        """
+        Пересчитывает маски тегов рецептов по их связям с тегами в
+        RecipeTag.
+        """
+        recipes = list(self.only("id"))
+        masks = {}
+        for recipe_id, bit in RecipeTag.objects.filter(
+                recipe__in=recipes).values_list("recipe_id", "tag__bit"):
+            masks[recipe_id] = masks.get(recipe_id, 0) | 1 << bit
+        for recipe in recipes:
+            recipe.tags_mask = masks.get(recipe.id, 0)
+        Recipe.objects.bulk_update(
+            recipes, ["tags_mask"], batch_size=IMPORT_BATCH_SIZE)
+
+    def with_user_flags(self, user):
+        """
+        Добавляет к рецептам признаки is_favorited и is_in_shopping_cart
+        одним запросом. Для анонимного пользователя признаки константны
+        и не требуют обращения к БД.
+        """
+        if user.is_anonymous:
+            return self.annotate(
+                is_favorited=models.Value(False),
+                is_in_shopping_cart=models.Value(False),
+            )
+        return self.annotate(
+            is_favorited=models.Exists(FavoriteRecipe.objects.filter(
+                user=user, recipe=models.OuterRef("pk"))),
+            is_in_shopping_cart=models.Exists(ShoppingList.objects.filter(
+                user=user, recipe=models.OuterRef("pk"))),
+        )
+
 
 class Recipe(models.Model):
     """Модель рецептов."""
@@ -79,6 +188,7 @@ class Recipe(models.Model):
     )
     tags = models.ManyToManyField(
         Tag,
+        through="RecipeTag",
         related_name="recipes",
         verbose_name="Теги")
     image = models.ImageField(
@@ -101,11 +211,58 @@ class Recipe(models.Model):
         blank=False,
     )
     pub_date = models.DateTimeField("Дата публикации", auto_now_add=True)
+    image_variants = models.JSONField(
+        verbose_name="Уменьшенные копии картинки",
+        default=dict,
+        editable=False,
+    )
+    search_document = models.TextField(
+        verbose_name="Поисковый документ",
+        blank=True,
+        default="",
+        editable=False,
+    )
+    tags_mask = models.BigIntegerField(
+        verbose_name="Маска тегов",
+        default=0,
+        editable=False,
+    )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name="Число добавлений в избранное",
+        default=0,
+        editable=False,
+    )
+    in_carts_count = models.PositiveIntegerField(
+        verbose_name="Число добавлений в список покупок",
+        default=0,
+        editable=False,
+    )
+
+    objects = RecipeQuerySet.as_manager()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Картинка при загрузке из БД: по ней после сохранения
+        # освобождается файл замененной картинки.
+        instance._loaded_image = dict(zip(field_names, values)).get("image")
+        return instance
 
     class Meta:
-        ordering = ("name",)
+        ordering = ("name", "id")
         verbose_name = "Рецепт"
         verbose_name_plural = "Рецепты"
+        indexes = [
+            models.Index(fields=("name", "id"), name="recipe_name_id"),
+            models.Index(
+                fields=("author", "name", "id"),
+                name="recipe_author_name_id",
+            ),
+            models.Index(
+                fields=("author", "-pub_date", "-id"),
+                name="recipe_author_pub_date",
+            ),
+        ]
 
     def __str__(self):
         return self.name
@@ -116,6 +273,9 @@ class RecipeTag(models.Model):
     RecipeTag - это класс модели, который представляет связь между рецептами и
     тегами в приложении.Он содержит два ForeignKey, которые связывают его с
     моделями Recipe и Tag.
+
+    Это промежуточная модель Recipe.tags: теги из API и из админки
+    хранятся в одной таблице, а Recipe.tags_mask повторяет ее строки.
     """
 
     recipe = models.ForeignKey(
@@ -133,6 +293,10 @@ class RecipeTag(models.Model):
 
     class Meta:
         unique_together = ("recipe", "tag")
+        indexes = [
+            models.Index(
+                fields=("tag", "recipe"), name="recipe_tag_tag_recipe"),
+        ]
 
     def __str__(self) -> str:
         return f"{self.recipe} {self.tag}"
@@ -244,3 +408,346 @@ class ShoppingList(models.Model):
             f"рецепт- {self.recipe.name}"
             f"добавлен в список покупок к   {self.user.username}"
         )
+
+
+class ShoppingListIngredientManager(models.Manager):
+    """
+    Менеджер суммарного списка покупок. Поддерживает суммы ингредиентов
+    в актуальном состоянии при изменении корзины и рецептов.
+    """
+
+    def change_amounts(self, user_ids, amounts):
+        """
+        Прибавляет к спискам покупок пользователей изменения количеств
+        ингредиентов и удаляет строки, количество в которых стало нулевым.
+
+            Параметры:
+                user_ids (Iterable[int]): id пользователей.
+                amounts (dict): id ингредиента -> изменение количества.
+
+        """
+        amounts = {
+            ingredient_id: amount
+            for ingredient_id, amount in amounts.items() if amount
+        }
+        user_ids = list(user_ids)
+        if not user_ids or not amounts:
+            return
+        with transaction.atomic():
+            list(CustomUser.objects.select_for_update().filter(
+                id__in=user_ids).order_by("id").values_list("id"))
+            self.bulk_create(
+                [
+                    self.model(
+                        user_id=user_id, ingredient_id=ingredient_id, amount=0)
+                    for user_id in user_ids
+                    for ingredient_id, amount in amounts.items() if amount > 0
+                ],
+                ignore_conflicts=True,
+            )
+            rows = self.filter(user_id__in=user_ids)
+            rows.filter(ingredient_id__in=amounts).update(
+                amount=F("amount") + Case(
+                    *(When(ingredient_id=ingredient_id, then=Value(amount))
+                      for ingredient_id, amount in amounts.items()),
+                    output_field=models.IntegerField(),
+                ))
+            rows.filter(amount__lte=0).delete()
+
+    def add_recipe(self, user_ids, recipe, sign=1):
+        """Добавляет ингредиенты рецепта в списки покупок пользователей."""
+        self.change_amounts(user_ids, {
+            ingredient_id: sign * amount
+            for ingredient_id, amount in IngredientCount.objects.filter(
+                recipe=recipe).values_list("ingredients_id", "amount")
+        })
+
+    def remove_recipe(self, user_ids, recipe):
+        """Убирает ингредиенты рецепта из списков покупок пользователей."""
+        self.add_recipe(user_ids, recipe, sign=-1)
+
+    def rebuild(self, user_ids=None):
+        """
+        Пересчитывает списки покупок пользователей с нуля по их корзинам.
+        Без user_ids пересчитывает списки всех пользователей.
+        """
+        rows = self.all()
+        carts = {"recipe__shopping_list_recipe__isnull": False}
+        if user_ids is not None:
+            rows = rows.filter(user_id__in=user_ids)
+            carts = {"recipe__shopping_list_recipe__user_id__in": user_ids}
+        totals = IngredientCount.objects.filter(**carts).values(
+            user_id=F("recipe__shopping_list_recipe__user_id"),
+            ingredient_id=F("ingredients_id"),
+        ).annotate(total=Sum("amount")).order_by()
+        with transaction.atomic():
+            rows.delete()
+            self.bulk_create(
+                (
+                    self.model(
+                        user_id=row["user_id"],
+                        ingredient_id=row["ingredient_id"],
+                        amount=row["total"],
+                    )
+                    for row in totals.iterator()
+                ),
+                batch_size=1000,
+            )
+
+
+class ShoppingListIngredient(models.Model):
+    """
+    Модель суммарного количества ингредиента в списке покупок
+    пользователя. Обновляется при изменении корзины и рецептов в ней.
+    """
+
+    user = models.ForeignKey(
+        CustomUser,
+        on_delete=models.CASCADE,
+        verbose_name="Пользователь",
+        related_name="shopping_list_ingredients",
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        verbose_name="Ингредиент",
+        related_name="shopping_list_ingredients",
+    )
+    amount = models.IntegerField(verbose_name="Количество")
+
+    objects = ShoppingListIngredientManager()
+
+    class Meta:
+        verbose_name = "Ингредиент списка покупок"
+        verbose_name_plural = "Ингредиенты списков покупок"
+        constraints = [
+            models.UniqueConstraint(
+                fields=("user", "ingredient"),
+                name="shopping_list_ingredient",
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.user} {self.ingredient} {self.amount}"
+
+
+class FeedEntryManager(models.Manager):
+    """
+    Менеджер лент рецептов подписок.
+
+    Новые рецепты автора записываются в ленты всех его подписчиков
+    при создании. Рецепты авторов, у которых не меньше FEED_FANOUT_LIMIT
+    подписчиков, в ленты не пишутся, а подмешиваются при чтении. Когда
+    число подписчиков автора переходит через FEED_FANOUT_LIMIT, ленты
+    его подписчиков приводятся к новому режиму (followers_changed).
+    """
+
+    def fan_out(self, recipe):
+        """Записывает новый рецепт в ленты подписчиков его автора."""
+        if CustomUser.objects.filter(
+                pk=recipe.author_id,
+                followers_count__gte=FEED_FANOUT_LIMIT).exists():
+            return
+        followers = Subscription.objects.filter(
+            following_id=recipe.author_id).values_list("user_id", flat=True)
+        self.bulk_create(
+            (
+                self.model(
+                    user_id=user_id,
+                    recipe_id=recipe.id,
+                    author_id=recipe.author_id,
+                    pub_date=recipe.pub_date,
+                )
+                for user_id in followers.iterator()
+            ),
+            batch_size=FEED_BATCH_SIZE,
+            ignore_conflicts=True,
+        )
+
+    def add_author(self, user_id, author_id):
+        """
+        Добавляет в ленту пользователя последние FEED_BACKFILL рецептов
+        автора, на которого он подписался.
+        """
+        if CustomUser.objects.filter(
+                pk=author_id, followers_count__gte=FEED_FANOUT_LIMIT).exists():
+            return
+        self.backfill(author_id, [user_id])
+
+    def backfill(self, author_id, user_ids):
+        """
+        Добавляет в ленты пользователей user_ids последние FEED_BACKFILL
+        рецептов автора. Уже записанные рецепты пропускаются.
+        """
+        recipes = list(Recipe.objects.filter(author_id=author_id).order_by(
+            "-pub_date", "-id").values_list("id", "pub_date")[:FEED_BACKFILL])
+        self.bulk_create(
+            (
+                self.model(
+                    user_id=user_id,
+                    recipe_id=recipe_id,
+                    author_id=author_id,
+                    pub_date=pub_date,
+                )
+                for user_id in user_ids
+                for recipe_id, pub_date in recipes
+            ),
+            batch_size=FEED_BATCH_SIZE,
+            ignore_conflicts=True,
+        )
+
+    def followers_changed(self, author_id, delta):
+        """
+        Приводит ленты подписчиков автора к новому режиму, если после
+        изменения followers_count на delta он перешел через
+        FEED_FANOUT_LIMIT.
+
+        Ставший популярным автор подмешивается в ленты при чтении, и его
+        записи из лент удаляются. Переставшему быть популярным автору
+        подписчики, чьи ленты его рецептов не получали, дописываются,
+        как при новой подписке. Вызывается в транзакции, изменившей
+        счетчик: блокировка строки автора при его изменении упорядочивает
+        параллельные подписки, и каждая видит свое значение.
+        """
+        count = CustomUser.objects.filter(pk=author_id).values_list(
+            "followers_count", flat=True).first()
+        if delta > 0 and count == FEED_FANOUT_LIMIT:
+            self.filter(author_id=author_id).delete()
+        elif delta < 0 and count == FEED_FANOUT_LIMIT - 1:
+            self.backfill(author_id, Subscription.objects.filter(
+                following_id=author_id).values_list("user_id", flat=True))
+
+    def remove_author(self, user_id, author_id):
+        """Убирает из ленты пользователя рецепты автора."""
+        self.filter(user_id=user_id, author_id=author_id).delete()
+
+    def rebuild(self, user_ids=None):
+        """
+        Собирает ленты пользователей заново по их подпискам.
+        Без user_ids пересобирает ленты всех пользователей.
+        """
+        subscriptions = Subscription.objects.filter(
+            following__followers_count__lt=FEED_FANOUT_LIMIT)
+        rows = self.all()
+        if user_ids is not None:
+            subscriptions = subscriptions.filter(user_id__in=user_ids)
+            rows = rows.filter(user_id__in=user_ids)
+        with transaction.atomic():
+            rows.delete()
+            for user_id, author_id in subscriptions.values_list(
+                    "user_id", "following_id").iterator():
+                self.add_author(user_id, author_id)
+
+    def page(self, user, before=None, limit=None):
+        """
+        Возвращает id рецептов страницы ленты пользователя.
+
+        Читает не больше limit строк из ленты по индексу
+        (user, -pub_date, -recipe) и столько же последних рецептов
+        популярных авторов из подписок, затем сливает их.
+
+            Параметры:
+                user (User): Владелец ленты.
+                before (tuple): (pub_date, id) последнего рецепта
+                    предыдущей страницы или None для первой страницы.
+                limit (int): Число рецептов на странице.
+
+            Возвращает:
+                list: id рецептов от новых к старым.
+
+        """
+        timeline = self.filter(user=user).order_by("-pub_date", "-recipe_id")
+        popular = Recipe.objects.filter(author__in=CustomUser.objects.filter(
+            following__user=user, followers_count__gte=FEED_FANOUT_LIMIT,
+        )).order_by("-pub_date", "-id")
+        if before is not None:
+            pub_date, recipe_id = before
+            timeline = timeline.filter(
+                models.Q(pub_date__lt=pub_date)
+                | models.Q(pub_date=pub_date, recipe_id__lt=recipe_id))
+            popular = popular.filter(
+                models.Q(pub_date__lt=pub_date)
+                | models.Q(pub_date=pub_date, id__lt=recipe_id))
+        entries = set(timeline.values_list("pub_date", "recipe_id")[:limit])
+        entries.update(popular.values_list("pub_date", "id")[:limit])
+        return [
+            recipe_id
+            for _, recipe_id in sorted(entries, reverse=True)[:limit]
+        ]
+
+
+class FeedEntry(models.Model):
+    """
+    Модель записи ленты: рецепт автора, на которого подписан
+    пользователь. Дата публикации копируется из рецепта, чтобы страница
+    ленты читалась только по индексу.
+    """
+
+    user = models.ForeignKey(
+        CustomUser,
+        on_delete=models.CASCADE,
+        verbose_name="Пользователь",
+        related_name="feed_entries",
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        verbose_name="Рецепт",
+        related_name="feed_entries",
+    )
+    author = models.ForeignKey(
+        CustomUser,
+        on_delete=models.CASCADE,
+        verbose_name="Автор",
+        related_name="+",
+    )
+    pub_date = models.DateTimeField("Дата публикации")
+
+    objects = FeedEntryManager()
+
+    class Meta:
+        verbose_name = "Запись ленты"
+        verbose_name_plural = "Записи лент"
+        constraints = [
+            models.UniqueConstraint(
+                fields=("user", "recipe"), name="feed_entry_user_recipe"
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=("user", "-pub_date", "-recipe"),
+                name="feed_entry_timeline",
+            ),
+            models.Index(
+                fields=("user", "author"), name="feed_entry_user_author"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user} {self.recipe}"
+
+
+class ImageUpload(models.Model):
+    """
+    Модель картинки, загруженной отдельно от рецепта. Картинка
+    привязывается к рецепту по токену при его создании или изменении.
+    """
+
+    token = models.UUIDField(
+        verbose_name="Токен", default=uuid.uuid4, unique=True, editable=False
+    )
+    user = models.ForeignKey(
+        CustomUser,
+        on_delete=models.CASCADE,
+        verbose_name="Пользователь",
+        related_name="image_uploads",
+    )
+    image = models.ImageField(upload_to="recipes/", verbose_name="Картинка")
+    created = models.DateTimeField("Дата загрузки", auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Загруженная картинка"
+        verbose_name_plural = "Загруженные картинки"
+
+    def __str__(self):
+        return f"{self.user} {self.image.name}"
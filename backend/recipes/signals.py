@@ -0,0 +1,186 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete,
+    pre_save,
+)
+from django.dispatch import receiver
+
+from recipes.images import (
+    normalize_original,
+    release_image,
+    schedule_image_variants,
+)
+from recipes.models import (
+    FavoriteRecipe,
+    FeedEntry,
+    ImageUpload,
+    Recipe,
+    RecipeTag,
+    ShoppingList,
+    ShoppingListIngredient,
+    Tag,
+)
+from users.models import CustomUser, Subscription
+
+
+COUNTERS = {
+    Recipe: (CustomUser, "author_id", "recipes_count"),
+    FavoriteRecipe: (Recipe, "recipe_id", "favorites_count"),
+    ShoppingList: (Recipe, "recipe_id", "in_carts_count"),
+    Subscription: (CustomUser, "following_id", "followers_count"),
+}
+
+
+def change_counter(instance, delta):
+    """
+    Атомарно меняет счетчик объекта, на который ссылается instance.
+    Счетчик не опускается ниже нуля.
+    """
+    model, field, counter = COUNTERS[type(instance)]
+    rows = model.objects.filter(pk=getattr(instance, field))
+    if delta < 0:
+        rows = rows.filter(**{f"{counter}__gte": -delta})
+    rows.update(**{counter: F(counter) + delta})
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=FavoriteRecipe)
+@receiver(post_save, sender=ShoppingList)
+@receiver(post_save, sender=Subscription)
+def increment_counter(sender, instance, created, **kwargs):
+    """Увеличивает счетчик при создании связи."""
+    if created:
+        change_counter(instance, 1)
+
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=FavoriteRecipe)
+@receiver(post_delete, sender=ShoppingList)
+@receiver(post_delete, sender=Subscription)
+def decrement_counter(sender, instance, **kwargs):
+    """Уменьшает счетчик при удалении связи."""
+    change_counter(instance, -1)
+
+
+@receiver(post_save, sender=Subscription)
+def follower_added(sender, instance, created, **kwargs):
+    """
+    Проверяет, не стал ли автор популярным для лент. Выполняется после
+    увеличения счетчика подписчиков.
+    """
+    if created:
+        FeedEntry.objects.followers_changed(instance.following_id, 1)
+
+
+@receiver(post_delete, sender=Subscription)
+def follower_removed(sender, instance, **kwargs):
+    """
+    Проверяет, не перестал ли автор быть популярным для лент.
+    Выполняется после уменьшения счетчика подписчиков.
+    """
+    FeedEntry.objects.followers_changed(instance.following_id, -1)
+
+
+@receiver(post_save, sender=Recipe)
+def push_recipe_to_feeds(sender, instance, created, **kwargs):
+    """Записывает новый рецепт в ленты подписчиков автора."""
+    if created:
+        FeedEntry.objects.fan_out(instance)
+
+
+@receiver(post_save, sender=Recipe)
+def build_image_variants(sender, instance, **kwargs):
+    """Ставит в очередь уменьшенные копии новой картинки рецепта."""
+    if instance.image and (
+            instance.image_variants.get("source") != instance.image.name):
+        schedule_image_variants(instance.id)
+
+
+@receiver(post_save, sender=Recipe)
+def release_replaced_image(sender, instance, **kwargs):
+    """Освобождает файл картинки, которую заменили в рецепте."""
+    loaded_image = getattr(instance, "_loaded_image", None)
+    if loaded_image and loaded_image != instance.image.name:
+        image_variants = instance.image_variants
+        transaction.on_commit(
+            lambda: release_image(loaded_image, image_variants))
+    instance._loaded_image = instance.image.name
+
+
+@receiver(pre_save, sender=Recipe)
+@receiver(pre_save, sender=ImageUpload)
+def normalize_new_image(sender, instance, **kwargs):
+    """
+    Нормализует новую картинку перед записью в хранилище: в нем
+    хранится уже повернутая, уменьшенная и очищенная от метаданных
+    картинка.
+    """
+    if instance.image and not instance.image._committed:
+        instance.image = normalize_original(instance.image)
+
+
+@receiver(post_delete, sender=Recipe)
+def release_recipe_image(sender, instance, **kwargs):
+    """Освобождает файл картинки удаленного рецепта."""
+    transaction.on_commit(lambda: release_image(
+        instance.image.name, instance.image_variants))
+
+
+@receiver(post_delete, sender=ImageUpload)
+def release_uploaded_image(sender, instance, **kwargs):
+    """Освобождает файл картинки удаленной загрузки."""
+    transaction.on_commit(lambda: release_image(instance.image.name))
+
+
+@receiver(pre_delete, sender=Recipe)
+def remove_recipe_from_shopping_lists(sender, instance, **kwargs):
+    """Убирает ингредиенты удаляемого рецепта из списков покупок."""
+    ShoppingListIngredient.objects.remove_recipe(
+        ShoppingList.objects.filter(recipe=instance).values_list(
+            "user_id", flat=True),
+        instance,
+    )
+
+
+@receiver(m2m_changed, sender=RecipeTag)
+def recipe_tags_added(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Выставляет в масках тегов биты добавленных тегов. Удаление связей
+    идет через RecipeTag.delete и обрабатывается в recipe_tag_deleted.
+    """
+    if action != "post_add":
+        return
+    if reverse:
+        recipes = Recipe.objects.filter(pk__in=pk_set)
+        mask = instance.mask
+    else:
+        recipes = Recipe.objects.filter(pk=instance.pk)
+        mask = 0
+        for bit in Tag.objects.filter(pk__in=pk_set).values_list(
+                "bit", flat=True):
+            mask |= 1 << bit
+    recipes.update(tags_mask=F("tags_mask").bitor(mask))
+
+
+@receiver(post_save, sender=RecipeTag)
+def recipe_tag_saved(sender, instance, created, **kwargs):
+    """
+    Переносит в маску тегов связь рецепта с тегом, сохраненную
+    отдельно, например из админки.
+    """
+    recipes = Recipe.objects.filter(pk=instance.recipe_id)
+    if created:
+        recipes.update(tags_mask=F("tags_mask").bitor(instance.tag.mask))
+    else:
+        recipes.update_tags_masks()
+
+
+@receiver(post_delete, sender=RecipeTag)
+def recipe_tag_deleted(sender, instance, **kwargs):
+    """Сбрасывает в маске тегов рецепта бит удаленной связи с тегом."""
+    Recipe.objects.filter(pk=instance.recipe_id).update(
+        tags_mask=F("tags_mask").bitand(~instance.tag.mask))
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.9 on 2026-10-18 06:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_customuser_counters'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customuser',
+            index=models.Index(fields=['-recipes_count', 'id'], name='user_recipes_count_id'),
+        ),
+    ]
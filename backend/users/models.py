@@ -31,6 +31,16 @@ class CustomUser(AbstractUser):
         verbose_name="Пароль",
         max_length=150
     )
+    recipes_count = models.PositiveIntegerField(
+        verbose_name="Число рецептов",
+        default=0,
+        editable=False
+    )
+    followers_count = models.PositiveIntegerField(
+        verbose_name="Число подписчиков",
+        default=0,
+        editable=False
+    )
 
     USERNAME_FIELD = "email"
     REQUIRED_FIELDS = ("username", "first_name", "last_name")
@@ -39,6 +49,12 @@ class CustomUser(AbstractUser):
         ordering = ["id"]
         verbose_name = "Пользователь"
         verbose_name_plural = "Пользователи"
+        indexes = [
+            models.Index(
+                fields=("-recipes_count", "id"),
+                name="user_recipes_count_id",
+            ),
+        ]
 
     def __str__(self):
         return self.username